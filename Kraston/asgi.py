@@ -3,6 +3,10 @@ ASGI config for Kraston project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with uvicorn workers to run the async/ end points natively:
+
+    gunicorn Kraston.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -11,6 +15,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from users.timeouts import limit_request_statements
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Kraston.settings')
 
 application = get_asgi_application()
+
+# only the processes serving requests cap their statements
+limit_request_statements()
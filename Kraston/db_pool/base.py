@@ -0,0 +1,269 @@
+"""
+PostgreSQL backend keeping a pool of open connections per worker process.
+
+Django (5.0, psycopg2) either opens a new connection per request or keeps
+one persistent connection per thread. This backend keeps up to
+POOL["MAX_SIZE"] idle connections per database alias and process: closing
+a Django connection returns it to the pool, opening one takes the most
+recently used idle connection. Connections idle for longer than
+POOL["HEALTH_CHECK_AFTER"] seconds are checked with a `SELECT 1` before
+being handed out and connections older than POOL["MAX_LIFETIME"] seconds
+are closed instead of being reused.
+
+Pools are keyed by connection parameters, not by alias: a connection is
+never handed out for another database (the test runner renames NAME), and
+the session state of a connection (SET, temporary tables, prepared
+statements) is discarded before it is reused.
+"""
+
+import collections
+import os
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError
+from django.db.backends.postgresql import base, creation
+from psycopg2 import extensions
+
+DEFAULT_POOL = {
+    "MAX_SIZE": 10,
+    "MAX_LIFETIME": 3600,
+    "HEALTH_CHECK_AFTER": 30,
+    "TIMEOUT": 30,
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of at most `max_size` raw psycopg2 connections.
+    """
+
+    def __init__(self, max_size, max_lifetime, health_check_after, timeout):
+        if max_size < 1:
+            raise ImproperlyConfigured("POOL['MAX_SIZE'] must be at least 1.")
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.size = 0
+        # (connection, created_at, returned_at), most recently used last
+        self.idle = collections.deque()
+        self.created_at = {}
+        self.condition = threading.Condition()
+
+    def get(self, connect):
+        """
+        Take an idle connection, or open one with `connect()` while the pool
+        is not full.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s "
+                            f"({self.max_size} in use)."
+                        )
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, created_at, returned_at = self.idle.pop()
+                else:
+                    self.size += 1
+                    connection = None
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    self.discard(None)
+                    raise
+                self.created_at[id(connection)] = time.monotonic()
+                return connection
+
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime or not self.is_healthy(
+                connection, now - returned_at
+            ):
+                self.discard(connection)
+                continue
+            self.created_at[id(connection)] = created_at
+            return connection
+
+    def is_healthy(self, connection, idle_for):
+        if connection.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            # leave no transaction open when autocommit is off
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def put(self, connection):
+        """
+        Give back a connection taken with get(). Broken, busy or expired
+        connections are closed, the others are reset to their startup state.
+        """
+        created_at = self.created_at.pop(id(connection), None)
+        now = time.monotonic()
+        if (
+            created_at is None
+            or connection.closed
+            or now - created_at > self.max_lifetime
+            or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+            or not self.reset(connection)
+        ):
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, created_at, now))
+            self.condition.notify()
+
+    @staticmethod
+    def reset(connection):
+        """
+        Drop the session state a request left (SET, temporary tables,
+        cursors, prepared statements), startup options are kept.
+        """
+        try:
+            # DISCARD ALL can't run in a transaction block
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute("DISCARD ALL")
+            return True
+        except Exception:
+            return False
+
+    def discard(self, connection):
+        if connection is not None:
+            self.created_at.pop(id(connection), None)
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, collections.deque()
+        for connection, _, _ in idle:
+            self.discard(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool_key(conn_params):
+    return tuple(sorted((name, repr(value)) for name, value in conn_params.items()))
+
+
+def get_pool(settings_dict, conn_params):
+    """
+    Pool of the connections opened with `conn_params` in this process.
+    """
+    key = get_pool_key(conn_params)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                options = {**DEFAULT_POOL, **settings_dict.get("POOL", {})}
+                pool = _pools[key] = ConnectionPool(
+                    max_size=int(options["MAX_SIZE"]),
+                    max_lifetime=float(options["MAX_LIFETIME"]),
+                    health_check_after=float(options["HEALTH_CHECK_AFTER"]),
+                    timeout=float(options["TIMEOUT"]),
+                )
+    return pool
+
+
+def close_pools():
+    """
+    Close the idle connections of every pool, e.g. before forking or
+    dropping a database.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+def _forget_pools():
+    """
+    Start a forked child with pools of its own, without closing the
+    connections of the parent (closing would end their sessions).
+    """
+    global _pools, _pools_lock
+    _pools, _pools_lock = {}, threading.Lock()
+
+
+# idle connections are closed in the parent so that no socket is shared,
+# connections checked out at the time of the fork stay with the parent
+os.register_at_fork(before=close_pools, after_in_child=_forget_pools)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Test databases can't be created from a template or dropped while idle
+    pooled connections are open on them.
+    """
+
+    def _create_test_db(self, *args, **kwargs):
+        close_pools()
+        return super()._create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, *args, **kwargs):
+        close_pools()
+        super()._destroy_test_db(*args, **kwargs)
+        close_pools()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        if self.timezone_name:
+            # a startup option survives DISCARD ALL, the time zone isn't set
+            # again by a query each time the connection is reused
+            options = conn_params.get("options", "")
+            conn_params["options"] = f"{options} -c TimeZone={self.timezone_name}".strip()
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.settings_dict, conn_params)
+        connection = self.pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        # Only set by the parent when opening a connection, reused connections
+        # keep the isolation level they were opened with.
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = base.IsolationLevel(
+            options.get("isolation_level", base.IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if not self.connection.closed and self.connection.get_transaction_status() in (
+                    extensions.TRANSACTION_STATUS_INTRANS,
+                    extensions.TRANSACTION_STATUS_INERROR,
+                ):
+                    # closed in a transaction: never hand it out half done
+                    self.connection.rollback()
+                self.pool.put(self.connection)
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "users.instrumentation.QueryCountMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -52,7 +53,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    # "users.middleware.AuthenticationMiddleware",
+    "users.middleware.ReplicaRoutingMiddleware",
+    "users.middleware.AuthenticationMiddleware",
 ]
 
 ROOT_URLCONF = "Kraston.urls"
@@ -82,17 +84,87 @@ WSGI_APPLICATION = "Kraston.wsgi.application"
 from dotenv import load_dotenv
 load_dotenv()
 
+# Connections are pooled per worker process by Kraston.db_pool (set
+# POSTGRES_POOL_SIZE=0 to fall back to one persistent connection per thread,
+# kept for POSTGRES_CONN_MAX_AGE seconds).
+POSTGRES_POOL_SIZE = int(os.environ.get("POSTGRES_POOL_SIZE", 10))
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": (
+            "Kraston.db_pool" if POSTGRES_POOL_SIZE else "django.db.backends.postgresql"
+        ),
         "NAME": os.environ.get("POSTGRES_DATABASE"),
         "USER": os.environ.get("POSTGRES_USER"),
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
         "HOST": os.environ.get("POSTGRES_HOST"),
-        "PORT": os.environ.get("5432"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+        # with the pool, closing at the end of a request gives the connection back
+        "CONN_MAX_AGE": (
+            0 if POSTGRES_POOL_SIZE else int(os.environ.get("POSTGRES_CONN_MAX_AGE", 600))
+        ),
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": {
+            "MAX_SIZE": POSTGRES_POOL_SIZE,
+            "MAX_LIFETIME": int(os.environ.get("POSTGRES_POOL_MAX_LIFETIME", 3600)),
+            "HEALTH_CHECK_AFTER": int(os.environ.get("POSTGRES_POOL_HEALTH_CHECK_AFTER", 30)),
+            "TIMEOUT": int(os.environ.get("POSTGRES_POOL_TIMEOUT", 30)),
+        },
+        "OPTIONS": {
+            "connect_timeout": int(os.environ.get("POSTGRES_CONNECT_TIMEOUT", 5)),
+        },
     }
 }
 
+# Statements of the processes serving requests are cancelled after this many
+# milliseconds (0 to disable), see users.timeouts. Migrations, management
+# commands and job workers run without a timeout.
+REQUEST_STATEMENT_TIMEOUT_MS = int(os.environ.get("POSTGRES_STATEMENT_TIMEOUT_MS", 30000))
+
+# Read replicas, as comma separated database URLs. Each one gets a
+# "replica_<n>" alias sharing the primary's engine, pool and options.
+REPLICA_DATABASES = []
+for index, url in enumerate(
+    filter(None, os.environ.get("POSTGRES_REPLICA_URLS", "").split(",")), start=1
+):
+    replica = dj_database_url.parse(url.strip())
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        **{key: replica[key] for key in ["NAME", "USER", "PASSWORD", "HOST", "PORT"]},
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(f"replica_{index}")
+
+DATABASE_ROUTERS = ["users.routing.PrimaryReplicaRouter"]
+
+# Safe requests read from a replica lagging at most MAX_REPLICA_LAG_SECONDS;
+# clients stay on the primary for READ_YOUR_WRITES_SECONDS after a write.
+DATABASE_ROUTING = {
+    "READ_YOUR_WRITES_SECONDS": int(os.environ.get("READ_YOUR_WRITES_SECONDS", 5)),
+    "MAX_REPLICA_LAG_SECONDS": float(os.environ.get("MAX_REPLICA_LAG_SECONDS", 2)),
+    "LAG_CHECK_INTERVAL": float(os.environ.get("REPLICA_LAG_CHECK_INTERVAL", 1)),
+    "CACHE_ALIAS": "default",
+}
+
+# Per request query stats of users.instrumentation.QueryCountMiddleware:
+# Server-Timing headers in DEBUG, log records (metrics) in production.
+QUERY_INSTRUMENTATION = {
+    "SERVER_TIMING": DEBUG,
+    "LOG_REQUESTS": not DEBUG,
+    "DUPLICATE_THRESHOLD": int(os.environ.get("QUERY_DUPLICATE_THRESHOLD", 3)),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "users.instrumentation": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 # DATABASES = {
 #     "default": {
 #         "ENGINE": "django.db.backends.postgresql",
@@ -110,6 +182,89 @@ DATABASES = {
 #     )
 # }
 
+# Authenticated principal cache used by users.middleware.AuthenticationMiddleware.
+# SHARED_CACHE_ALIAS names an entry of CACHES shared between workers
+# (leave unset to keep the cache in-process only).
+AUTH_PRINCIPAL_CACHE = {
+    "MAX_SIZE": int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", 10000)),
+    "TTL": int(os.environ.get("AUTH_PRINCIPAL_CACHE_TTL", 300)),
+    "SHARED_CACHE_ALIAS": os.environ.get("AUTH_PRINCIPAL_SHARED_CACHE"),
+}
+
+# Cached user representations of users.profile_cache, in local memory by
+# default. Point PROFILE_CACHE_BACKEND/LOCATION at a shared cache (e.g.
+# django.core.cache.backends.redis.RedisCache) to share entries and
+# invalidations between workers.
+PROFILE_CACHE_BACKEND = os.environ.get(
+    "PROFILE_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+)
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "profiles": {
+        "BACKEND": PROFILE_CACHE_BACKEND,
+        "LOCATION": os.environ.get("PROFILE_CACHE_LOCATION", "profiles"),
+    },
+}
+if PROFILE_CACHE_BACKEND.endswith("LocMemCache"):
+    CACHES["profiles"]["OPTIONS"] = {
+        "MAX_ENTRIES": int(os.environ.get("PROFILE_CACHE_SIZE", 50000))
+    }
+PROFILE_CACHE = {
+    "CACHE_ALIAS": "profiles",
+    "TTL": int(os.environ.get("PROFILE_CACHE_TTL", 300)),
+    # seconds a request waits for another thread recomputing the same profile
+    "WAIT_TIMEOUT": 5,
+}
+
+# Daily session rollups of users.rollups, behind the analytics end points.
+# Changed days are refreshed by the job workers (refresh_marked), or right
+# after the write with SYNC, which puts the refresh on the request path.
+SESSION_ROLLUPS = {
+    "SYNC": os.environ.get("SESSION_ROLLUPS_SYNC", "0") == "1",
+    "BATCH_SIZE": 50,
+    "CHART_TTL": 86400,
+}
+
+# Background jobs of users.jobs (media processing, session reminders, rollup
+# catch-up), run by `python manage.py run_jobs` workers.
+JOB_QUEUE = {
+    "CONCURRENCY": int(os.environ.get("JOB_WORKER_CONCURRENCY", 2)),
+    "POLL_INTERVAL": 1,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_BASE": 10,
+    "BACKOFF_MAX": 3600,
+    "LEASE_SECONDS": 600,
+    "SCHEDULE_INTERVAL": 60,
+    "KEEP_FINISHED_SECONDS": 7 * 86400,
+}
+
+# Emails sent a day and an hour before each session.
+SESSION_REMINDERS = {
+    "LEADS": [86400, 3600],
+    "AHEAD": 600,
+    "GRACE": 900,
+    "BATCH_SIZE": 500,
+}
+EMAIL_BACKEND = os.environ.get(
+    "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
+)
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 25))
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "no-reply@kraston.local")
+
+# Fully consumed courses are moved to the partitioned archive by
+# `python manage.py archive_sessions` once their last session is this old.
+SESSION_ARCHIVE = {
+    "RETENTION_DAYS": int(os.environ.get("SESSION_ARCHIVE_RETENTION_DAYS", 365)),
+    "BATCH_SIZE": 200,
+    "PARTITIONS_AHEAD": 3,
+}
+
+# Threads hashing passwords for the async auth views (per worker process).
+PASSWORD_HASHING_THREADS = int(
+    os.environ.get("PASSWORD_HASHING_THREADS", min(4, os.cpu_count() or 1))
+)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -145,7 +300,28 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = "/static/"
-MEDIA_URL = "media/"
+MEDIA_URL = "/media/"
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", BASE_DIR / "media")
+
+# Uploads are stored once per content hash, media/ downloads are authorized
+# by users.downloads.MediaDownloadView.
+STORAGES = {
+    "default": {"BACKEND": "users.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Internal nginx location aliasing MEDIA_ROOT, e.g. "/protected-media/". When
+# set, file bodies are sent by nginx through X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get("MEDIA_ACCEL_REDIRECT_PREFIX")
+
+# Uploads are streamed to a temporary file in chunks instead of being held in
+# memory, then moved into MEDIA_ROOT (keep both on the same file system so
+# the move is a rename).
+FILE_UPLOAD_HANDLERS = ["django.core.files.uploadhandler.TemporaryFileUploadHandler"]
+FILE_UPLOAD_TEMP_DIR = os.environ.get("FILE_UPLOAD_TEMP_DIR")
+
+# Thumbnails and document checks are jobs of the run_jobs workers, larger
+# documents are rejected.
+MEDIA_MAX_DOCUMENT_SIZE = int(os.environ.get("MEDIA_MAX_DOCUMENT_SIZE", 20 * 1024 * 1024))
 
 # AUTH_USER_MODEL = "users.User"
 
@@ -153,7 +329,15 @@ CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "users.authentication.JWTAuthentication",
+    ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",  # for api auto documentation
+    # same output as rest_framework.renderers.JSONRenderer, faster with orjson
+    "DEFAULT_RENDERER_CLASSES": [
+        "users.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 # Spectacular settings for api auto documentation
@@ -163,3 +347,7 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "1.0.0",
     "SERVE_INCLUDE_SCHEMA": False,
 }
+
+# Directory of the prebuilt schema served at /api/schema/
+# (python manage.py build_api_schema)
+API_SCHEMA_DIR = BASE_DIR / "api_schema"
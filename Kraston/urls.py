@@ -19,18 +19,28 @@ from django.contrib import admin
 from django.urls import path
 
 from drf_spectacular.views import (
-    SpectacularAPIView,
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
 
+from users.async_views import (
+    AsyncBookSeriesView,
+    AsyncLoginView,
+    AsyncLogoutView,
+    AsyncRegisterView,
+    AsyncUserView,
+)
+from users.downloads import MediaDownloadView
+from users.schema import PrebuiltSchemaView
 from users.views import *
 
 urlpatterns = [
     # admin end point
     path("admin/", admin.site.urls),
     # API auto documentation end points
-    path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
+    # the schema is prebuilt by `manage.py build_api_schema` (or generated
+    # once per process) and served with ETags
+    path("api/schema/", PrebuiltSchemaView.as_view(), name="schema"),
     path(
         "api/schema/swagger-ui/",
         SpectacularSwaggerView.as_view(url_name="schema"),
@@ -41,16 +51,54 @@ urlpatterns = [
         SpectacularRedocView.as_view(url_name="schema"),
         name="redoc",
     ),
-    # # User authentication end points
-    # path("auth/register/", RegisterView.as_view({"post": "create"})),
-    # path("auth/login/", LoginView.as_view({"post": "login"})),
-    # path("auth/logout/", LogoutView.as_view({"post": "logout"})),
-    # path("auth/user/", UserView.as_view({"get": "retrieve"})),
-    # # User end points
-    # path("users/", UserViewSet.as_view({"get": "list"})),
-    # path(
-    #     "users/<int:pk>/",
-    #     UserViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy"}),
-    # ),
-    # path("users/search/<str:string>/", UserSearch.as_view({"get": "list"})),
+    # User authentication end points
+    path("auth/register/", RegisterView.as_view({"post": "create"})),
+    path("auth/login/", LoginView.as_view({"post": "login"})),
+    path("auth/logout/", LogoutView.as_view({"post": "logout"})),
+    path("auth/user/", UserView.as_view({"get": "retrieve"})),
+    # Async versions of the auth and booking end points, for ASGI workers
+    path("async/auth/register/", AsyncRegisterView.as_view()),
+    path("async/auth/login/", AsyncLoginView.as_view()),
+    path("async/auth/logout/", AsyncLogoutView.as_view()),
+    path("async/auth/user/", AsyncUserView.as_view()),
+    path("async/sessions/book/", AsyncBookSeriesView.as_view()),
+    # User end points
+    path("users/", UserViewSet.as_view({"get": "list"})),
+    path("users/search/<str:string>/", UserSearch.as_view({"get": "list"})),
+    path(
+        "users/<str:identity>/<int:pk>/",
+        UserViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy"}),
+    ),
+    # Nurse availability end points
+    path(
+        "nurses/schedule/",
+        NurseScheduleView.as_view({"get": "retrieve", "put": "update"}),
+    ),
+    path("nurses/available/", AvailableNurseViewSet.as_view({"get": "list"})),
+    path("nurses/match/", AvailableNurseViewSet.as_view({"get": "match"})),
+    path("nurses/<int:pk>/free/", AvailableNurseViewSet.as_view({"get": "free"})),
+    # Admin bulk import and export of patients, nurses, admins and sessions
+    path("bulk/import/<str:kind>/", BulkViewSet.as_view({"post": "import_rows"})),
+    path("bulk/export/<str:kind>/", BulkViewSet.as_view({"get": "export_rows"})),
+    # Cache statistics of the serving worker
+    path("metrics/caches/", CacheStatsView.as_view({"get": "list"})),
+    # Session analytics, from the rollup tables
+    path("analytics/sessions/", SessionAnalyticsViewSet.as_view({"get": "list"})),
+    path(
+        "analytics/sessions/chart/",
+        SessionAnalyticsViewSet.as_view({"get": "chart"}),
+    ),
+    # Uploaded files
+    path("media/<path:name>", MediaDownloadView.as_view(), name="media"),
+    # Session end points
+    path("sessions/", SessionViewSet.as_view({"get": "list"})),
+    path("sessions/book/", SessionViewSet.as_view({"post": "book"})),
+    path(
+        "sessions/series/<uuid:series>/",
+        SessionViewSet.as_view({"get": "series"}),
+    ),
+    path(
+        "sessions/series/<uuid:series>/consume/",
+        SessionViewSet.as_view({"post": "consume"}),
+    ),
 ]
@@ -11,6 +11,11 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from users.timeouts import limit_request_statements
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Kraston.settings')
 
 application = get_wsgi_application()
+
+# only the processes serving requests cap their statements
+limit_request_statements()
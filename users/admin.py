@@ -1,10 +1,207 @@
+import datetime
+import uuid
+
 from django.contrib import admin
-from .models import Nurse, Patient, Session, Admin
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import (
+    IDENTITY_MODELS,
+    Job,
+    Nurse,
+    Patient,
+    Session,
+    Admin,
+    UserIdentity,
+    normalize_search_text,
+)
+from .pagination import estimate_count
 
 # Register your models here.
 
 
-admin.site.register(Nurse)
-admin.site.register(Patient)
-admin.site.register(Session)
-admin.site.register(Admin)
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting large changelists from the planner statistics.
+
+    Below `exact_below` estimated rows the count is exact, above it a
+    COUNT(*) over millions of rows would dominate the page time, so the
+    estimate is shown instead.
+    """
+
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate < self.exact_below:
+            return super().count
+        return estimate
+
+
+class HighVolumeAdmin(admin.ModelAdmin):
+    """
+    Changelists of tables with millions of rows: estimated counts, no
+    second count of the unfiltered table and a small page.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+def indexed_value_filter(field, title, limit=200, timeout=600):
+    """
+    Changelist filter on an indexed column, its choices (the distinct
+    values) are read from the index and cached for `timeout` seconds.
+    """
+
+    class IndexedValueFilter(admin.SimpleListFilter):
+        parameter_name = field
+
+        def lookups(self, request, model_admin):
+            key = f"admin_filter:{model_admin.model._meta.label}:{field}"
+            values = cache.get(key)
+            if values is None:
+                values = list(
+                    model_admin.model.objects.exclude(**{field: ""})
+                    .order_by(field)
+                    .values_list(field, flat=True)
+                    .distinct()[:limit]
+                )
+                cache.set(key, values, timeout)
+            return [(value, value) for value in values]
+
+        def queryset(self, request, queryset):
+            if self.value() is not None:
+                return queryset.filter(**{field: self.value()})
+            return queryset
+
+    IndexedValueFilter.title = title
+    return IndexedValueFilter
+
+
+class UserAdmin(HighVolumeAdmin):
+    """
+    Users of one identity, searched through the trigram indexed identity
+    index instead of ILIKE scans of every name column.
+    """
+
+    list_display = ["id", "email", "first_name", "last_name", "city"]
+    list_filter = [indexed_value_filter("city", "city")]
+    # also enables the autocomplete widgets pointing at users
+    search_fields = ["email"]
+    search_help_text = "Name, city, specialization, national id or exact email."
+    ordering = ["-id"]
+
+    def get_search_results(self, request, queryset, search_term):
+        text = normalize_search_text(search_term)
+        if not text:
+            return queryset, False
+        identity = next(
+            identity
+            for identity, model in IDENTITY_MODELS.items()
+            if model is self.model
+        )
+        ids = UserIdentity.objects.filter(
+            identity=identity, search_text__contains=text
+        ).values("user_id")
+        return queryset.filter(Q(pk__in=ids) | Q(email=search_term.strip())), False
+
+
+@admin.register(Patient)
+class PatientAdmin(UserAdmin):
+    pass
+
+
+@admin.register(Nurse)
+class NurseAdmin(UserAdmin):
+    list_display = UserAdmin.list_display + ["specialization", "session_price"]
+    list_filter = UserAdmin.list_filter + [
+        indexed_value_filter("specialization", "specialization")
+    ]
+
+
+@admin.register(Admin)
+class AdminAdmin(UserAdmin):
+    pass
+
+
+class UpcomingFilter(admin.SimpleListFilter):
+    """
+    Past or upcoming sessions, a range on the start_time index.
+    """
+
+    title = "when"
+    parameter_name = "when"
+
+    def lookups(self, request, model_admin):
+        return [("upcoming", "Upcoming"), ("past", "Past"), ("next_7_days", "Next 7 days")]
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        if self.value() == "upcoming":
+            return queryset.filter(start_time__gte=now)
+        if self.value() == "past":
+            return queryset.filter(start_time__lt=now)
+        if self.value() == "next_7_days":
+            return queryset.filter(
+                start_time__gte=now, start_time__lt=now + datetime.timedelta(days=7)
+            )
+        return queryset
+
+
+@admin.register(Session)
+class SessionAdmin(HighVolumeAdmin):
+    list_display = [
+        "id",
+        "start_time",
+        "session_type",
+        "patient",
+        "nurse",
+        "ordinal",
+        "remaining_sessions",
+        "paid_price",
+    ]
+    # patient and nurse are rendered with their __str__, joined in the
+    # changelist query instead of loaded row by row
+    list_select_related = ["patient", "nurse"]
+    list_filter = [UpcomingFilter]
+    date_hierarchy = "start_time"
+    ordering = ["-start_time"]
+    autocomplete_fields = ["patient", "nurse"]
+    raw_id_fields = ["prev_session", "next_session"]
+    search_fields = ["series"]
+    search_help_text = "Session id or treatment course (series) id."
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        try:
+            return queryset.filter(series=uuid.UUID(search_term)), False
+        except ValueError:
+            return queryset.none(), False
+
+
+@admin.register(Job)
+class JobAdmin(HighVolumeAdmin):
+    list_display = ["id", "name", "status", "run_at", "attempts", "finished_at"]
+    list_filter = ["status"]
+    ordering = ["-id"]
+    readonly_fields = ["locked_by", "locked_at", "created_at", "finished_at", "last_error"]
+    actions = ["retry"]
+
+    @admin.action(description="Run again now")
+    def retry(self, request, queryset):
+        queryset.exclude(status=Job.Status.RUNNING).update(
+            status=Job.Status.QUEUED,
+            run_at=timezone.now(),
+            attempts=0,
+            finished_at=None,
+        )
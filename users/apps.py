@@ -1,6 +1,44 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, pre_migrate
+
+
+def create_postgres_extensions(using, **kwargs):
+    """
+    Enable the extensions our indexes depend on before the users tables
+    are migrated.
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+
+
+def create_session_archive(using, **kwargs):
+    """
+    Create the partitioned session archive, a table migrations can't
+    declare (see users.partitions).
+    """
+    from django.db import connections
+
+    from .partitions import ensure_archive_table
+
+    ensure_archive_table(connections[using])
 
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # register the handlers of signals and the tasks of the job queue
+        from . import partitions, reminders, signals  # noqa: F401
+        from .instrumentation import install_query_wrapper
+
+        pre_migrate.connect(create_postgres_extensions, sender=self)
+        post_migrate.connect(create_session_archive, sender=self)
+        connection_created.connect(install_query_wrapper)
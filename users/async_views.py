@@ -0,0 +1,169 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .middleware import aauthenticate_token, get_request_token, revoke_token
+from .models import BookingConflict, Identity, UserIdentity
+from .passwords import acheck_password, amake_password
+from .serializers import BookSeriesSerializer, SessionSerializer, USER_SERIALIZERS
+from .views import create_token
+
+
+class AsyncAPIView(View):
+    """
+    Base of the async endpoints served under ASGI.
+
+    They answer like their DRF counterparts but await the database with the
+    async ORM and hash passwords in a bounded thread pool, so slow logins
+    don't hold a worker. Serializer validation and transactional writes,
+    which have no async ORM equivalent, run in a thread with sync_to_async.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # token authenticated like the DRF views, which are csrf exempt too
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    def error(detail, status_code):
+        return JsonResponse({"detail": detail}, status=status_code)
+
+    @staticmethod
+    def get_data(request):
+        if request.content_type == "application/json":
+            return json.loads(request.body or b"{}")
+        data = request.POST.copy()
+        data.update(request.FILES)
+        return data
+
+    async def get_user(self, request):
+        token = get_request_token(request)
+        if not token:
+            return None
+        return await aauthenticate_token(token)
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except json.JSONDecodeError as exc:
+            return self.error(f"JSON parse error - {exc}", status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncRegisterView(AsyncAPIView):
+    """
+    Create a new user.
+    """
+
+    async def post(self, request):
+        data = self.get_data(request)
+        serializer_class = USER_SERIALIZERS.get(data.get("identity"))
+        if serializer_class is None:
+            return JsonResponse(
+                {"identity": "Invalid identity."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = serializer_class(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        encoded_password = await amake_password(serializer.validated_data["password"])
+        await sync_to_async(serializer.save)(encoded_password=encoded_password)
+        return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AsyncLoginView(AsyncAPIView):
+    """
+    User Login.
+    """
+
+    async def post(self, request):
+        """
+        Returns:
+            {"jwt": token} in json format and in cookie.
+        """
+        data = self.get_data(request)
+        missing = {
+            field: ["This field is required."]
+            for field in ["email", "password"]
+            if field not in data
+        }
+        if missing:
+            return JsonResponse(missing, status=status.HTTP_400_BAD_REQUEST)
+
+        user = await UserIdentity.objects.aget_user(email=data["email"])
+        if user is None:
+            return self.error("User not found!", status.HTTP_403_FORBIDDEN)
+
+        if not await acheck_password(data["password"], user.password):
+            return self.error("Incorrect password!", status.HTTP_403_FORBIDDEN)
+
+        token = create_token(user)
+        response = JsonResponse({"jwt": token})
+        response.set_cookie(key="jwt", value=token, httponly=True)
+        return response
+
+
+class AsyncLogoutView(AsyncAPIView):
+    """
+    User Logout and Delete Cookie.
+    """
+
+    async def post(self, request):
+        token = get_request_token(request)
+        if token:
+            revoke_token(token)
+
+        response = JsonResponse({"message": "success"})
+        response.delete_cookie("jwt")
+        return response
+
+
+class AsyncUserView(AsyncAPIView):
+    """
+    Check Authentication and Retrieve User.
+    """
+
+    async def get(self, request):
+        user = await self.get_user(request)
+        if user is None:
+            return self.error(
+                "Authentication credentials were not provided.",
+                status.HTTP_403_FORBIDDEN,
+            )
+        return JsonResponse(USER_SERIALIZERS[user.identity](user).data)
+
+
+class AsyncBookSeriesView(AsyncAPIView):
+    """
+    Book a treatment course: one session per slot, linked in order.
+    """
+
+    async def post(self, request):
+        user = await self.get_user(request)
+        if user is None:
+            return self.error(
+                "Authentication credentials were not provided.",
+                status.HTTP_403_FORBIDDEN,
+            )
+
+        serializer = BookSeriesSerializer(data=self.get_data(request))
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        if user.identity != Identity.ADMIN and user not in (data["patient"], data["nurse"]):
+            return JsonResponse(
+                "You are not authorized to book sessions for other users",
+                status=status.HTTP_403_FORBIDDEN,
+                safe=False,
+            )
+        try:
+            sessions = await sync_to_async(serializer.save)()
+        except BookingConflict as exc:
+            return JsonResponse(str(exc), status=status.HTTP_409_CONFLICT, safe=False)
+        return JsonResponse(
+            SessionSerializer(sessions, many=True).data,
+            status=status.HTTP_201_CREATED,
+            safe=False,
+        )
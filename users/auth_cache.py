@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class PrincipalCache:
+    """
+    Cache of authenticated users keyed by verified token id.
+
+    Entries live in an in-process LRU with a TTL so that a warm token is
+    resolved without touching the database. When a shared cache alias is
+    configured, local misses are looked up there before falling back to the
+    database, and invalidations are propagated through a per-user generation
+    number so other processes drop stale entries on their next shared lookup.
+
+    Note: local entries on other processes stay valid until their TTL expires,
+    so the TTL is the upper bound on cross-process staleness.
+    """
+
+    KEY_PREFIX = "principal"
+
+    def __init__(self, max_size=10000, ttl=300, shared_cache_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_cache_alias = shared_cache_alias
+        self._entries = OrderedDict()  # token_id -> (expires_at, user_key, user)
+        self._tokens_by_user = {}  # user_key -> {token_id, ...}
+        self._revoked = {}  # token_id -> expires_at
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ["hits", "shared_hits", "misses", "evictions", "invalidations"], 0
+        )
+
+    @property
+    def shared(self):
+        if self.shared_cache_alias is None:
+            return None
+        return caches[self.shared_cache_alias]
+
+    @staticmethod
+    def user_key(user):
+        return f"{user.identity}:{user.pk}"
+
+    def _shared_key(self, *parts):
+        return ":".join([self.KEY_PREFIX, *map(str, parts)])
+
+    def get(self, token_id):
+        """
+        Return the cached user for `token_id` or None on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(token_id)
+                    self._counters["hits"] += 1
+                    return entry[2]
+                self._discard(token_id)
+
+        user = self._get_shared(token_id)
+        with self._lock:
+            if user is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["shared_hits"] += 1
+        self._store_local(token_id, user)
+        return user
+
+    def set(self, token_id, user):
+        """
+        Cache `user` as the principal authenticated by `token_id`.
+        """
+        self._store_local(token_id, user)
+        shared = self.shared
+        if shared is not None:
+            gen_key = self._shared_key("gen", self.user_key(user))
+            generation = shared.get(gen_key, 0)
+            shared.set(
+                self._shared_key("token", token_id), (generation, user), self.ttl
+            )
+
+    def is_revoked(self, token_id):
+        with self._lock:
+            expires_at = self._revoked.get(token_id)
+            if expires_at is not None:
+                if expires_at > time.time():
+                    return True
+                del self._revoked[token_id]
+        shared = self.shared
+        if shared is None:
+            return False
+        return shared.get(self._shared_key("revoked", token_id)) is not None
+
+    def revoke(self, token_id, expires_at=None):
+        """
+        Drop the entry for `token_id` and refuse it until `expires_at`
+        (a unix timestamp, normally the token's `exp` claim), for the TTL
+        when the token has no expiry.
+        """
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.ttl
+        with self._lock:
+            self._discard(token_id)
+            # revocations of expired tokens are no longer needed
+            for revoked_id, revoked_until in list(self._revoked.items()):
+                if revoked_until <= now:
+                    del self._revoked[revoked_id]
+            self._revoked[token_id] = expires_at
+            self._counters["invalidations"] += 1
+        shared = self.shared
+        if shared is not None:
+            timeout = max(int(expires_at - now), 1)
+            shared.delete(self._shared_key("token", token_id))
+            shared.set(self._shared_key("revoked", token_id), True, timeout)
+
+    def invalidate_user(self, user):
+        """
+        Drop every cached token of `user`, e.g. after a password change or
+        delete.
+        """
+        user_key = self.user_key(user)
+        with self._lock:
+            for token_id in list(self._tokens_by_user.get(user_key, ())):
+                self._discard(token_id)
+            self._counters["invalidations"] += 1
+        shared = self.shared
+        if shared is not None:
+            gen_key = self._shared_key("gen", user_key)
+            shared.add(gen_key, 0, None)
+            shared.incr(gen_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+            self._revoked.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=len(self._entries))
+
+    def _get_shared(self, token_id):
+        shared = self.shared
+        if shared is None:
+            return None
+        cached = shared.get(self._shared_key("token", token_id))
+        if cached is None:
+            return None
+        generation, user = cached
+        gen_key = self._shared_key("gen", self.user_key(user))
+        if shared.get(gen_key, 0) != generation:
+            return None
+        return user
+
+    def _store_local(self, token_id, user):
+        user_key = self.user_key(user)
+        with self._lock:
+            self._discard(token_id)
+            self._entries[token_id] = (time.monotonic() + self.ttl, user_key, user)
+            self._tokens_by_user.setdefault(user_key, set()).add(token_id)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self._counters["evictions"] += 1
+
+    def _discard(self, token_id):
+        """
+        Remove `token_id` from the local cache. Caller must hold the lock.
+        """
+        entry = self._entries.pop(token_id, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token_id)
+            if not tokens:
+                del self._tokens_by_user[entry[1]]
+
+
+def _build_principal_cache():
+    config = getattr(settings, "AUTH_PRINCIPAL_CACHE", {})
+    return PrincipalCache(
+        max_size=config.get("MAX_SIZE", 10000),
+        ttl=config.get("TTL", 300),
+        shared_cache_alias=config.get("SHARED_CACHE_ALIAS"),
+    )
+
+
+principal_cache = _build_principal_cache()
@@ -0,0 +1,33 @@
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from rest_framework.authentication import BaseAuthentication
+
+from .middleware import authenticate_token, get_request_token
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    DRF authentication backed by the same cached token resolution as
+    users.middleware.AuthenticationMiddleware.
+    """
+
+    def authenticate(self, request):
+        token = get_request_token(request)
+        if not token:
+            return None
+
+        user = authenticate_token(token)
+        if user is None:
+            return None
+        return (user, token)
+
+
+class JWTAuthenticationScheme(OpenApiAuthenticationExtension):
+    """
+    Describe JWTAuthentication in the OpenAPI schema.
+    """
+
+    target_class = "users.authentication.JWTAuthentication"
+    name = "jwtAuth"
+
+    def get_security_definition(self, auto_schema):
+        return {"type": "apiKey", "in": "header", "name": "Authorization"}
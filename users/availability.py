@@ -0,0 +1,79 @@
+import datetime
+
+from django.utils import timezone
+
+from .models import NurseAvailabilityException, Session
+
+
+def merge_intervals(intervals):
+    """
+    Sort and merge overlapping or touching `(start, end)` intervals.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(intervals, removed):
+    """
+    Parts of the merged `intervals` not covered by any of `removed`.
+    """
+    result = []
+    removed = merge_intervals(removed)
+    for start, end in intervals:
+        for removed_start, removed_end in removed:
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                result.append((start, removed_start))
+            start = max(start, removed_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def free_intervals(nurse, start, end):
+    """
+    Free time of `nurse` within `[start, end)`: weekly slots and extra
+    availabilities minus time off and already booked sessions.
+    """
+    local_start = timezone.localtime(start)
+    week_start = (local_start - datetime.timedelta(days=local_start.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+    available = []
+    slots = list(nurse.availability.values_list("minutes", flat=True))
+    while week_start < end:
+        for minutes in slots:
+            available.append(
+                (
+                    week_start + datetime.timedelta(minutes=minutes.lower),
+                    week_start + datetime.timedelta(minutes=minutes.upper),
+                )
+            )
+        week_start += datetime.timedelta(weeks=1)
+
+    exceptions = NurseAvailabilityException.objects.filter(
+        nurse=nurse, period__overlap=(start, end)
+    ).values_list("period", "is_available")
+    time_off = []
+    for period, is_available in exceptions:
+        (available if is_available else time_off).append((period.lower, period.upper))
+
+    booked = Session.objects.filter(
+        nurse=nurse, start_time__lt=end, end_time__gt=start
+    ).values_list("start_time", "end_time")
+
+    available = [
+        (max(slot_start, start), min(slot_end, end))
+        for slot_start, slot_end in merge_intervals(available)
+        if slot_start < end and slot_end > start
+    ]
+    return subtract_intervals(available, [*time_off, *booked])
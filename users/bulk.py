@@ -0,0 +1,395 @@
+import codecs
+import csv
+import json
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from .models import (
+    IDENTITY_MODELS,
+    Identity,
+    Nurse,
+    Patient,
+    Session,
+    UserIdentity,
+    sessions_changed,
+)
+from .passwords import get_hashing_executor
+from .serializers import SessionSerializer, USER_SERIALIZERS
+from .timeouts import no_statement_timeout
+
+FORMATS = ["csv", "ndjson"]
+
+# what can be imported and exported, by name
+BULK_KINDS = {
+    "patients": Identity.PATIENT,
+    "nurses": Identity.Nurse,
+    "admins": Identity.ADMIN,
+    "sessions": None,
+}
+
+
+def read_rows(lines, file_format):
+    """
+    `(row_number, data, error)` for each row of CSV (with a header line) or
+    NDJSON text `lines`. Empty CSV cells are left out so optional fields get
+    their defaults.
+    """
+    if file_format == "csv":
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, {key: value for key, value in row.items() if value != ""}, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield number, None, {"non_field_errors": [f"Invalid JSON: {exc}"]}
+            continue
+        if not isinstance(data, dict):
+            yield number, None, {"non_field_errors": ["Expected a JSON object."]}
+            continue
+        yield number, data, None
+
+
+def decode_lines(stream):
+    """
+    Text lines of a binary stream (an upload, a request body or a file),
+    decoded on the fly.
+    """
+    return codecs.iterdecode(stream, "utf-8-sig")
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkUserSerializerMixin:
+    """
+    Validate one imported user without a query: uniqueness is checked for
+    the whole batch at once by UserImporter, files can't be imported.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name, field in list(fields.items()):
+            if isinstance(field, serializers.FileField) or name in ("identity", "media"):
+                del fields[name]
+                continue
+            field.validators = [
+                validator
+                for validator in field.validators
+                if not isinstance(validator, UniqueValidator)
+            ]
+        fields["password"].required = False
+        return fields
+
+    def validate_email(self, value):
+        return value
+
+    def validate_national_id(self, value):
+        return value
+
+
+class PrefetchedRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field resolved from objects prefetched for the whole batch
+    (`context["prefetched"][field_name]`, a dict by pk).
+    """
+
+    def to_internal_value(self, data):
+        objects = self.context["prefetched"][self.field_name]
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if pk not in objects:
+            self.fail("does_not_exist", pk_value=data)
+        return objects[pk]
+
+
+class BulkSessionSerializer(SessionSerializer):
+    """
+    Imported session. Courses are given by `series` and `ordinal` and linked
+    after insert, a row without series is a course of its own.
+    """
+
+    patient = PrefetchedRelatedField(queryset=Patient.objects.all())
+    nurse = PrefetchedRelatedField(queryset=Nurse.objects.all())
+    series = serializers.UUIDField(required=False)
+    ordinal = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta(SessionSerializer.Meta):
+        fields = [
+            field
+            for field in SessionSerializer.Meta.fields
+            if field not in ("prev_session", "next_session")
+        ]
+        extra_kwargs = {}
+
+
+def get_bulk_serializer_class(kind):
+    if kind == "sessions":
+        return BulkSessionSerializer
+    serializer_class = USER_SERIALIZERS[BULK_KINDS[kind]]
+    return type(
+        f"Bulk{serializer_class.__name__}",
+        (BulkUserSerializerMixin, serializer_class),
+        {},
+    )
+
+
+class Importer:
+    """
+    Validate rows in batches, insert each batch with bulk_create in its own
+    transaction and collect per-row errors.
+
+    When a batch fails in the database (a row conflicting with data written
+    concurrently), its rows are inserted one by one so only the faulty rows
+    are reported.
+    """
+
+    def __init__(self, kind, batch_size=500):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.serializer_class = get_bulk_serializer_class(kind)
+        self.created = 0
+        self.errors = []
+
+    def run(self, rows):
+        """
+        Import `(row_number, data, error)` rows as given by read_rows().
+        Returns self, with `created` and `errors` set.
+        """
+        for batch in batched(rows, self.batch_size):
+            valid = []
+            # one serializer per batch, its fields are built only once
+            serializer = self.serializer_class(context=self.get_context(batch))
+            for number, data, error in batch:
+                if error is None:
+                    try:
+                        valid.append((number, serializer.run_validation(data)))
+                        continue
+                    except serializers.ValidationError as exc:
+                        error = exc.detail
+                self.errors.append({"row": number, "errors": error})
+            valid = self.check_batch(valid)
+            if valid:
+                self.insert(valid)
+        self.errors.sort(key=lambda error: error["row"])
+        return self
+
+    def get_context(self, batch):
+        return {}
+
+    def check_batch(self, valid):
+        return valid
+
+    def insert(self, valid):
+        instances = [self.build(data) for _, data in valid]
+        try:
+            with transaction.atomic():
+                self.bulk_insert(instances)
+        except IntegrityError:
+            for (number, _), instance in zip(valid, instances):
+                instance.pk = None
+                try:
+                    with transaction.atomic():
+                        self.bulk_insert([instance])
+                except IntegrityError as exc:
+                    self.errors.append(
+                        {"row": number, "errors": {"non_field_errors": [str(exc).strip()]}}
+                    )
+                else:
+                    self.created += 1
+        else:
+            self.created += len(instances)
+
+    def build(self, data):
+        raise NotImplementedError
+
+    def bulk_insert(self, instances):
+        raise NotImplementedError
+
+    def report(self, max_errors=None):
+        return {
+            "created": self.created,
+            "failed": len(self.errors),
+            "errors": self.errors[:max_errors],
+        }
+
+
+class UserImporter(Importer):
+    def __init__(self, kind, batch_size=500):
+        super().__init__(kind, batch_size)
+        self.identity = BULK_KINDS[kind]
+        self.model = IDENTITY_MODELS[self.identity]
+
+    def check_batch(self, valid):
+        """
+        Reject rows whose email, national id or username is already taken,
+        with one query per unique key for the whole batch.
+        """
+        keys = {
+            "email": UserIdentity.objects,
+            "national_id": UserIdentity.objects,
+            "username": self.model.objects,
+        }
+        taken = {
+            field: set(
+                manager.filter(
+                    **{f"{field}__in": [data[field] for _, data in valid if data.get(field)]}
+                ).values_list(field, flat=True)
+            )
+            for field, manager in keys.items()
+        }
+        checked = []
+        for number, data in valid:
+            errors = {
+                field: [f"user with this {field} already exists."]
+                for field, values in taken.items()
+                if data.get(field) and data[field] in values
+            }
+            if errors:
+                self.errors.append({"row": number, "errors": errors})
+                continue
+            for field, values in taken.items():
+                if data.get(field):
+                    values.add(data[field])
+            checked.append((number, data))
+
+        # hash the batch in the hashing pool, rows without password get an
+        # unusable one
+        passwords = get_hashing_executor().map(
+            make_password, [data.get("password") for _, data in checked]
+        )
+        for (_, data), password in zip(checked, passwords):
+            data["password"] = password
+        return checked
+
+    def build(self, data):
+        return self.model(identity=self.identity, **data)
+
+    def bulk_insert(self, instances):
+        self.model.objects.bulk_create(instances)
+        UserIdentity.objects.bulk_create(
+            [
+                UserIdentity(
+                    identity=self.identity,
+                    user_id=instance.pk,
+                    **UserIdentity.fields_for(instance),
+                )
+                for instance in instances
+            ]
+        )
+
+
+class SessionImporter(Importer):
+    def get_context(self, batch):
+        """
+        Fetch the patients and nurses of the batch with one query each.
+        """
+        prefetched = {}
+        for field, model in [("patient", Patient), ("nurse", Nurse)]:
+            ids = set()
+            for _, data, _ in batch:
+                try:
+                    ids.add(int(data[field]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            prefetched[field] = model.objects.in_bulk(ids)
+        return {"prefetched": prefetched}
+
+    def build(self, data):
+        data = {"series": uuid.uuid4(), **data}
+        return Session(**data)
+
+    def bulk_insert(self, instances):
+        Session.objects.bulk_create(instances)
+        self.link(instances)
+        sessions_changed.send(
+            sender=Session, start_times=[instance.start_time for instance in instances]
+        )
+
+    def link(self, instances):
+        """
+        Point prev_session/next_session of the courses of `instances` at
+        their neighbours by ordinal, including rows of earlier batches.
+        """
+        series = list({str(instance.series) for instance in instances})
+        table = Session._meta.db_table
+        connection = connections[router.db_for_write(Session)]
+        with connection.cursor() as cursor:
+            for column, offset in [("prev_session_id", -1), ("next_session_id", 1)]:
+                cursor.execute(
+                    f"""
+                    UPDATE {table} AS s SET {column} = n.id, updated_at = %s
+                    FROM {table} AS n
+                    WHERE s.series = ANY(%s::uuid[])
+                        AND n.series = s.series
+                        AND n.ordinal = s.ordinal + %s
+                        AND s.{column} IS DISTINCT FROM n.id
+                    """,
+                    [timezone.now(), series, offset],
+                )
+
+
+def get_importer(kind, batch_size=500):
+    if kind == "sessions":
+        return SessionImporter(kind, batch_size)
+    return UserImporter(kind, batch_size)
+
+
+class Echo:
+    """
+    File-like object handing back what is written, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, file_format, chunk_size=2000):
+    """
+    Lines of CSV or NDJSON text with every row of `kind`, in primary key
+    order. Rows are read through a server-side cursor and serialized one at
+    a time, so memory use does not grow with the table.
+    """
+    serializer_class = get_bulk_serializer_class(kind)
+    if kind == "sessions":
+        queryset = Session.objects.all()
+    else:
+        queryset = IDENTITY_MODELS[BULK_KINDS[kind]].objects.all()
+    serializer = serializer_class()
+    fields = [
+        name for name, field in serializer.fields.items() if not field.write_only
+    ]
+
+    rows = (
+        serializer.to_representation(instance)
+        for instance in queryset.order_by("pk").iterator(chunk_size=chunk_size)
+    )
+    # the whole table is read, more than a request's statement timeout allows
+    with no_statement_timeout(queryset.db):
+        if file_format == "csv":
+            writer = csv.writer(Echo())
+            yield writer.writerow(fields)
+            for row in rows:
+                yield writer.writerow([row[field] for field in fields])
+        else:
+            for row in rows:
+                yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,78 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+# part of every ETag, bump when representations change so clients don't
+# keep an outdated shape
+ETAG_VERSION = 1
+
+
+class Validators:
+    """
+    ETag and Last-Modified of a resource, computed from `updated_at`
+    values instead of the serialized body.
+
+    `parts` are whatever else selects the representation (the requested
+    fields, the query string, the requesting user), they go into the weak
+    ETag with the modification time.
+    """
+
+    def __init__(self, last_modified, *parts):
+        self.last_modified = last_modified
+        data = ":".join(
+            [
+                str(ETAG_VERSION),
+                last_modified.isoformat() if last_modified else "",
+                *map(str, parts),
+            ]
+        )
+        self.etag = f'W/"{hashlib.sha256(data.encode()).hexdigest()[:32]}"'
+
+    @classmethod
+    def for_queryset(cls, queryset, *parts, related=()):
+        """
+        Validators of a list, from the row count and latest `updated_at` of
+        `queryset` and of its `related` objects (expanded relations) in one
+        aggregate query. Deleted rows change the count.
+        """
+        state = queryset.order_by().aggregate(
+            count=Count("pk"),
+            last=Max("updated_at"),
+            **{name: Max(f"{name}__updated_at") for name in related},
+        )
+        last = max(
+            [state[name] for name in ["last", *related] if state[name] is not None],
+            default=None,
+        )
+        validators = cls(last, state["count"], *parts)
+        # deletions don't move the latest updated_at, only the ETag sees
+        # them, so lists are validated by ETag only
+        validators.last_modified = None
+        return validators
+
+    def not_modified(self, request):
+        """
+        304 (or 412) response when the request's conditional headers match,
+        None when the resource has to be sent.
+        """
+        response = get_conditional_response(
+            request,
+            etag=self.etag,
+            last_modified=self.last_modified and int(self.last_modified.timestamp()),
+        )
+        if response is not None:
+            self.patch(response)
+        return response
+
+    def patch(self, response):
+        """
+        Set the validators on `response`, clients must revalidate before
+        reusing it.
+        """
+        response["ETag"] = self.etag
+        if self.last_modified is not None:
+            response["Last-Modified"] = http_date(self.last_modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,189 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views import View
+from rest_framework import status
+
+from .middleware import authenticate_token, get_request_token
+from .models import Identity, Patient, Session
+from .storage import ContentAddressedStorage
+
+# upload directories any authenticated user may download from
+SHARED_DIRECTORIES = {"profile_images", "certificates", "accreditations"}
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    `(start, end)` byte positions, both included, of a single range
+    `Range` header, or None when the header should be ignored (missing,
+    malformed or multiple ranges).
+    """
+    match = RANGE_RE.match((header or "").strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        length = int(end)
+        if length == 0:
+            raise UnsatisfiableRange
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end and end == size - 1:
+        raise UnsatisfiableRange
+    if start > end:
+        return None
+    return start, end
+
+
+def read_range(path, start, length, chunk_size=64 * 1024):
+    with open(path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def normalize_name(name):
+    """
+    `name` when it is a plain relative storage name, None when it has `..`
+    or `.` segments, empty segments or a leading slash that could point
+    outside of its directory once resolved.
+    """
+    if not name or "\\" in name or "\x00" in name:
+        return None
+    if posixpath.isabs(name) or posixpath.normpath(name) != name:
+        return None
+    if ".." in name.split("/"):
+        return None
+    return name
+
+
+def can_download(user, name):
+    """
+    Profile images and nurse credentials are visible to every authenticated
+    user, medical reports to their patient, admins and nurses who had a
+    session with the patient. `name` must be normalized, see
+    normalize_name().
+    """
+    directory = name.split("/", 1)[0]
+    if directory in SHARED_DIRECTORIES:
+        return True
+    if directory != "reports":
+        return False
+    if user.identity == Identity.ADMIN:
+        return True
+    patients = Patient.objects.filter(medical_report=name)
+    if user.identity == Identity.PATIENT:
+        return patients.filter(pk=user.pk).exists()
+    return Session.objects.filter(nurse=user, patient__in=patients).exists()
+
+
+class MediaDownloadView(View):
+    """
+    Authorized downloads of uploaded files.
+
+    With MEDIA_ACCEL_REDIRECT_PREFIX set, the body is left to the front
+    server through X-Accel-Redirect (nginx `internal` location aliasing
+    MEDIA_ROOT); otherwise the file is served here with conditional and
+    single range request support.
+    """
+
+    def get(self, request, name):
+        token = get_request_token(request)
+        user = authenticate_token(token) if token else None
+        if user is None:
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        # the checked name is the one served, storage would resolve `..`
+        name = normalize_name(name)
+        if name is None:
+            raise Http404
+        if not can_download(user, name) or not default_storage.exists(name):
+            raise Http404
+
+        path = default_storage.path(name)
+        stat = os.stat(path)
+        digest = ContentAddressedStorage.get_digest(name)
+        # content addressed files never change, others are keyed on mtime and size
+        etag = f'"{digest}"' if digest else f'W/"{int(stat.st_mtime)}-{stat.st_size}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(stat.st_mtime),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": (
+                "private, max-age=31536000, immutable" if digest else "private, no-cache"
+            ),
+        }
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(stat.st_mtime)
+        )
+        if response is not None:
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        accel_prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", None)
+        if accel_prefix:
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = accel_prefix.rstrip("/") + "/" + quote(name)
+        else:
+            response = self.serve(request, path, stat, etag, content_type)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def serve(self, request, path, stat, etag, content_type):
+        size = stat.st_size
+        byte_range = None
+        if self.range_applies(request, etag, int(stat.st_mtime)):
+            try:
+                byte_range = parse_range(request.headers.get("Range"), size)
+            except UnsatisfiableRange:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+
+        if byte_range is None:
+            return FileResponse(open(path, "rb"), content_type=content_type)
+
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(path, start, end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+        return response
+
+    @staticmethod
+    def range_applies(request, etag, last_modified):
+        """
+        Honour Range unless If-Range names another version of the file.
+        """
+        if_range = request.headers.get("If-Range")
+        if not if_range:
+            return True
+        if if_range.startswith(("W/", '"')):
+            return not etag.startswith("W/") and etag in parse_etags(if_range)
+        return parse_http_date_safe(if_range) == last_modified
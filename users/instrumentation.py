@@ -0,0 +1,216 @@
+import contextlib
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_recorder = contextvars.ContextVar("query_recorder", default=None)
+
+# values that differ between otherwise identical queries, replaced by "?"
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def get_instrumentation_setting(name):
+    defaults = {
+        # add a Server-Timing header to every response
+        "SERVER_TIMING": settings.DEBUG,
+        # log the stats of every request to the users.instrumentation logger
+        "LOG_REQUESTS": not settings.DEBUG,
+        # log a warning when one query runs this many times in a request
+        "DUPLICATE_THRESHOLD": 3,
+    }
+    return getattr(settings, "QUERY_INSTRUMENTATION", {}).get(name, defaults[name])
+
+
+def fingerprint(sql):
+    """
+    `sql` without its literal values, so queries differing only by their
+    parameters (an N+1 loop) share a fingerprint.
+    """
+    sql = LITERALS.sub("?", sql)
+    sql = PLACEHOLDER_LISTS.sub("(...)", sql)
+    return " ".join(sql.split())
+
+
+class QueryRecorder:
+    """
+    SQL count, total database time and fingerprints of the queries run
+    while it is active, on every database alias. Queries are also added to
+    the `parent` recorder active when it started, e.g. a query budget
+    around requests that record their own.
+    """
+
+    def __init__(self, parent=None):
+        self.queries = []  # (alias, sql, seconds)
+        self.start = time.perf_counter()
+        self.parent = parent
+
+    def add(self, alias, sql, duration):
+        self.queries.append((alias, sql, duration))
+        if self.parent is not None:
+            self.parent.add(alias, sql, duration)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    def duplicates(self, threshold=2):
+        """
+        `{fingerprint: count}` of the queries run at least `threshold` times.
+        """
+        counts = Counter(fingerprint(sql) for _, sql, _ in self.queries)
+        return {sql: count for sql, count in counts.items() if count >= threshold}
+
+    def server_timing(self):
+        """
+        Value of a Server-Timing header, durations in milliseconds.
+        """
+        total = (time.perf_counter() - self.start) * 1000
+        duplicates = sum(count - 1 for count in self.duplicates().values())
+        return (
+            f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries", '
+            f'dup;desc="{duplicates} duplicate queries", '
+            f"total;dur={total:.1f}"
+        )
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper reporting to the active QueryRecorder, if any.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(context["connection"].alias, sql, time.perf_counter() - start)
+
+
+def install_query_wrapper(connection, **kwargs):
+    """
+    connection_created receiver adding record_query to every connection.
+
+    Recorders are kept in a context variable rather than on connections,
+    so the queries async views run in worker threads are counted too.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextlib.contextmanager
+def record_queries():
+    """
+    Record the queries run in the block, yields the QueryRecorder.
+    """
+    recorder = QueryRecorder(parent=_recorder.get())
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextlib.contextmanager
+def assert_query_budget(max_queries, max_duplicates=None):
+    """
+    Fail when the block runs more than `max_queries` queries or, when
+    given, repeats one query more than `max_duplicates` times, e.g.
+
+        with assert_query_budget(4, max_duplicates=1):
+            client.get("/sessions/?expand=patient,nurse")
+
+    The error lists the queries so N+1 loops can be spotted in CI logs.
+    """
+    with record_queries() as recorder:
+        yield recorder
+
+    problems = []
+    if recorder.count > max_queries:
+        problems.append(f"{recorder.count} queries, the budget is {max_queries}")
+    if max_duplicates is not None:
+        problems += [
+            f"{count} times: {sql}"
+            for sql, count in recorder.duplicates(max_duplicates + 1).items()
+        ]
+    if problems:
+        queries = "\n".join(f"  [{alias}] {sql}" for alias, sql, _ in recorder.queries)
+        raise QueryBudgetExceeded("\n".join(problems) + "\nQueries:\n" + queries)
+
+
+class QueryCountMiddleware:
+    """
+    Count the queries of each request and the time spent in them.
+
+    Depending on QUERY_INSTRUMENTATION, the stats go to a Server-Timing
+    header (on in DEBUG) and to the users.instrumentation logger (on in
+    production) with `db_queries`, `db_time_ms` and `db_duplicates`
+    extras for log based metrics. Queries repeated DUPLICATE_THRESHOLD
+    times in one request are logged as likely N+1 loops.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        self.report(request, response, recorder)
+        return response
+
+    async def __acall__(self, request):
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        self.report(request, response, recorder)
+        return response
+
+    def report(self, request, response, recorder):
+        if get_instrumentation_setting("SERVER_TIMING"):
+            response["Server-Timing"] = recorder.server_timing()
+
+        duplicates = recorder.duplicates(get_instrumentation_setting("DUPLICATE_THRESHOLD"))
+        for sql, count in duplicates.items():
+            logger.warning(
+                "Possible N+1 on %s %s: query run %d times: %s",
+                request.method,
+                request.path,
+                count,
+                sql,
+            )
+        if get_instrumentation_setting("LOG_REQUESTS"):
+            logger.info(
+                "%s %s %s: %d queries in %.1f ms",
+                request.method,
+                request.path,
+                response.status_code,
+                recorder.count,
+                recorder.duration * 1000,
+                extra={
+                    "db_queries": recorder.count,
+                    "db_time_ms": round(recorder.duration * 1000, 3),
+                    "db_duplicates": sum(count - 1 for count in recorder.duplicates().values()),
+                },
+            )
@@ -0,0 +1,352 @@
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def get_job_setting(name):
+    defaults = {
+        # threads of a run_jobs worker
+        "CONCURRENCY": 2,
+        # seconds an idle worker waits before looking for jobs again
+        "POLL_INTERVAL": 1,
+        "MAX_ATTEMPTS": 5,
+        # retry delays double from BACKOFF_BASE seconds up to BACKOFF_MAX
+        "BACKOFF_BASE": 10,
+        "BACKOFF_MAX": 3600,
+        # a job whose lease wasn't renewed for this long is considered lost
+        # (crashed worker) and queued again, running jobs renew it every
+        # third of it
+        "LEASE_SECONDS": 600,
+        # seconds between two runs of the scheduler of a worker
+        "SCHEDULE_INTERVAL": 60,
+        # finished jobs are deleted after this many seconds
+        "KEEP_FINISHED_SECONDS": 7 * 86400,
+    }
+    return getattr(settings, "JOB_QUEUE", {}).get(name, defaults[name])
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: object
+    max_attempts: int | None = None
+
+
+# registered tasks by name, see task()
+TASKS = {}
+
+
+def task(name, max_attempts=None):
+    """
+    Register the decorated function as the task `name`. It is called with
+    the kwargs of the job, JSON serializable values only.
+
+    A job can run more than once (a worker dying before recording its
+    success), tasks must be idempotent.
+    """
+
+    def decorator(func):
+        TASKS[name] = Task(name, func, max_attempts)
+        return func
+
+    return decorator
+
+
+def build_job(name, run_at=None, dedupe_key=None, **kwargs):
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}.")
+    return Job(
+        name=name,
+        kwargs=kwargs,
+        run_at=run_at or timezone.now(),
+        max_attempts=TASKS[name].max_attempts or get_job_setting("MAX_ATTEMPTS"),
+        dedupe_key=dedupe_key,
+    )
+
+
+def enqueue(name, run_at=None, dedupe_key=None, **kwargs):
+    """
+    Queue the task `name` to run with `kwargs` at `run_at` (now by
+    default).
+
+    The job is written in the current transaction, it only becomes visible
+    to workers if that transaction commits. Returns the job, None when one
+    with the same `dedupe_key` already exists.
+    """
+    job = build_job(name, run_at, dedupe_key, **kwargs)
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if dedupe_key is None:
+            raise
+        return None
+    return job
+
+
+def enqueue_many(jobs):
+    """
+    Queue `jobs` built by build_job() with one insert, those whose
+    `dedupe_key` exists are skipped.
+    """
+    Job.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def retry_delay(attempts):
+    """
+    Seconds before retrying a job that failed `attempts` times: doubling
+    from BACKOFF_BASE, capped at BACKOFF_MAX, with jitter so jobs failing
+    together don't retry together.
+    """
+    delay = min(
+        get_job_setting("BACKOFF_BASE") * 2 ** (attempts - 1),
+        get_job_setting("BACKOFF_MAX"),
+    )
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(worker, limit=1):
+    """
+    Take up to `limit` due jobs for `worker`. Rows locked by a concurrent
+    claim are skipped instead of waited for, workers never queue behind
+    each other.
+
+    The jobs are locked by a token of this claim, not by the worker: the
+    threads of a worker never record the outcome of a job claimed again by
+    another of its threads after its lease expired.
+    """
+    now = timezone.now()
+    token = f"{worker}:{uuid.uuid4().hex[:12]}"
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.QUEUED, run_at__lte=now)
+            .order_by("run_at")[:limit]
+        )
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.Status.RUNNING,
+                locked_by=token,
+                locked_at=now,
+                attempts=F("attempts") + 1,
+            )
+    for job in jobs:
+        job.status, job.locked_by, job.locked_at = Job.Status.RUNNING, token, now
+        job.attempts += 1
+    return jobs
+
+
+def get_owned(job):
+    """
+    `job` while it is still held by the claim that took it, a job queued
+    again after its lease expired belongs to whoever claimed it next.
+    """
+    return Job.objects.filter(
+        pk=job.pk, status=Job.Status.RUNNING, locked_by=job.locked_by
+    )
+
+
+class LeaseRenewal:
+    """
+    Thread renewing the lease of a running job every `interval` seconds
+    until stopped, so jobs running longer than LEASE_SECONDS are not taken
+    for lost.
+    """
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or get_job_setting("LEASE_SECONDS") / 3
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name=f"job-lease-{job.pk}", daemon=True
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopping.wait(self.interval):
+                if not get_owned(self.job).update(locked_at=timezone.now()):
+                    logger.warning(
+                        "Job %s (%s) lost its lease", self.job.pk, self.job.name
+                    )
+                    return
+        except Exception:
+            logger.exception("Renewing the lease of job %s failed", self.job.pk)
+        finally:
+            connections.close_all()
+
+
+def execute(job):
+    """
+    Run a claimed job and record its outcome.
+    """
+    # only the claim holding the lease records the outcome
+    owned = get_owned(job)
+    try:
+        registered = TASKS.get(job.name)
+        if registered is None:
+            raise LookupError(f"Unknown task {job.name!r}.")
+        with LeaseRenewal(job):
+            registered.func(**job.kwargs)
+    except Exception as exc:
+        error = "".join(traceback.format_exception(exc))[-4000:]
+        now = timezone.now()
+        if isinstance(exc, LookupError) or job.attempts >= job.max_attempts:
+            logger.exception("Job %s (%s) failed", job.pk, job.name)
+            owned.update(
+                status=Job.Status.FAILED, last_error=error, finished_at=now, locked_by=""
+            )
+        else:
+            delay = retry_delay(job.attempts)
+            logger.warning(
+                "Job %s (%s) failed, retrying in %.0fs: %s", job.pk, job.name, delay, exc
+            )
+            owned.update(
+                status=Job.Status.QUEUED,
+                last_error=error,
+                run_at=now + datetime.timedelta(seconds=delay),
+                locked_by="",
+                locked_at=None,
+            )
+        return False
+    owned.update(status=Job.Status.DONE, finished_at=timezone.now(), locked_by="")
+    return True
+
+
+def requeue_expired():
+    """
+    Queue again the jobs whose lease wasn't renewed for LEASE_SECONDS, or
+    fail them when they have no attempt left. Returns how many.
+    """
+    now = timezone.now()
+    lease = datetime.timedelta(seconds=get_job_setting("LEASE_SECONDS"))
+    expired = Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=now - lease)
+    failed = expired.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.Status.FAILED,
+        last_error="The worker running the job was lost.",
+        finished_at=now,
+        locked_by="",
+    )
+    queued = expired.update(
+        status=Job.Status.QUEUED, run_at=now, locked_by="", locked_at=None
+    )
+    return failed + queued
+
+
+def purge_finished():
+    """
+    Delete jobs finished more than KEEP_FINISHED_SECONDS ago.
+    """
+    before = timezone.now() - datetime.timedelta(
+        seconds=get_job_setting("KEEP_FINISHED_SECONDS")
+    )
+    deleted, _ = Job.objects.filter(finished_at__lt=before).delete()
+    return deleted
+
+
+# run by each worker every SCHEDULE_INTERVAL, see schedule()
+SCHEDULERS = []
+
+
+def schedule(func):
+    """
+    Register `func` to be called periodically by the workers. Workers run
+    schedulers concurrently, they must only enqueue jobs with a
+    `dedupe_key` or be otherwise safe to run twice.
+    """
+    SCHEDULERS.append(func)
+    return func
+
+
+class Worker:
+    """
+    `concurrency` threads claiming and running jobs until stopped, the
+    calling thread runs the schedulers.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None, run_schedulers=True):
+        self.concurrency = concurrency or get_job_setting("CONCURRENCY")
+        self.poll_interval = poll_interval or get_job_setting("POLL_INTERVAL")
+        self.run_schedulers = run_schedulers
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self.stopping.set()
+
+    def tick(self):
+        """
+        One run of the housekeeping and of every registered scheduler.
+        """
+        for func in [requeue_expired, purge_finished, *SCHEDULERS]:
+            try:
+                func()
+            except Exception:
+                logger.exception("Scheduler %s failed", func.__name__)
+        connections.close_all()
+
+    def _consume(self, drain):
+        try:
+            while not self.stopping.is_set():
+                jobs = claim(self.name)
+                if not jobs:
+                    if drain:
+                        return
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                for job in jobs:
+                    succeeded = execute(job)
+                    with self._lock:
+                        self.processed += 1
+                        self.failed += not succeeded
+        finally:
+            # each thread holds its own connections
+            connections.close_all()
+
+    def run(self, drain=False):
+        """
+        Work until stop() is called, or with `drain` until no job is due.
+        """
+        if self.run_schedulers:
+            self.tick()
+        threads = [
+            threading.Thread(
+                target=self._consume, args=(drain,), name=f"job-worker-{number}"
+            )
+            for number in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        interval = get_job_setting("SCHEDULE_INTERVAL")
+        while any(thread.is_alive() for thread in threads):
+            if self.stopping.wait(0.1 if drain else interval):
+                break
+            if self.run_schedulers and not drain:
+                self.tick()
+        for thread in threads:
+            thread.join()
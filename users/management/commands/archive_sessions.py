@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from users.partitions import archive_series, ensure_future_partitions, get_archive_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the session archive ahead of time "
+        "and move fully consumed courses older than the retention window "
+        "into it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=get_archive_setting("RETENTION_DAYS"),
+            help="Archive courses whose last session ended this many days ago.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=get_archive_setting("BATCH_SIZE"),
+            help="Courses moved per transaction.",
+        )
+        parser.add_argument(
+            "--partitions-only",
+            action="store_true",
+            help="Only create the partitions of the coming months.",
+        )
+
+    def handle(self, *args, **options):
+        created = ensure_future_partitions()
+        self.stdout.write(f"Created {len(created)} partitions.")
+        if options["partitions_only"]:
+            return
+        series, sessions = archive_series(options["retention_days"], options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Archived {sessions} sessions of {series} courses.")
+        )
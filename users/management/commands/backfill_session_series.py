@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from users.models import Session, sessions_changed
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign series and ordinal to sessions linked only through "
+        "prev_session/next_session, walking every chain in one recursive query."
+    )
+
+    def handle(self, *args, **options):
+        table = connection.ops.quote_name(Session._meta.db_table)
+        # every chain takes the series of its head session, ordinals follow
+        # the prev_session links
+        sql = f"""
+            WITH RECURSIVE chain (head_id, id, ordinal) AS (
+                SELECT id, id, 1 FROM {table} WHERE prev_session_id IS NULL
+                UNION ALL
+                SELECT chain.head_id, session.id, chain.ordinal + 1
+                FROM {table} session
+                JOIN chain ON session.prev_session_id = chain.id
+            )
+            UPDATE {table} session
+            SET series = head.series, ordinal = chain.ordinal
+            FROM chain
+            JOIN {table} head ON head.id = chain.head_id
+            WHERE session.id = chain.id
+              AND (session.series != head.series OR session.ordinal != chain.ordinal)
+            RETURNING session.start_time
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql)
+            start_times = [row[0] for row in cursor.fetchall()]
+            updated = len(start_times)
+            # ordinals decide which sessions count as consumed in the rollups
+            sessions_changed.send(sender=Session, start_times=start_times)
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} sessions."))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.models import IDENTITY_MODELS, UserIdentity
+
+
+class Command(BaseCommand):
+    help = "Build the user identity index for existing patients, nurses and admins."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of index rows written per bulk insert.",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Delete the whole index before building it again.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        with transaction.atomic():
+            if options["rebuild"]:
+                UserIdentity.objects.all().delete()
+
+            for identity, model in IDENTITY_MODELS.items():
+                fields = ["id", "email", "national_id", "first_name", "last_name", "city"]
+                if hasattr(model, "specialization"):
+                    fields.append("specialization")
+                rows = model.objects.only(*fields)
+                batch = []
+                total = 0
+                for user in rows.iterator(chunk_size=batch_size):
+                    batch.append(
+                        UserIdentity(
+                            identity=identity,
+                            user_id=user.pk,
+                            **UserIdentity.fields_for(user),
+                        )
+                    )
+                    if len(batch) >= batch_size:
+                        total += self._write(batch)
+                        batch = []
+                total += self._write(batch)
+                self.stdout.write(f"{model.__name__}: indexed {total} users")
+
+        self.stdout.write(self.style.SUCCESS("Identity index is up to date."))
+
+    def _write(self, batch):
+        UserIdentity.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["identity", "user_id"],
+            update_fields=["email", "national_id", "search_text"],
+        )
+        return len(batch)
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+ENGINES = {
+    "unpooled": "django.db.backends.postgresql",
+    "pooled": "Kraston.db_pool",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare simulated requests/sec with and without connection pooling. "
+        "Each request connects, runs one query and closes like a request "
+        "with CONN_MAX_AGE=0 does."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--pool-size", type=int, default=8)
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options["database"]].settings_dict
+        for name, engine in ENGINES.items():
+            elapsed = self.run(
+                {
+                    **settings_dict,
+                    "ENGINE": engine,
+                    "CONN_MAX_AGE": 0,
+                    "POOL": {**settings_dict.get("POOL", {}), "MAX_SIZE": options["pool_size"]},
+                },
+                options["database"],
+                options["requests"],
+                options["threads"],
+            )
+            self.stdout.write(
+                f"{name:>9}: {options['requests']} requests in {elapsed:.2f}s, "
+                f"{options['requests'] / elapsed:.0f} requests/sec"
+            )
+
+    def run(self, settings_dict, alias, requests, threads):
+        backend = load_backend(settings_dict["ENGINE"])
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+        errors = []
+
+        def work():
+            connection = backend.DatabaseWrapper(settings_dict, alias)
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    connection.ensure_connection()
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                        cursor.fetchone()
+                    connection.close()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        if hasattr(backend, "close_pools"):
+            backend.close_pools()
+        if errors:
+            raise errors[0]
+        return elapsed
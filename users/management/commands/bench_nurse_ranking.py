@@ -0,0 +1,98 @@
+import math
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from users.matching import DEFAULT_WEIGHTS, haversine_km, score_nurses, top_k
+
+SPECIALIZATIONS = np.array(["pediatrics", "geriatrics", "oncology", "cardiology", "wound care"])
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized nurse scorer on a synthetic dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nurses", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        count = options["nurses"]
+        # nurses spread over ~50 km around Cairo
+        latitude, longitude, radius_km = 30.0444, 31.2357, 50.0
+        latitudes = latitude + rng.uniform(-0.45, 0.45, count)
+        longitudes = longitude + rng.uniform(-0.52, 0.52, count)
+        specializations = SPECIALIZATIONS[rng.integers(0, len(SPECIALIZATIONS), count)]
+        is_free = rng.random(count) < 0.3
+        prices = rng.uniform(100, 1000, count)
+        prices[rng.random(count) < 0.1] = np.nan
+
+        def rank():
+            distances = haversine_km(latitude, longitude, latitudes, longitudes)
+            inside = distances <= radius_km
+            scores = score_nurses(
+                distances[inside],
+                radius_km,
+                (specializations[inside] == "pediatrics").astype(float),
+                is_free[inside].astype(float),
+                prices[inside],
+            )
+            return top_k(scores, options["limit"])
+
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            rank()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"numpy: {count} nurses, p50={statistics.median(timings):.2f}ms "
+            f"p95={p95:.2f}ms"
+        )
+
+        started = time.perf_counter()
+        self.rank_python(
+            latitude, longitude, radius_km, latitudes, longitudes,
+            specializations, is_free, prices, options["limit"],
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"pure python: {count} nurses, {elapsed:.2f}ms")
+
+    @staticmethod
+    def rank_python(latitude, longitude, radius_km, latitudes, longitudes,
+                    specializations, is_free, prices, limit):
+        """
+        Row by row equivalent of the vectorized scorer, for comparison.
+        """
+        lat1 = math.radians(latitude)
+        candidates = []
+        for i in range(len(latitudes)):
+            lat2 = math.radians(latitudes[i])
+            a = (
+                math.sin((lat2 - lat1) / 2) ** 2
+                + math.cos(lat1) * math.cos(lat2)
+                * math.sin(math.radians(longitudes[i] - longitude) / 2) ** 2
+            )
+            distance = 2 * 6371.0088 * math.asin(math.sqrt(a))
+            if distance <= radius_km:
+                candidates.append((i, distance))
+        known = [prices[i] for i, _ in candidates if not math.isnan(prices[i])]
+        low, high = min(known), max(known)
+        scored = []
+        for i, distance in candidates:
+            price = prices[i]
+            price_score = 0.5 if math.isnan(price) else 1 - (price - low) / (high - low)
+            scored.append((
+                DEFAULT_WEIGHTS["distance"] * max(0.0, 1 - distance / radius_km)
+                + DEFAULT_WEIGHTS["specialization"] * (specializations[i] == "pediatrics")
+                + DEFAULT_WEIGHTS["availability"] * is_free[i]
+                + DEFAULT_WEIGHTS["price"] * price_score,
+                i,
+            ))
+        scored.sort(reverse=True)
+        return scored[:limit]
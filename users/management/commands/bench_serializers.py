@@ -0,0 +1,148 @@
+import datetime
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from users.models import Nurse, Patient, Session
+from users.projections import get_projection
+from users.renderers import FastJSONRenderer
+from users.serializers import NurseSerializer, PatientSerializer, SessionSerializer
+
+
+def build_patient(i):
+    return Patient(
+        id=i,
+        identity="P",
+        national_id=f"{i:014d}",
+        username=f"patient{i}",
+        first_name="Mona",
+        last_name="Hassan",
+        email=f"patient{i}@example.com",
+        gender="F",
+        phone_number="+201000000000",
+        bio="Recovering from knee surgery — needs daily physiotherapy.",
+        nationality="Egyptian",
+        location="12 Tahrir St.",
+        city="Cairo",
+        country="Egypt",
+        date_of_birth=datetime.date(1990, 1, 1) + datetime.timedelta(days=i % 5000),
+        latitude=30.0444 + i / 100000,
+        longitude=31.2357 - i / 100000,
+        processed_media={},
+        profile_image=f"profile_images/{i}.jpg" if i % 2 else "",
+        chronic_diseases="Diabetes",
+        medical_report="",
+    )
+
+
+def build_nurse(i):
+    return Nurse(
+        id=i,
+        identity="D",
+        national_id=f"{i:014d}",
+        username=f"nurse{i}",
+        first_name="Omar",
+        last_name="Adel",
+        email=f"nurse{i}@example.com",
+        gender="M",
+        phone_number="+201100000000",
+        bio="Home care nurse.",
+        nationality="Egyptian",
+        location="5 Nile St.",
+        city="Giza",
+        country="Egypt",
+        date_of_birth=datetime.date(1985, 6, 1),
+        latitude=30.0131,
+        longitude=31.2089,
+        processed_media={"profile_image": {"status": "done", "name": "x.jpg"}},
+        profile_image="",
+        specialization="Pediatrics",
+        certificates="",
+        medical_accreditations="",
+        available_working_hours="9-17",
+        session_price=Decimal("250.00") + i,
+    )
+
+
+def build_session(i):
+    start = timezone.now().replace(microsecond=0) + datetime.timedelta(hours=i)
+    return Session(
+        id=i,
+        session_type="Physiotherapy",
+        price=Decimal("300.00"),
+        patient_id=i % 97 + 1,
+        nurse_id=i % 13 + 1,
+        paid_price=Decimal("150.50"),
+        total_sessions=10,
+        remaining_sessions=i % 10,
+        prev_session_id=i - 1 if i % 10 else None,
+        next_session_id=i + 1,
+        place="Home",
+        start_time=start,
+        end_time=start + datetime.timedelta(hours=1),
+        series=uuid.uuid4(),
+        ordinal=i % 10 + 1,
+    )
+
+
+def to_row(instance, columns):
+    """
+    `.values()` row of an unsaved instance.
+    """
+    row = {}
+    for field in instance._meta.concrete_fields:
+        value = getattr(instance, field.attname)
+        row[field.name] = value.name if hasattr(value, "name") else value
+    return {column: row[column] for column in columns}
+
+
+CASES = {
+    "patients": (build_patient, PatientSerializer),
+    "nurses": (build_nurse, NurseSerializer),
+    "sessions": (build_session, SessionSerializer),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time to serialize and render 1,000 rows with the DRF "
+        "serializers and JSONRenderer and with the read projections and "
+        "FastJSONRenderer. No database is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        for name, (build, serializer_class) in CASES.items():
+            projection = get_projection(serializer_class)
+            instances = [build(i) for i in range(1, rows + 1)]
+            values = [to_row(instance, projection.columns) for instance in instances]
+
+            def before():
+                return JSONRenderer().render(serializer_class(instances, many=True).data)
+
+            def after():
+                return FastJSONRenderer().render(projection.represent(values))
+
+            if before() != after():
+                raise CommandError(f"{name}: the fast path output differs.")
+
+            timings = {}
+            for label, render in [("before", before), ("after", after)]:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    render()
+                timings[label] = (time.perf_counter() - start) / repeat * 1000 / rows * 1000
+
+            self.stdout.write(
+                f"{name}: {timings['before']:.1f} ms per 1,000 rows before, "
+                f"{timings['after']:.1f} ms after "
+                f"({timings['before'] / timings['after']:.1f}x)"
+            )
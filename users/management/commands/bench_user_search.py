@@ -0,0 +1,109 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from users.models import Identity, UserIdentity, normalize_search_text
+from users.search import SearchQuery
+
+FIRST_NAMES = [
+    "Ahmed", "Mohamed", "Mahmoud", "Omar", "Youssef", "Mostafa", "Karim",
+    "Fatma", "Mariam", "Nour", "Salma", "Hana", "Aya", "Rana", "José", "Zoë",
+]
+LAST_NAMES = [
+    "Hassan", "Ibrahim", "Ali", "Mansour", "Saleh", "Farouk", "Gamal",
+    "Khalil", "Nasser", "Rashed", "Youssef", "Zaki", "Núñez", "Müller",
+]
+CITIES = ["Cairo", "Giza", "Alexandria", "Mansoura", "Tanta", "Aswan", "Luxor"]
+SPECIALIZATIONS = ["", "Pediatrics", "Geriatrics", "Oncology", "Cardiology"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark user search latency on a synthetic identity index. "
+        "The synthetic rows are rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+
+        with transaction.atomic():
+            self.populate(rng, options["users"], options["batch_size"])
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {UserIdentity._meta.db_table}")
+
+            first_page, next_page = [], []
+            for _ in range(options["queries"]):
+                string = self.make_query(rng)
+
+                started = time.perf_counter()
+                _, cursor = SearchQuery(string).page()
+                first_page.append(time.perf_counter() - started)
+
+                if cursor is not None:
+                    started = time.perf_counter()
+                    SearchQuery(string, cursor=cursor).page()
+                    next_page.append(time.perf_counter() - started)
+
+            self.report("first page", first_page)
+            self.report("next page", next_page)
+            transaction.set_rollback(True)
+
+    def populate(self, rng, users, batch_size):
+        identities = [Identity.PATIENT, Identity.Nurse]
+        batch = []
+        for i in range(users):
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = rng.choice(LAST_NAMES)
+            national_id = f"{29000000000000 + i}"
+            batch.append(
+                UserIdentity(
+                    identity=identities[i % 2],
+                    user_id=i,
+                    email=f"bench{i}@example.com",
+                    national_id=national_id,
+                    search_text=normalize_search_text(
+                        first_name,
+                        last_name,
+                        rng.choice(CITIES),
+                        rng.choice(SPECIALIZATIONS),
+                        national_id,
+                    ),
+                )
+            )
+            if len(batch) >= batch_size:
+                UserIdentity.objects.bulk_create(batch)
+                batch = []
+        UserIdentity.objects.bulk_create(batch)
+        self.stdout.write(f"Seeded {users} synthetic users")
+
+    @staticmethod
+    def make_query(rng):
+        """
+        A name with an occasional typo, as typed in a search box.
+        """
+        string = rng.choice(FIRST_NAMES + LAST_NAMES + CITIES)
+        if len(string) > 4 and rng.random() < 0.5:
+            i = rng.randrange(len(string))
+            string = string[:i] + string[i + 1:]
+        return string
+
+    def report(self, label, timings):
+        if not timings:
+            self.stdout.write(f"{label}: no samples")
+            return
+        timings = sorted(t * 1000 for t in timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"{label}: n={len(timings)} "
+            f"p50={statistics.median(timings):.1f}ms p95={p95:.1f}ms "
+            f"max={timings[-1]:.1f}ms"
+        )
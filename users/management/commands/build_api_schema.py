@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Prebuild the OpenAPI schema (yaml and json, plain and gzipped) "
+        "served at /api/schema/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dir",
+            help="Output directory, defaults to settings.API_SCHEMA_DIR.",
+        )
+
+    def handle(self, *args, **options):
+        for path in write_schema(options["dir"]):
+            self.stdout.write(f"Wrote {path}")
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from users.bulk import BULK_KINDS, FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Export every patient, nurse, admin or session as CSV or NDJSON, "
+        "streamed from a server-side cursor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(BULK_KINDS))
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output", default="-", help="File to write, - for stdout.")
+
+    def handle(self, *args, **options):
+        lines = export_rows(options["kind"], options["format"])
+        if options["output"] == "-":
+            for line in lines:
+                sys.stdout.write(line)
+        else:
+            with open(options["output"], "w", newline="") as file:
+                file.writelines(lines)
@@ -0,0 +1,49 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bulk import BULK_KINDS, FORMATS, decode_lines, get_importer, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import patients, nurses, admins or sessions from a CSV or NDJSON file, "
+        "in batches. Invalid rows are skipped and reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(BULK_KINDS))
+        parser.add_argument("path", help="File to import, - for stdin.")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--errors",
+            help="Write the errors of every rejected row to this NDJSON file.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or path.rsplit(".", 1)[-1]
+        if file_format not in FORMATS:
+            raise CommandError("Pass --format, it can't be told from the file name.")
+
+        importer = get_importer(options["kind"], options["batch_size"])
+        if path == "-":
+            importer.run(read_rows(decode_lines(sys.stdin.buffer), file_format))
+        else:
+            with open(path, "rb") as file:
+                importer.run(read_rows(decode_lines(file), file_format))
+
+        if options["errors"]:
+            with open(options["errors"], "w") as file:
+                for error in importer.errors:
+                    file.write(json.dumps(error) + "\n")
+        else:
+            for error in importer.errors[:20]:
+                self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+
+        self.stdout.write(f"{importer.created} created, {len(importer.errors)} rejected")
+        if importer.errors:
+            raise CommandError(f"{len(importer.errors)} rows were rejected.")
+        self.stdout.write(self.style.SUCCESS("Import done."))
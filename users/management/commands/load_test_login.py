@@ -0,0 +1,79 @@
+import statistics
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent logins at running deployments and compare their "
+        "throughput, e.g. a WSGI and an ASGI one:\n"
+        "  gunicorn Kraston.wsgi -b :8000 -w 2\n"
+        "  gunicorn Kraston.asgi:application -b :8001 -w 2 -k uvicorn.workers.UvicornWorker\n"
+        "  manage.py load_test_login --email ... --password ... "
+        "--target wsgi=http://127.0.0.1:8000/auth/login/ "
+        "--target asgi=http://127.0.0.1:8001/async/auth/login/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            required=True,
+            help="name=login url, can be repeated.",
+        )
+        parser.add_argument("--email", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=50)
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            name, sep, url = target.partition("=")
+            if not sep:
+                raise CommandError(f"Expected name=url, got {target!r}.")
+            targets.append((name, url))
+
+        credentials = {"email": options["email"], "password": options["password"]}
+        for name, url in targets:
+            elapsed, latencies, failures = self.run(
+                url, credentials, options["requests"], options["concurrency"]
+            )
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+            self.stdout.write(
+                f"{name}: {options['requests'] / elapsed:.1f} logins/sec, "
+                f"p50 {statistics.median(latencies or [0]) * 1000:.0f}ms, "
+                f"p95 {p95 * 1000:.0f}ms, {failures} failed"
+            )
+
+    def run(self, url, credentials, total, concurrency):
+        remaining = iter(range(total))
+        lock = threading.Lock()
+        latencies = []
+        failures = []
+
+        def work():
+            with requests.Session() as session:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    start = time.perf_counter()
+                    try:
+                        response = session.post(url, json=credentials, timeout=60)
+                        ok = response.status_code == 200
+                    except requests.RequestException:
+                        ok = False
+                    (latencies if ok else failures).append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, len(failures)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from users.media import get_media_fields, process_user_media
+from users.models import IDENTITY_MODELS
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate image variants and validate documents of existing users, "
+        "e.g. files uploaded before the media workers existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Process every file again, not only unprocessed or pending ones.",
+        )
+
+    def handle(self, *args, **options):
+        for identity, model in IDENTITY_MODELS.items():
+            fields = [field.name for field in get_media_fields(model)]
+            processed = 0
+            users = model.objects.only("id", "processed_media", *fields)
+            for user in users.iterator(chunk_size=500):
+                todo = [
+                    field
+                    for field in fields
+                    if getattr(user, field)
+                    and (
+                        options["all"]
+                        or user.processed_media.get(field, {}).get("status", "pending")
+                        == "pending"
+                    )
+                ]
+                if todo:
+                    process_user_media(identity, user.pk, todo)
+                    processed += 1
+            self.stdout.write(f"{model.__name__}: processed {processed} users")
+
+        self.stdout.write(self.style.SUCCESS("Media is up to date."))
@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from users.rollups import mark_range, refresh_marked
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the session rollups up to date: recompute the days changed "
+        "since their last refresh, or every day of a range with --rebuild. "
+        "The job workers run the refresh on their own; --rebuild is for backfills."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute every day with sessions or rollups, e.g. after a migration.",
+        )
+        parser.add_argument(
+            "--start", type=datetime.date.fromisoformat, help="First day rebuilt."
+        )
+        parser.add_argument(
+            "--end",
+            type=datetime.date.fromisoformat,
+            help="Day after the last one rebuilt.",
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            marked = mark_range(options["start"], options["end"])
+            self.stdout.write(f"Marked {marked} days.")
+        refreshed = refresh_marked(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} days."))
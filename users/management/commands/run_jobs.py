@@ -0,0 +1,48 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from users.jobs import Worker, get_job_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs (media processing, session reminders) and the "
+        "schedulers queueing them, until interrupted. Start as many workers "
+        "as needed, they share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=get_job_setting("CONCURRENCY"),
+            help="Jobs run at the same time, one thread each.",
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Exit once no job is due instead of waiting for more.",
+        )
+        parser.add_argument(
+            "--no-schedulers",
+            action="store_true",
+            help="Only run jobs, let other workers queue the scheduled ones.",
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options["concurrency"],
+            run_schedulers=not options["no_schedulers"],
+        )
+        # running jobs are finished before exiting
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"Worker {worker.name} running {worker.concurrency} threads.")
+        worker.run(drain=options["drain"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ran {worker.processed} jobs, {worker.failed} failed or retried."
+            )
+        )
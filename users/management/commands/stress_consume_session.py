@@ -0,0 +1,124 @@
+import datetime
+import threading
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from users.models import Nurse, Patient, Session
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent consumers at one treatment course and check that no "
+        "update is lost. The synthetic patient, nurse and sessions are deleted "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumers", type=int, default=200)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Number of threads (and database connections) consuming at once.",
+        )
+        parser.add_argument("--sessions", type=int, default=50)
+        parser.add_argument("--paid-price", type=Decimal, default=Decimal("10.00"))
+
+    def handle(self, *args, **options):
+        consumers = options["consumers"]
+        concurrency = min(options["concurrency"], consumers)
+        total = options["sessions"]
+        paid_price = options["paid_price"]
+
+        patient, nurse = self.create_participants()
+        try:
+            start = timezone.now()
+            slots = [
+                (start + datetime.timedelta(days=i), start + datetime.timedelta(days=i, hours=1))
+                for i in range(total)
+            ]
+            series = Session.objects.book_series(
+                patient, nurse, "stress", Decimal("100.00"), "stress", slots
+            )[0].series
+
+            results = []
+            errors = []
+            attempts = iter(range(consumers))
+            lock = threading.Lock()
+            barrier = threading.Barrier(concurrency)
+
+            def consume():
+                try:
+                    barrier.wait()
+                    while True:
+                        with lock:
+                            if next(attempts, None) is None:
+                                return
+                        results.append(Session.objects.consume(series, paid_price))
+                except Exception as exc:
+                    errors.append(exc)
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=consume) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            succeeded = [state for state in results if state is not None]
+            expected = min(consumers, total)
+            counters = set(
+                Session.objects.chain(series).values_list(
+                    "remaining_sessions", "paid_price"
+                )
+            )
+            ordinals = sorted(state["consumed_ordinal"] for state in succeeded)
+
+            self.stdout.write(
+                f"{consumers} consumers, {total} sessions: "
+                f"{len(succeeded)} consumed, {len(results) - len(succeeded)} refused"
+            )
+            if errors:
+                raise CommandError(f"{len(errors)} consumers failed: {errors[0]!r}")
+            if len(succeeded) != expected:
+                raise CommandError(f"Expected {expected} consumptions, got {len(succeeded)}.")
+            if counters != {(total - expected, paid_price * expected)}:
+                raise CommandError(f"Course counters are inconsistent: {counters}")
+            if ordinals != list(range(1, expected + 1)):
+                raise CommandError("A session was consumed twice.")
+        finally:
+            patient.delete()
+            nurse.delete()
+
+        self.stdout.write(self.style.SUCCESS("No lost updates."))
+
+    def create_participants(self):
+        common = {
+            "gender": "F",
+            "phone_number": "0",
+            "nationality": "stress",
+            "location": "stress",
+            "city": "stress",
+            "country": "stress",
+            "date_of_birth": datetime.date(1990, 1, 1),
+        }
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        patient = Patient.objects.create(
+            username=f"stress-patient-{suffix}",
+            email=f"stress-patient-{suffix}@example.com",
+            national_id=f"stress-patient-{suffix}",
+            **common,
+        )
+        nurse = Nurse.objects.create(
+            username=f"stress-nurse-{suffix}",
+            email=f"stress-nurse-{suffix}@example.com",
+            national_id=f"stress-nurse-{suffix}",
+            specialization="stress",
+            available_working_hours="",
+            **common,
+        )
+        return patient, nurse
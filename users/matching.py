@@ -0,0 +1,138 @@
+import numpy as np
+
+from .models import Nurse
+
+EARTH_RADIUS_KM = 6371.0088
+
+# weight of each criterion in the final score, the score is in [0, 1]
+DEFAULT_WEIGHTS = {
+    "distance": 0.4,
+    "specialization": 0.3,
+    "availability": 0.2,
+    "price": 0.1,
+}
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great circle distances in km from one point to arrays of points.
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def score_nurses(
+    distances,
+    radius_km,
+    specialization_match,
+    is_free,
+    prices,
+    weights=DEFAULT_WEIGHTS,
+):
+    """
+    Score candidates from arrays of their criteria, higher is better.
+
+    Distances score linearly from 1 at the patient to 0 at `radius_km`,
+    prices from 1 for the cheapest candidate to 0 for the most expensive
+    one (unknown prices, NaN, score 0.5).
+    """
+    distance_score = np.clip(1 - distances / radius_km, 0, 1)
+
+    price_score = np.full(prices.shape, 0.5)
+    known = ~np.isnan(prices)
+    if known.any():
+        low, high = prices[known].min(), prices[known].max()
+        spread = high - low
+        price_score[known] = 1 - (prices[known] - low) / spread if spread else 1.0
+
+    return (
+        weights["distance"] * distance_score
+        + weights["specialization"] * specialization_match
+        + weights["availability"] * is_free
+        + weights["price"] * price_score
+    )
+
+
+def top_k(scores, k):
+    """
+    Indices of the `k` best scores, best first.
+    """
+    if k < len(scores):
+        best = np.argpartition(-scores, k)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def match_nurses(
+    latitude,
+    longitude,
+    radius_km,
+    specialization=None,
+    start=None,
+    end=None,
+    limit=20,
+    weights=DEFAULT_WEIGHTS,
+):
+    """
+    Best nurses for a patient at (`latitude`, `longitude`).
+
+    Candidates are prefiltered in SQL by the bounding box of `radius_km`,
+    their criteria fetched as plain columns in one query and scored with
+    NumPy. When a `[start, end)` window is given, availability counts in
+    the score.
+
+    Returns nurses best first, each with `distance_km` and `score` set.
+    """
+    queryset = Nurse.objects.within_box(latitude, longitude, radius_km)
+    columns = ["id", "latitude", "longitude", "specialization", "session_price"]
+    if start is not None and end is not None:
+        queryset = queryset.annotate_availability(start, end)
+        columns.append("is_free")
+
+    rows = list(queryset.values_list(*columns))
+    if not rows:
+        return []
+
+    data = list(zip(*rows))
+    ids = np.array(data[0])
+    distances = haversine_km(
+        latitude, longitude, np.array(data[1], dtype=float), np.array(data[2], dtype=float)
+    )
+    if specialization:
+        specializations = np.char.lower(np.array(data[3], dtype=str))
+        specialization_match = (specializations == specialization.lower()).astype(float)
+    else:
+        specialization_match = np.zeros(len(ids))
+    prices = np.array([np.nan if p is None else float(p) for p in data[4]])
+    if len(data) > 5:
+        is_free = np.array(data[5], dtype=float)
+    else:
+        is_free = np.zeros(len(ids))
+
+    inside = distances <= radius_km
+    ids, distances = ids[inside], distances[inside]
+    scores = score_nurses(
+        distances,
+        radius_km,
+        specialization_match[inside],
+        is_free[inside],
+        prices[inside],
+        weights,
+    )
+
+    best = top_k(scores, limit)
+    nurses = Nurse.objects.in_bulk(ids[best].tolist())
+    matches = []
+    for i in best:
+        nurse = nurses.get(int(ids[i]))
+        if nurse is None:
+            continue
+        nurse.distance_km = float(distances[i])
+        nurse.score = float(scores[i])
+        matches.append(nurse)
+    return matches
@@ -0,0 +1,151 @@
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .auth_cache import principal_cache
+from .jobs import enqueue, task
+from .models import IDENTITY_MODELS
+from .profile_cache import profile_cache
+
+logger = logging.getLogger(__name__)
+
+# longest side of each WebP variant of an uploaded image
+IMAGE_VARIANTS = {
+    "thumbnail": 128,
+    "medium": 512,
+}
+WEBP_QUALITY = 80
+
+# accepted documents, by leading bytes
+DOCUMENT_SIGNATURES = {
+    b"%PDF-": "application/pdf",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+}
+
+
+def get_media_fields(model):
+    return [field for field in model._meta.get_fields() if isinstance(field, models.FileField)]
+
+
+def get_variant_name(name, variant):
+    """
+    Storage name of a variant: profile_images/a.jpg -> profile_images/variants/a.thumbnail.webp
+    """
+    directory, filename = posixpath.split(name)
+    root = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{root}.{variant}.webp")
+
+
+def process_image(file):
+    """
+    Write the WebP variants of an image file, returns its processing state.
+    """
+    with file.open("rb"):
+        image = Image.open(file)
+        # let the JPEG decoder downscale while decoding
+        size = max(IMAGE_VARIANTS.values())
+        image.draft("RGB", (size, size))
+        image.load()
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, "WEBP", quality=WEBP_QUALITY)
+        name = get_variant_name(file.name, variant)
+        if file.storage.exists(name):
+            file.storage.delete(name)
+        variants[variant] = file.storage.save(name, ContentFile(buffer.getvalue()))
+    return {"status": "ready", "variants": variants}
+
+
+def validate_document(file):
+    """
+    Check the size and type of an uploaded document, returns its processing
+    state.
+    """
+    if file.size > settings.MEDIA_MAX_DOCUMENT_SIZE:
+        return {"status": "rejected", "error": "File is too large."}
+
+    with file.open("rb"):
+        header = file.read(8)
+        content_type = next(
+            (
+                content_type
+                for signature, content_type in DOCUMENT_SIGNATURES.items()
+                if header.startswith(signature)
+            ),
+            None,
+        )
+        if content_type is None:
+            return {"status": "rejected", "error": "Only PDF, PNG and JPEG files are accepted."}
+        if content_type == "application/pdf":
+            file.seek(max(file.size - 1024, 0))
+            if b"%%EOF" not in file.read():
+                return {"status": "rejected", "error": "Truncated PDF file."}
+        else:
+            file.seek(0)
+            try:
+                Image.open(file).verify()
+            except Exception:
+                return {"status": "rejected", "error": "Corrupted image file."}
+    return {"status": "valid", "content_type": content_type}
+
+
+@task("process_user_media")
+def process_user_media(identity, pk, fields):
+    """
+    Process the `fields` files of a user and store the result in its
+    `processed_media`, unless the file was replaced meanwhile.
+    """
+    model = IDENTITY_MODELS[identity]
+    user = model.objects.filter(pk=pk).first()
+    if user is None:
+        return
+
+    results = {}
+    for field in fields:
+        file = getattr(user, field)
+        if not file:
+            continue
+        try:
+            if isinstance(file.field, models.ImageField):
+                result = process_image(file)
+            else:
+                result = validate_document(file)
+        except Exception as exc:
+            logger.warning("Could not process %s of %s %s: %s", field, identity, pk, exc)
+            result = {"status": "failed", "error": "The file could not be processed."}
+        results[field] = {"name": file.name, **result}
+
+    with transaction.atomic():
+        user = model.objects.select_for_update().filter(pk=pk).first()
+        if user is None:
+            return
+        media = dict(user.processed_media)
+        for field, result in results.items():
+            if getattr(user, field).name == result["name"]:
+                media[field] = result
+        model.objects.filter(pk=pk).update(processed_media=media, updated_at=timezone.now())
+    principal_cache.invalidate_user(user)
+    profile_cache.invalidate(identity, pk)
+
+
+def schedule_media_processing(user, fields):
+    """
+    Queue the processing of the `fields` files of `user` for the run_jobs
+    workers, in the transaction saving them.
+    """
+    enqueue("process_user_media", identity=user.identity, pk=user.pk, fields=list(fields))
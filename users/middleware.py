@@ -1,36 +1,211 @@
-# import jwt
-# from django.utils.deprecation import MiddlewareMixin
-# from django.http import JsonResponse
-# from users.models import User
-
-
-# class AuthenticationMiddleware(MiddlewareMixin):
-#     EXEMPT_PATHS = [
-#         "/auth/register/",
-#         "/auth/login/",
-#         "/api/schema/",
-#         "/api/schema/swagger-ui/",
-#         "/api/schema/redoc/",
-#     ]
-
-#     def process_request(self, request):
-#         if any(
-#             request.path.startswith(exempt_path) for exempt_path in self.EXEMPT_PATHS
-#         ):
-#             return None
-
-#         token = request.headers.get("Authorization") or request.COOKIES.get("jwt")
-
-#         if not token:
-#             return JsonResponse({"detail": "Unauthenticated!"}, status=403)
-
-#         try:
-#             payload = jwt.decode(token, "secret", algorithms=["HS256"])
-#         except jwt.ExpiredSignatureError:
-#             return JsonResponse({"detail": "Unauthenticated!"}, status=403)
-
-#         user = User.objects.filter(id=payload["id"]).first()
-#         if not user:
-#             return JsonResponse({"detail": "Unauthenticated!"}, status=403)
-
-#         request.user = user
+import hashlib
+import time
+
+import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+from django.http import JsonResponse
+from users.auth_cache import principal_cache
+from users.models import IDENTITY_MODELS
+from users.routing import get_replicas, get_routing_setting, use_replicas
+
+
+def get_token_id(token, payload):
+    """
+    Id used to key the principal cache: the `jti` claim when the token
+    carries one, otherwise a digest of the token itself.
+    """
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_user_for_payload(payload):
+    """
+    Load the user a verified token belongs to with a single indexed query.
+
+    User ids are only unique per table, so tokens without an `identity`
+    claim are rejected.
+    """
+    model = IDENTITY_MODELS.get(payload.get("identity"))
+    if model is None:
+        return None
+    return model.objects.filter(id=payload["id"]).first()
+
+
+def authenticate_token(token):
+    """
+    Return the user authenticated by `token`, or None when the token is
+    invalid, expired, revoked or its user is gone.
+
+    Warm tokens are served from the principal cache without any query.
+    """
+    try:
+        payload = jwt.decode(token, "secret", algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+
+    token_id = get_token_id(token, payload)
+    user = principal_cache.get(token_id)
+    if user is None:
+        if principal_cache.is_revoked(token_id):
+            return None
+
+        user = get_user_for_payload(payload)
+        if user is not None:
+            principal_cache.set(token_id, user)
+    return user
+
+
+async def aget_user_for_payload(payload):
+    """
+    Async get_user_for_payload().
+    """
+    model = IDENTITY_MODELS.get(payload.get("identity"))
+    if model is None:
+        return None
+    return await model.objects.filter(id=payload["id"]).afirst()
+
+
+async def aauthenticate_token(token):
+    """
+    Async authenticate_token(), for async views.
+    """
+    try:
+        payload = jwt.decode(token, "secret", algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+
+    token_id = get_token_id(token, payload)
+    user = principal_cache.get(token_id)
+    if user is None:
+        if principal_cache.is_revoked(token_id):
+            return None
+
+        user = await aget_user_for_payload(payload)
+        if user is not None:
+            principal_cache.set(token_id, user)
+    return user
+
+
+def get_request_token(request):
+    return request.headers.get("Authorization") or request.COOKIES.get("jwt")
+
+
+def revoke_token(token):
+    """
+    Revoke a token on logout so it is no longer served from the cache.
+    """
+    try:
+        payload = jwt.decode(token, "secret", algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return
+    principal_cache.revoke(get_token_id(token, payload), payload.get("exp"))
+
+
+class AuthenticationMiddleware(MiddlewareMixin):
+    EXEMPT_PATHS = [
+        "/auth/register/",
+        "/auth/login/",
+        # an expired token can still log out, to drop its cookie
+        "/auth/logout/",
+        "/async/auth/register/",
+        "/async/auth/login/",
+        "/async/auth/logout/",
+        # session authenticated by django.contrib.auth
+        "/admin/",
+        "/api/schema/",
+        "/api/schema/swagger-ui/",
+        "/api/schema/redoc/",
+    ]
+
+    def process_request(self, request):
+        if any(
+            request.path.startswith(exempt_path) for exempt_path in self.EXEMPT_PATHS
+        ):
+            return None
+
+        token = get_request_token(request)
+
+        if not token:
+            return JsonResponse({"detail": "Unauthenticated!"}, status=403)
+
+        user = authenticate_token(token)
+        if not user:
+            return JsonResponse({"detail": "Unauthenticated!"}, status=403)
+
+        request.user = user
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Read safe requests from the replicas, except for clients that wrote
+    recently.
+
+    A successful unsafe request pins its client to the primary for
+    READ_YOUR_WRITES_SECONDS, through a cookie and, for token clients that
+    drop cookies, a cache entry keyed by the token's identity and id claims.
+    """
+
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+    COOKIE_NAME = "primary_until"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with use_replicas(self.reads_from_replicas(request)):
+            response = self.get_response(request)
+        if request.method not in self.SAFE_METHODS and response.status_code < 400:
+            self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        with use_replicas(self.reads_from_replicas(request)):
+            response = await self.get_response(request)
+        if request.method not in self.SAFE_METHODS and response.status_code < 400:
+            self.pin(request, response)
+        return response
+
+    def reads_from_replicas(self, request):
+        return request.method in self.SAFE_METHODS and not self.is_pinned(request)
+
+    @staticmethod
+    def get_principal_key(request):
+        token = get_request_token(request)
+        if not token:
+            return None
+        try:
+            payload = jwt.decode(token, "secret", algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            return None
+        return f"primary_until:{payload.get('identity')}:{payload.get('id')}"
+
+    def is_pinned(self, request):
+        now = time.time()
+        try:
+            if float(request.COOKIES.get(self.COOKIE_NAME, 0)) > now:
+                return True
+        except ValueError:
+            pass
+        key = self.get_principal_key(request)
+        cache = caches[get_routing_setting("CACHE_ALIAS")]
+        return key is not None and cache.get(key, 0) > now
+
+    def pin(self, request, response):
+        window = get_routing_setting("READ_YOUR_WRITES_SECONDS")
+        until = time.time() + window
+        response.set_cookie(
+            self.COOKIE_NAME, f"{until:.3f}", max_age=window, httponly=True, samesite="Lax"
+        )
+        key = self.get_principal_key(request)
+        if key is not None:
+            caches[get_routing_setting("CACHE_ALIAS")].set(key, until, window)
@@ -1,6 +1,21 @@
+import math
+import unicodedata
+import uuid
+
 from django.utils import timezone
-from django.db import models
-from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.db import IntegrityError, connections, models, router, transaction
+from django.contrib.auth.models import AbstractUser, Group, Permission, UserManager
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import (
+    DateTimeRangeField,
+    IntegerRangeField,
+    RangeOperators,
+)
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import Exists, ExpressionWrapper, F, Func, OuterRef
+from django.dispatch import Signal
+from psycopg2.extras import DateTimeTZRange, NumericRange
 
 
 class Gender(models.TextChoices):
@@ -35,6 +50,18 @@ class User(AbstractUser):
     city = models.CharField(max_length=55)
     country = models.CharField(max_length=55)
     date_of_birth = models.DateField()
+    # geocoded coordinates of `location`, in degrees
+    latitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    # state of the uploaded files per field, filled by users.media workers:
+    # {"profile_image": {"status": "ready", "variants": {...}}, ...}
+    processed_media = models.JSONField(default=dict, blank=True, editable=False)
+    # validator of conditional requests, also set by the queryset updates
+    updated_at = models.DateTimeField(auto_now=True)
 
     is_staff = None
     is_active = None
@@ -49,6 +76,23 @@ class User(AbstractUser):
 
     class Meta:
         abstract = True
+        # filters of the admin changelists
+        indexes = [
+            models.Index(fields=["city"], name="%(class)s_city"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Save the user and keep its identity index entry in the same transaction.
+        """
+        self.identity = MODEL_IDENTITIES[type(self)]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            UserIdentity.objects.update_or_create(
+                identity=self.identity,
+                user_id=self.pk,
+                defaults=UserIdentity.fields_for(self),
+            )
 
 
 # remember to create list of diseases
@@ -58,7 +102,133 @@ class Patient(User):
     medical_report = models.FileField(upload_to='reports/', blank=True, null=True)
 
     def __str__(self):
-        return self.name
+        return self.get_full_name() or self.username
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+KM_PER_DEGREE = 111.32
+
+
+def minute_of_week(value):
+    """
+    Minutes since Monday 00:00 of a datetime, in the current time zone.
+    """
+    value = timezone.localtime(value)
+    return value.weekday() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+def week_minutes_ranges(start, end):
+    """
+    Minute of week ranges covering the `[start, end)` datetime window, two
+    when it runs from Sunday into Monday.
+    """
+    lower = minute_of_week(start)
+    upper = lower + math.ceil((end - start).total_seconds() / 60)
+    if upper - lower >= MINUTES_PER_WEEK:
+        return [NumericRange(0, MINUTES_PER_WEEK)]
+    if upper > MINUTES_PER_WEEK:
+        return [NumericRange(lower, MINUTES_PER_WEEK), NumericRange(0, upper - MINUTES_PER_WEEK)]
+    return [NumericRange(lower, upper)]
+
+
+class RangeAgg(models.Aggregate):
+    """
+    Union of ranges as a multirange, contiguous ones merged (PostgreSQL 14).
+    """
+
+    function = "RANGE_AGG"
+
+
+class RangeContains(Func):
+    """
+    Whether a range or multirange contains a range, the `contains` lookup
+    of range fields takes an expression on the right for an element.
+    """
+
+    arg_joiner = " @> "
+    template = "(%(expressions)s)"
+    output_field = models.BooleanField()
+
+
+class NurseQuerySet(models.QuerySet):
+    @staticmethod
+    def availability_condition(start, end):
+        """
+        Condition matching nurses free during the whole `[start, end)` window.
+
+        A nurse is free when the window is inside the union of their weekly
+        slots (back to back slots count as one) or inside an extra
+        availability, doesn't overlap an unavailability and doesn't overlap
+        any of their booked sessions. Everything is resolved in the database.
+        """
+        period = DateTimeTZRange(start, end)
+        in_schedule = (
+            NurseAvailability.objects.filter(nurse=OuterRef("pk"))
+            .values("nurse")
+            .annotate(slots=RangeAgg("minutes", output_field=IntegerRangeField()))
+            .filter(
+                *[
+                    RangeContains(F("slots"), Int4Range(minutes.lower, minutes.upper))
+                    for minutes in week_minutes_ranges(start, end)
+                ]
+            )
+        )
+        extra = NurseAvailabilityException.objects.filter(
+            nurse=OuterRef("pk"), is_available=True, period__contains=period
+        )
+        off = NurseAvailabilityException.objects.filter(
+            nurse=OuterRef("pk"), is_available=False, period__overlap=period
+        )
+        booked = Session.objects.filter(
+            nurse=OuterRef("pk"), start_time__lt=end, end_time__gt=start
+        )
+        return (Exists(in_schedule) | Exists(extra)) & ~(Exists(off) | Exists(booked))
+
+    def available_between(self, start, end):
+        """
+        Nurses free during the whole `[start, end)` window.
+        """
+        return self.filter(self.availability_condition(start, end))
+
+    def annotate_availability(self, start, end):
+        """
+        Add `is_free`, whether the nurse is free during `[start, end)`.
+        """
+        return self.annotate(
+            is_free=ExpressionWrapper(
+                self.availability_condition(start, end),
+                output_field=models.BooleanField(),
+            )
+        )
+
+    def within_box(self, latitude, longitude, radius_km):
+        """
+        Nurses inside the bounding box of a circle, a cheap indexed
+        prefilter before exact distances are computed.
+        """
+        lat_delta = radius_km / KM_PER_DEGREE
+        lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+        queryset = self.filter(latitude__range=(latitude - lat_delta, latitude + lat_delta))
+        west, east = longitude - lon_delta, longitude + lon_delta
+        if east - west >= 360:
+            return queryset
+        # a box crossing the antimeridian is two ranges of longitude
+        if west < -180:
+            return queryset.filter(
+                models.Q(longitude__range=(west + 360, 180))
+                | models.Q(longitude__range=(-180, east))
+            )
+        if east > 180:
+            return queryset.filter(
+                models.Q(longitude__range=(west, 180))
+                | models.Q(longitude__range=(-180, east - 360))
+            )
+        return queryset.filter(longitude__range=(west, east))
+
+
+class NurseManager(UserManager.from_queryset(NurseQuerySet)):
+    pass
 
 
 class Nurse(User):
@@ -66,17 +236,235 @@ class Nurse(User):
     specialization = models.CharField(max_length=100)
     certificates = models.FileField(upload_to='certificates/')
     medical_accreditations = models.FileField(upload_to='accreditations/')
+    # free text kept for display, availability queries use NurseAvailability
     available_working_hours = models.CharField(max_length=255)
+    # usual price of one session, used to rank nurses
+    session_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    objects = NurseManager()
+
+    class Meta(User.Meta):
+        indexes = User.Meta.indexes + [
+            models.Index(fields=["latitude", "longitude"], name="nurse_location"),
+            models.Index(fields=["specialization"], name="nurse_specialization"),
+        ]
 
     def __str__(self):
-        return self.name
+        return self.get_full_name() or self.username
 
 
 class Admin(User):
     profile_image = models.ImageField(upload_to="profile_images/")
 
     def __str__(self):
-        return self.name
+        return self.get_full_name() or self.username
+
+
+# concrete user model for each identity, since User itself is abstract
+IDENTITY_MODELS = {
+    Identity.PATIENT: Patient,
+    Identity.Nurse: Nurse,
+    Identity.ADMIN: Admin,
+}
+MODEL_IDENTITIES = {model: identity for identity, model in IDENTITY_MODELS.items()}
+
+
+class NurseAvailability(models.Model):
+    """
+    Weekly working slot of a nurse, stored as a range of minutes since
+    Monday 00:00 so that availability windows are answered in the database.
+    """
+
+    nurse = models.ForeignKey(Nurse, on_delete=models.CASCADE, related_name="availability")
+    minutes = IntegerRangeField()
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=["minutes"], name="nurse_availability_minutes"),
+        ]
+        constraints = [
+            ExclusionConstraint(
+                name="exclude_overlapping_nurse_availability",
+                expressions=[
+                    ("nurse", RangeOperators.EQUAL),
+                    ("minutes", RangeOperators.OVERLAPS),
+                ],
+            ),
+        ]
+
+    @classmethod
+    def weekly(cls, nurse, weekday, start_time, end_time):
+        """
+        Slot from `start_time` to `end_time` every `weekday` (Monday is 0).
+        """
+        day = weekday * MINUTES_PER_DAY
+        return cls(
+            nurse=nurse,
+            minutes=NumericRange(
+                day + start_time.hour * 60 + start_time.minute,
+                day + end_time.hour * 60 + end_time.minute,
+            ),
+        )
+
+    @property
+    def weekday(self):
+        return self.minutes.lower // MINUTES_PER_DAY
+
+    def __str__(self):
+        return f"{self.nurse_id} {self.minutes}"
+
+
+class NurseAvailabilityException(models.Model):
+    """
+    One-off change to a nurse's weekly schedule: extra working time when
+    `is_available` is set, time off otherwise.
+    """
+
+    nurse = models.ForeignKey(
+        Nurse, on_delete=models.CASCADE, related_name="availability_exceptions"
+    )
+    period = DateTimeRangeField()
+    is_available = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=["nurse", "period"], name="nurse_exception_period"),
+        ]
+
+    def __str__(self):
+        return f"{self.nurse_id} {self.period}"
+
+
+def normalize_search_text(*parts):
+    """
+    Lowercase, strip accents and collapse whitespace so that search text can
+    be indexed and matched without unaccent() (which can't back an index).
+    """
+    text = unicodedata.normalize("NFKD", " ".join(p for p in parts if p))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+
+class UserIdentityManager(models.Manager):
+    def get_user(self, **lookup):
+        """
+        Resolve a user from any of its unique keys (email, national_id or
+        identity + user_id) with one indexed query and a primary key fetch.
+        """
+        entry = self.filter(**lookup).values_list("identity", "user_id").first()
+        if entry is None:
+            return None
+        identity, user_id = entry
+        return IDENTITY_MODELS[identity].objects.filter(pk=user_id).first()
+
+    async def aget_user(self, **lookup):
+        """
+        Async get_user().
+        """
+        entry = await self.filter(**lookup).values_list("identity", "user_id").afirst()
+        if entry is None:
+            return None
+        identity, user_id = entry
+        return await IDENTITY_MODELS[identity].objects.filter(pk=user_id).afirst()
+
+    def get_users(self, entries):
+        """
+        Fetch the concrete users of `(identity, user_id)` pairs with one query
+        per identity, keeping their order.
+        """
+        entries = list(entries)
+        ids = {}
+        for identity, user_id in entries:
+            ids.setdefault(identity, []).append(user_id)
+        users = {
+            identity: IDENTITY_MODELS[identity].objects.in_bulk(user_ids)
+            for identity, user_ids in ids.items()
+        }
+        return [
+            users[identity][user_id]
+            for identity, user_id in entries
+            if user_id in users[identity]
+        ]
+
+
+class UserIdentity(models.Model):
+    """
+    Index of every user across the Patient, Nurse and Admin tables.
+
+    It is kept in sync by User.save and the post_delete signal, and can be
+    rebuilt with the `backfill_user_identities` management command.
+    """
+
+    email = models.EmailField(unique=True, null=True)
+    national_id = models.CharField(max_length=55, unique=True)
+    identity = models.CharField(max_length=8, choices=Identity)
+    user_id = models.IntegerField()
+    # normalized names, city, specialization and national id used by user search
+    search_text = models.TextField(blank=True)
+
+    objects = UserIdentityManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["identity", "user_id"], name="unique_identity_user"
+            ),
+        ]
+        indexes = [
+            GinIndex(
+                fields=["search_text"],
+                name="user_identity_search_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
+
+    @staticmethod
+    def fields_for(user):
+        """
+        Index values of `user` (any Patient, Nurse or Admin).
+        """
+        return {
+            "email": user.email or None,
+            "national_id": user.national_id,
+            "search_text": normalize_search_text(
+                user.first_name,
+                user.last_name,
+                user.city,
+                getattr(user, "specialization", ""),
+                user.national_id,
+            ),
+        }
+
+    def __str__(self):
+        return f"{self.get_identity_display()} {self.user_id}"
+
+
+class TsTzRange(Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
+class Int4Range(Func):
+    function = "INT4RANGE"
+    output_field = IntegerRangeField()
+
+
+class BookingConflict(Exception):
+    """
+    A booking overlaps an existing session of the same nurse or patient.
+    """
+
+
+# messages of the exclusion constraints that keep sessions from overlapping
+SESSION_OVERLAP_CONSTRAINTS = {
+    "exclude_overlapping_nurse_sessions": "The nurse is already booked at this time.",
+    "exclude_overlapping_patient_sessions": "The patient is already booked at this time.",
+}
+
+
+# sent with the `start_times` of sessions written without save() (bulk
+# inserts, raw updates of whole courses), see users.rollups
+sessions_changed = Signal()
 
 
 class AbstractSession(models.Model):
@@ -84,10 +472,125 @@ class AbstractSession(models.Model):
     session_type = models.CharField(max_length=55)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        abstract = True
+
+
+class SessionQuerySet(models.QuerySet):
+    def chain(self, series):
+        """
+        All sessions of a treatment course in order, in a single query.
+        """
+        return self.filter(series=series).order_by("ordinal")
+
+
+class SessionManager(models.Manager.from_queryset(SessionQuerySet)):
+    def book_series(self, patient, nurse, session_type, price, place, slots, paid_price=0):
+        """
+        Book a treatment course of one session per `(start_time, end_time)`
+        slot, created and linked in a single transaction.
+
+        Returns the sessions in order. Raises BookingConflict when a slot
+        overlaps another session of the nurse or the patient, overlaps are
+        detected by the database exclusion constraints.
+        """
+        series = uuid.uuid4()
+        total = len(slots)
+        sessions = [
+            self.model(
+                patient=patient,
+                nurse=nurse,
+                session_type=session_type,
+                price=price,
+                paid_price=paid_price,
+                total_sessions=total,
+                remaining_sessions=total,
+                place=place,
+                start_time=start_time,
+                end_time=end_time,
+                series=series,
+                ordinal=ordinal,
+            )
+            for ordinal, (start_time, end_time) in enumerate(slots, start=1)
+        ]
+        try:
+            with transaction.atomic():
+                self.bulk_create(sessions)
+                for previous, following in zip(sessions, sessions[1:]):
+                    previous.next_session = following
+                    following.prev_session = previous
+                if total > 1:
+                    self.bulk_update(sessions, ["prev_session", "next_session"])
+                sessions_changed.send(
+                    sender=self.model, start_times=[start for start, _ in slots]
+                )
+        except IntegrityError as exc:
+            constraint = getattr(getattr(exc.__cause__, "diag", None), "constraint_name", None)
+            if constraint in SESSION_OVERLAP_CONSTRAINTS:
+                raise BookingConflict(SESSION_OVERLAP_CONSTRAINTS[constraint]) from exc
+            raise
+        return sessions
+
+    def consume(self, series, paid_price=0, patient=None, nurse=None):
+        """
+        Consume one session of a treatment course and add `paid_price` to
+        what was paid.
+
+        Counters are shared by every session of the course and updated by a
+        single conditional UPDATE, so concurrent check-ins never lose an
+        update and never go below zero. Pass `patient` or `nurse` to only
+        touch courses they take part in.
+
+        Returns the new state of the course, or None when no session is
+        left (or the course doesn't exist or isn't theirs).
+        """
+        connection = connections[router.db_for_write(self.model)]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        # rows of the course are locked in id order so concurrent consumers
+        # queue up instead of deadlocking
+        filters = ["series = %s", "remaining_sessions > 0"]
+        params = [series]
+        if patient is not None:
+            filters.append("patient_id = %s")
+            params.append(patient.pk)
+        if nurse is not None:
+            filters.append("nurse_id = %s")
+            params.append(nurse.pk)
+        sql = f"""
+            UPDATE {table}
+            SET remaining_sessions = remaining_sessions - 1,
+                paid_price = paid_price + %s,
+                updated_at = %s
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE {" AND ".join(filters)}
+                ORDER BY id
+                FOR UPDATE
+            )
+            RETURNING total_sessions, remaining_sessions, paid_price, start_time
+        """
+        params = [paid_price, timezone.now(), *params]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+        sessions_changed.send(sender=self.model, start_times=[row[3] for row in rows])
+        total, remaining, paid, _ = rows[0]
+        return {
+            "series": series,
+            "consumed_ordinal": total - remaining,
+            "total_sessions": total,
+            "remaining_sessions": remaining,
+            "paid_price": paid,
+        }
+
 
 class Session(AbstractSession):
-    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='sessions')
-    nurse = models.ForeignKey(Nurse, on_delete=models.CASCADE, related_name='sessions')
+    # indexed by the (patient, start_time) and (nurse, start_time) indexes
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='sessions', db_index=False)
+    nurse = models.ForeignKey(Nurse, on_delete=models.CASCADE, related_name='sessions', db_index=False)
     paid_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_sessions = models.PositiveIntegerField()
     remaining_sessions = models.PositiveIntegerField()
@@ -96,6 +599,196 @@ class Session(AbstractSession):
     place = models.CharField(max_length=100)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
+    # treatment course this session belongs to and its position in it
+    series = models.UUIDField(default=uuid.uuid4)
+    ordinal = models.PositiveIntegerField(default=1)
+    # validator of conditional requests, also set by the raw updates
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SessionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["start_time"], name="session_start_time"),
+            models.Index(fields=["nurse", "start_time"], name="session_nurse_start_time"),
+            models.Index(fields=["patient", "start_time"], name="session_patient_start_time"),
+        ]
+        constraints = [
+            ExclusionConstraint(
+                name="exclude_overlapping_nurse_sessions",
+                expressions=[
+                    (TsTzRange("start_time", "end_time"), RangeOperators.OVERLAPS),
+                    ("nurse", RangeOperators.EQUAL),
+                ],
+            ),
+            ExclusionConstraint(
+                name="exclude_overlapping_patient_sessions",
+                expressions=[
+                    (TsTzRange("start_time", "end_time"), RangeOperators.OVERLAPS),
+                    ("patient", RangeOperators.EQUAL),
+                ],
+            ),
+            # deferred so chains can be renumbered in place
+            models.UniqueConstraint(
+                fields=["series", "ordinal"],
+                name="unique_session_series_ordinal",
+                deferrable=models.Deferrable.DEFERRED,
+            ),
+        ]
+
+    def __str__(self):
+        # ids only, so listing sessions doesn't load their users
+        return f"Session {self.pk} between patient {self.patient_id} and nurse {self.nurse_id}"
+
+
+class ArchivedSession(AbstractSession):
+    """
+    Session of a fully consumed treatment course moved out of the sessions
+    table by users.partitions.archive_series().
+
+    The table is partitioned by month of `start_time` and created outside
+    of migrations (see users.partitions), its primary key is (id,
+    start_time). Chains are kept as plain ids, the sessions they point to
+    are archived with them.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='archived_sessions', db_index=False)
+    nurse = models.ForeignKey(Nurse, on_delete=models.CASCADE, related_name='archived_sessions', db_index=False)
+    paid_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_sessions = models.PositiveIntegerField()
+    remaining_sessions = models.PositiveIntegerField()
+    prev_session = models.IntegerField(null=True, db_column="prev_session_id")
+    next_session = models.IntegerField(null=True, db_column="next_session_id")
+    place = models.CharField(max_length=100)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    series = models.UUIDField()
+    ordinal = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    objects = SessionQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+
+    def __str__(self):
+        return f"Archived session {self.pk} between patient {self.patient_id} and nurse {self.nurse_id}"
+
+
+class SessionRollup(models.Model):
+    """
+    Daily totals of the sessions of one nurse, patient city or session
+    type, maintained by users.rollups so reports never aggregate the
+    sessions table.
+
+    A day counts the sessions starting on it (in the default time zone):
+    their price, those already consumed (ordinal up to what was consumed of
+    their course) and their share of what was paid for their course.
+    """
+
+    class Dimension(models.TextChoices):
+        NURSE = "nurse", "Nurse"
+        CITY = "city", "City"
+        SESSION_TYPE = "session_type", "Session type"
+
+    dimension = models.CharField(max_length=16, choices=Dimension)
+    key = models.CharField(max_length=100)
+    day = models.DateField()
+    sessions = models.PositiveIntegerField(default=0)
+    consumed_sessions = models.PositiveIntegerField(default=0)
+    booked_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # validator of the analytics responses and key of the cached charts
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["dimension", "day"], name="session_rollup_day"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dimension", "key", "day"], name="unique_session_rollup"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension} {self.key} on {self.day}"
+
+
+class SessionRollupDirtyDay(models.Model):
+    """
+    A change of the sessions of `day` not yet in its rollups.
+
+    Marks are only ever inserted, never updated: writers touching the same
+    day don't wait for each other, a day has a mark per change until it is
+    refreshed.
+    """
+
+    day = models.DateField()
+    marked_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["day"], name="session_rollup_dirty_day"),
+        ]
+
+    def __str__(self):
+        return str(self.day)
+
+
+class Job(models.Model):
+    """
+    Background task run by the run_jobs workers, see users.jobs.
+
+    A queued job is claimed by one worker with SELECT ... FOR UPDATE SKIP
+    LOCKED, failures are retried with a backoff until `max_attempts`.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=8, choices=Status, default=Status.QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    # worker running the job and when it claimed it, its lease
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    # a job with a key already queued or run is not enqueued again
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the claim query, only over the jobs waiting to run
+            models.Index(
+                fields=["run_at"],
+                name="job_queued_run_at",
+                condition=models.Q(status="queued"),
+            ),
+            models.Index(
+                fields=["locked_at"],
+                name="job_running_locked_at",
+                condition=models.Q(status="running"),
+            ),
+            models.Index(fields=["finished_at"], name="job_finished_at"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                name="unique_job_dedupe_key",
+                condition=models.Q(dedupe_key__isnull=False),
+            ),
+        ]
 
     def __str__(self):
-        return f"Session between {self.patient.name} and {self.nurse.name}"
+        return f"{self.name} {self.pk} ({self.status})"
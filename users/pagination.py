@@ -0,0 +1,87 @@
+import json
+
+from rest_framework import pagination
+
+
+def estimate_count(queryset):
+    """
+    Approximate row count of `queryset` from the planner statistics, without
+    running a COUNT(*).
+    """
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class UserPagination(pagination.PageNumberPagination):
+    """
+    Pagination class for User objects.
+
+    This class defines the page size for paginated responses.
+
+    Attributes:
+        page_size (int): The number of users to display per page.
+            Default is 10.
+    """
+
+    page_size = 10
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Opaque cursor pagination keyed on an indexed column.
+
+    Every page is an index range scan from the cursor position, so deep pages
+    cost the same as the first one and no COUNT(*) is issued. Views pick it
+    by setting `pagination_class`; subclasses set `ordering` to the indexed
+    columns, ending with a unique one so rows sharing a position keep the
+    same order from page to page.
+
+    Attributes:
+        estimate_count (bool): Always include an approximate "count" taken
+            from planner statistics. Clients can also ask for it with
+            `?count=estimate`.
+    """
+
+    page_size = 10
+    ordering = ("id",)
+    estimate_count = False
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if (
+            self.estimate_count
+            or request.query_params.get(self.count_query_param) == "estimate"
+        ):
+            self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {"count": self.count, **response.data}
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"] = {
+            "count": {"type": "integer", "example": 123},
+            **response_schema["properties"],
+        }
+        return response_schema
+
+
+class UserCursorPagination(KeysetPagination):
+    """
+    Keyset pagination for users, in identity index order.
+    """
+
+    ordering = ("id",)
+
+
+class SessionCursorPagination(KeysetPagination):
+    """
+    Keyset pagination for sessions, in calendar order.
+    """
+
+    ordering = ("start_time", "id")
@@ -0,0 +1,245 @@
+import datetime
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+
+from .jobs import schedule
+from .models import ArchivedSession, Session
+
+
+def get_archive_setting(name):
+    defaults = {
+        # fully consumed courses are archived this many days after their
+        # last session
+        "RETENTION_DAYS": 365,
+        # courses moved per transaction
+        "BATCH_SIZE": 200,
+        # months of partitions kept created ahead of the current one
+        "PARTITIONS_AHEAD": 3,
+    }
+    return getattr(settings, "SESSION_ARCHIVE", {}).get(name, defaults[name])
+
+
+def get_connection():
+    return connections[router.db_for_write(ArchivedSession)]
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def next_month(start):
+    return month_start(start + datetime.timedelta(days=32))
+
+
+def partition_name(start):
+    return f"{ArchivedSession._meta.db_table}_{start:%Y_%m}"
+
+
+def ensure_archive_table(connection=None):
+    """
+    Create the archive table, partitioned by range of start_time, with its
+    indexes and its default partition (rows of months without a partition
+    of their own). Does nothing when it exists.
+    """
+    connection = connection or get_connection()
+    if connection.vendor != "postgresql":
+        return
+    qn = connection.ops.quote_name
+    table = ArchivedSession._meta.db_table
+    columns = []
+    for field in ArchivedSession._meta.local_concrete_fields:
+        column = f"{qn(field.column)} {field.db_type(connection)}"
+        column += " NULL" if field.null else " NOT NULL"
+        if field.remote_field is not None:
+            target = field.target_field
+            column += (
+                f" REFERENCES {qn(target.model._meta.db_table)} ({qn(target.column)})"
+                " DEFERRABLE INITIALLY DEFERRED"
+            )
+        columns.append(column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {qn(table)} (
+                {", ".join(columns)},
+                PRIMARY KEY (id, start_time)
+            ) PARTITION BY RANGE (start_time)
+            """
+        )
+        for name, fields in [
+            ("archived_session_patient_start_time", "patient_id, start_time"),
+            ("archived_session_nurse_start_time", "nurse_id, start_time"),
+            ("archived_session_series_ordinal", "series, ordinal"),
+        ]:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {qn(name)} ON {qn(table)} ({fields})"
+            )
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {qn(table + '_default')} "
+            f"PARTITION OF {qn(table)} DEFAULT"
+        )
+
+
+def get_partitions(connection=None):
+    """
+    Names of the partitions of the archive table.
+    """
+    connection = connection or get_connection()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [ArchivedSession._meta.db_table],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_partition(start, connection=None):
+    """
+    Create the partition of the month starting at `start`.
+
+    It is built next to the table and then attached, rows of that month
+    already in the default partition are moved into it first (a partition
+    can't be created over rows of the default one).
+    """
+    connection = connection or get_connection()
+    qn = connection.ops.quote_name
+    table = ArchivedSession._meta.db_table
+    name, end = partition_name(start), next_month(start)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {qn(name)} "
+            f"(LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {qn(table + '_default')}
+                WHERE start_time >= %s AND start_time < %s
+                RETURNING *
+            )
+            INSERT INTO {qn(name)} SELECT * FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    return name
+
+
+def ensure_partitions(first, last, connection=None):
+    """
+    Create the missing monthly partitions from the month of `first` to the
+    month of `last`. Returns the names of the created ones.
+    """
+    connection = connection or get_connection()
+    if connection.vendor != "postgresql":
+        return []
+    ensure_archive_table(connection)
+    existing = get_partitions(connection)
+    created = []
+    start = month_start(first)
+    while start <= last:
+        if partition_name(start) not in existing:
+            created.append(create_partition(start, connection))
+        start = next_month(start)
+    return created
+
+
+@schedule
+def ensure_future_partitions(ahead=None):
+    """
+    Keep partitions created from the current month to PARTITIONS_AHEAD
+    months later, run by the job workers.
+    """
+    ahead = get_archive_setting("PARTITIONS_AHEAD") if ahead is None else ahead
+    now = timezone.now()
+    last = month_start(now)
+    for _ in range(ahead):
+        last = next_month(last)
+    return ensure_partitions(now, last)
+
+
+# columns of a session copied to the archive, same names in both tables
+ARCHIVED_COLUMNS = [
+    field.column
+    for field in ArchivedSession._meta.local_concrete_fields
+    if field.name != "archived_at"
+]
+
+
+def get_archivable_series(cutoff):
+    """
+    Courses fully consumed (their counters are shared, every session has
+    none remaining) whose sessions all ended before `cutoff`.
+
+    Candidates come from a range of the start_time index over old sessions,
+    each checked against later sessions of its course through the series
+    index, so the whole table is never read.
+    """
+    later = Session.objects.filter(series=OuterRef("series"), end_time__gte=cutoff)
+    return (
+        Session.objects.filter(start_time__lt=cutoff, remaining_sessions=0)
+        .exclude(Exists(later))
+        .order_by()
+        .values_list("series", flat=True)
+        .distinct()
+    )
+
+
+def archive_series(retention_days=None, batch_size=None, now=None):
+    """
+    Move the sessions of fully consumed courses older than the retention
+    window to the archive, `batch_size` courses per transaction. Each batch
+    is deleted and inserted by a single statement, a course is never split
+    between both tables. Returns the numbers of courses and of sessions
+    moved.
+
+    The partitions of a batch are created before its transaction: their
+    DDL locks are released at once instead of blocking readers of the
+    archive until the batch commits.
+    """
+    retention_days = retention_days or get_archive_setting("RETENTION_DAYS")
+    batch_size = batch_size or get_archive_setting("BATCH_SIZE")
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=retention_days)
+    connection = get_connection()
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(column) for column in ARCHIVED_COLUMNS)
+    candidates = get_archivable_series(cutoff).using(connection.alias)
+    ensure_archive_table(connection)
+
+    moved_series = moved_sessions = 0
+    while True:
+        series = list(candidates[:batch_size])
+        if not series:
+            return moved_series, moved_sessions
+        span = Session.objects.using(connection.alias).filter(
+            series__in=series
+        ).aggregate(first=Min("start_time"), last=Max("start_time"))
+        ensure_partitions(span["first"], span["last"], connection)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {qn(Session._meta.db_table)}
+                    WHERE series = ANY(%s::uuid[])
+                    RETURNING {columns}
+                )
+                INSERT INTO {qn(ArchivedSession._meta.db_table)}
+                    ({columns}, archived_at)
+                SELECT {columns}, %s FROM moved
+                """,
+                [[str(value) for value in series], timezone.now()],
+            )
+            moved_sessions += cursor.rowcount
+        moved_series += len(series)
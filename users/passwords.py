@@ -0,0 +1,44 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hashing_executor():
+    """
+    Process wide pool running the password hashers, sized by
+    PASSWORD_HASHING_THREADS so that a burst of logins queues up instead of
+    starving the event loop or the database threads.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_THREADS,
+                    thread_name_prefix="password-hashing",
+                )
+    return _executor
+
+
+async def acheck_password(password, encoded):
+    """
+    Check `password` against the `encoded` hash in the hashing pool.
+
+    Unlike User.check_password, an outdated hash is not upgraded.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), check_password, password, encoded)
+
+
+async def amake_password(password):
+    """
+    Hash `password` in the hashing pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), make_password, password)
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .projections import get_user_representations
+
+
+class _Flight:
+    """
+    One recompute in progress, other threads wait for its result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ProfileCache:
+    """
+    Cache of user representations keyed by identity, id and field selection.
+
+    Each user has a version token in the cache, part of the keys of its
+    entries. Invalidating a user replaces the token, so every variant of
+    its representation is dropped at once, in every process sharing the
+    backend. A missing token (evicted or never set) is replaced too, stale
+    entries can't come back.
+
+    Misses are recomputed once per process: threads asking for a user being
+    recomputed wait for that result instead of querying the database too.
+
+    Entries are stored in the CACHES alias `cache_alias`, local memory by
+    default, a shared backend makes invalidations cluster wide.
+    """
+
+    KEY_PREFIX = "profile"
+    # bump when representations change shape, older entries are ignored
+    SCHEMA_VERSION = 2
+
+    def __init__(self, cache_alias="default", ttl=300, wait_timeout=5):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ["hits", "misses", "coalesced", "invalidations"], 0
+        )
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _version_key(self, identity, pk):
+        return f"{self.KEY_PREFIX}:{self.SCHEMA_VERSION}:version:{identity}:{pk}"
+
+    @staticmethod
+    def variant(fields):
+        """
+        Short name of a field selection, see projections.get_fieldset().
+        """
+        if fields is None:
+            return "all"
+        return hashlib.sha256(",".join(sorted(fields)).encode()).hexdigest()[:16]
+
+    def _versions(self, entries):
+        keys = {entry: self._version_key(*entry) for entry in entries}
+        versions = self.cache.get_many(keys.values())
+        result = {}
+        for entry, key in keys.items():
+            version = versions.get(key)
+            if version is None:
+                self.cache.add(key, uuid.uuid4().hex, None)
+                version = self.cache.get(key)
+            result[entry] = version
+        return result
+
+    def get_many(self, entries, fields=None):
+        """
+        Representations of the users of `(identity, user_id)` pairs, in
+        order, as projections.represent_users() gives them.
+        """
+        entries = list(entries)
+        variant = self.variant(fields)
+        versions = self._versions(entries)
+        keys = {
+            entry: f"{self.KEY_PREFIX}:{self.SCHEMA_VERSION}:{entry[0]}:{entry[1]}:{versions[entry]}:{variant}"
+            for entry in entries
+        }
+        found = self.cache.get_many(keys.values())
+        result = {entry: found[key] for entry, key in keys.items() if key in found}
+        missing = [entry for entry in dict.fromkeys(entries) if entry not in result]
+        with self._lock:
+            self._counters["hits"] += len(result)
+            self._counters["misses"] += len(missing)
+
+        if missing:
+            result.update(self._recompute(missing, keys, fields))
+        return [result[entry] for entry in entries if result.get(entry) is not None]
+
+    def _recompute(self, missing, keys, fields):
+        """
+        Representations of `missing` entries (None for deleted users), each
+        computed by one thread of the process at a time.
+        """
+        owned, waiting = [], []
+        with self._lock:
+            for entry in missing:
+                flight = self._flights.get(keys[entry])
+                if flight is None:
+                    self._flights[keys[entry]] = _Flight()
+                    owned.append(entry)
+                else:
+                    waiting.append((entry, flight))
+            self._counters["coalesced"] += len(waiting)
+
+        result = {}
+        try:
+            if owned:
+                computed = get_user_representations(owned, fields=fields)
+                self.cache.set_many(
+                    {keys[entry]: data for entry, data in computed.items()}, self.ttl
+                )
+                for entry in owned:
+                    result[entry] = computed.get(entry)
+        finally:
+            with self._lock:
+                for entry in owned:
+                    flight = self._flights.pop(keys[entry])
+                    flight.value = result.get(entry)
+                    flight.done.set()
+
+        retry = []
+        for entry, flight in waiting:
+            if flight.done.wait(self.wait_timeout) and flight.value is not None:
+                result[entry] = flight.value
+            else:
+                retry.append(entry)
+        if retry:
+            result.update(get_user_representations(retry, fields=fields))
+        return result
+
+    def invalidate(self, identity, pk):
+        """
+        Drop every cached representation of a user.
+        """
+        self.cache.set(self._version_key(identity, pk), uuid.uuid4().hex, None)
+        with self._lock:
+            self._counters["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+def _build_profile_cache():
+    config = getattr(settings, "PROFILE_CACHE", {})
+    return ProfileCache(
+        cache_alias=config.get("CACHE_ALIAS", "default"),
+        ttl=config.get("TTL", 300),
+        wait_timeout=config.get("WAIT_TIMEOUT", 5),
+    )
+
+
+profile_cache = _build_profile_cache()
@@ -0,0 +1,291 @@
+import functools
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+from .models import IDENTITY_MODELS
+from .serializers import USER_SERIALIZERS
+
+# fields representing a database value as the value itself
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.FloatField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class Projection:
+    """
+    Read only fast path of a ModelSerializer working on `.values()` rows.
+
+    The serializer fields are inspected once, giving the columns to select
+    and how to represent each of them, so rendering a row is a loop over
+    plain values instead of the DRF field machinery on a model instance.
+    `represent(rows)` gives the same data as `serializer_class(instances,
+    many=True).data`.
+
+    SerializerMethodFields must be mapped to a column and a static method
+    representing it in the serializer's `projected_methods`, e.g.
+    `{"media": ("processed_media", "represent_media")}`, the method is
+    called with the value, the model and the request.
+
+    Only the serializer fields in `fields` are kept when it is given, and
+    the relations in `expand`, a dict of Projections by field name, are
+    represented as nested objects selected through joins instead of ids.
+    """
+
+    def __init__(self, serializer_class, fields=None, expand=None):
+        serializer = serializer_class()
+        self.model = serializer_class.Meta.model
+        self.columns = []
+        self.fields = []
+        self.expanded = []
+        expand = expand or {}
+        projected_methods = getattr(serializer_class, "projected_methods", {})
+
+        for name, field in serializer.fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if name in expand:
+                # the foreign key is a placeholder keeping the field order
+                # until the nested object replaces it
+                nested = expand[name]
+                prefix = f"{field.source}__"
+                self.add(name, field.source, None)
+                self.columns += [prefix + column for column in nested.columns]
+                self.expanded.append((name, field.source, prefix, nested))
+            elif isinstance(field, serializers.SerializerMethodField):
+                column, method = projected_methods[name]
+                self.add(name, column, self.method_converter(getattr(serializer_class, method)))
+            elif isinstance(field, serializers.DateTimeField):
+                self.add(name, field.source, self.datetime_converter(field))
+            elif isinstance(field, serializers.FileField):
+                self.add(name, field.source, self.file_converter(field))
+            elif isinstance(field, PASSTHROUGH_FIELDS):
+                self.add(name, field.source, None)
+            else:
+                self.add(name, field.source, lambda request, field=field: field.to_representation)
+
+    def add(self, name, column, converter):
+        """
+        `converter(request)` gives the function representing non null
+        values of `column`, None when the value is its representation.
+        """
+        if column not in self.columns:
+            self.columns.append(column)
+        self.fields.append((name, column, converter))
+
+    def method_converter(self, method):
+        model = self.model
+
+        def converter(request):
+            return lambda value: method(value, model, request)
+
+        return converter
+
+    def datetime_converter(self, field):
+        """
+        DateTimeField representation with the current timezone looked up
+        once per call of `represent` instead of once per value.
+        """
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        if (
+            output_format is None
+            or output_format.lower() != ISO_8601
+            or hasattr(field, "timezone")
+        ):
+            return lambda request: field.to_representation
+
+        def converter(request):
+            field_timezone = field.default_timezone()
+            if field_timezone is None:
+                return field.to_representation
+
+            def represent(value):
+                if isinstance(value, str) or value.utcoffset() is None:
+                    return field.to_representation(value)
+                value = value.astimezone(field_timezone).isoformat()
+                if value.endswith("+00:00"):
+                    value = value[:-6] + "Z"
+                return value
+
+            return represent
+
+        return converter
+
+    def file_converter(self, field):
+        storage = self.model._meta.get_field(field.source).storage
+        use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+
+        def converter(request):
+            def represent(name):
+                if not name:
+                    return None
+                if not use_url:
+                    return name
+                url = storage.url(name)
+                return request.build_absolute_uri(url) if request is not None else url
+
+            return represent
+
+        return converter
+
+    def values(self, queryset, *columns):
+        """
+        `queryset.values()` with the projection's columns and `columns`,
+        e.g. the ordering column of a paginator.
+        """
+        return queryset.values(
+            *self.columns, *[column for column in columns if column not in self.columns]
+        )
+
+    def represent(self, rows, request=None):
+        """
+        Representations of `rows`, dicts with at least the projection's
+        `columns`.
+        """
+        if self.expanded:
+            rows = list(rows)
+        fields = [
+            (name, column, converter and converter(request))
+            for name, column, converter in self.fields
+        ]
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, converter in fields:
+                value = row[column]
+                item[name] = value if value is None or converter is None else converter(value)
+            data.append(item)
+
+        for name, column, prefix, nested in self.expanded:
+            related = [
+                (item, {key: row[prefix + key] for key in nested.columns})
+                for row, item in zip(rows, data)
+                if row[column] is not None
+            ]
+            represented = nested.represent([values for _, values in related], request)
+            for (item, _), value in zip(related, represented):
+                item[name] = value
+        return data
+
+
+@functools.lru_cache(maxsize=256)
+def get_projection(serializer_class, fields=None, expand=()):
+    """
+    Cached Projection of `serializer_class`. `fields` is a frozenset of
+    field names or None for all of them, `expand` a tuple of
+    `(relation, fields)` pairs, see get_fieldset().
+    """
+    expandable = getattr(serializer_class, "expandable_fields", {})
+    return Projection(
+        serializer_class,
+        fields,
+        {
+            name: get_projection(expandable[name], nested_fields)
+            for name, nested_fields in expand
+        },
+    )
+
+
+def get_fieldset(request, serializer_classes):
+    """
+    `(fields, expand)` for get_projection() from the query parameters, e.g.
+    ?fields=id,start_time,patient.first_name&expand=patient
+
+    `fields` lists the fields to return, `relation.field` the fields of an
+    expanded relation, and `expand` the relations of
+    `expandable_fields` to return as nested objects instead of ids. Fields
+    are checked against all `serializer_classes`, lists of users take the
+    fields of every identity.
+    """
+    fields = _split(request.query_params.get("fields"))
+    expand = _split(request.query_params.get("expand")) or set()
+
+    known = set()
+    expandable = {}
+    for serializer_class in serializer_classes:
+        known.update(
+            name
+            for name, field in serializer_class().fields.items()
+            if not field.write_only
+        )
+        expandable.update(getattr(serializer_class, "expandable_fields", {}))
+
+    unknown = sorted(expand - set(expandable))
+    if unknown:
+        raise ValidationError({"expand": f"Can't expand: {', '.join(unknown)}."})
+    if fields is None:
+        return None, tuple((name, None) for name in sorted(expand))
+
+    nested = {name: set() for name in expand}
+    errors = []
+    for name in fields:
+        relation, _, related_name = name.partition(".")
+        if not related_name:
+            if name not in known:
+                errors.append(name)
+        elif relation not in nested:
+            errors.append(name)
+        else:
+            nested[relation].add(related_name)
+    for relation, names in nested.items():
+        readable = {
+            name
+            for name, field in expandable[relation]().fields.items()
+            if not field.write_only
+        }
+        errors += [f"{relation}.{name}" for name in sorted(names - readable)]
+    if errors:
+        raise ValidationError({"fields": f"Unknown fields: {', '.join(errors)}."})
+
+    top_level = {name for name in fields if "." not in name}
+    return (
+        frozenset(top_level | {name for name, names in nested.items() if names}),
+        tuple(
+            (name, frozenset(names) if names else None)
+            for name, names in sorted(nested.items())
+        ),
+    )
+
+
+def _split(value):
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def get_user_representations(entries, request=None, fields=None):
+    """
+    `{(identity, user_id): representation}` of the users of `(identity,
+    user_id)` pairs, with one `.values()` query per identity. Missing users
+    are left out.
+    """
+    ids = {}
+    for identity, user_id in entries:
+        ids.setdefault(identity, []).append(user_id)
+
+    users = {}
+    for identity, user_ids in ids.items():
+        projection = get_projection(USER_SERIALIZERS[identity], fields)
+        rows = list(
+            projection.values(
+                IDENTITY_MODELS[identity].objects.filter(pk__in=user_ids), "id"
+            )
+        )
+        for row, item in zip(rows, projection.represent(rows, request)):
+            users[identity, row["id"]] = item
+    return users
+
+
+def represent_users(entries, request=None, fields=None):
+    """
+    Representations of the users of `(identity, user_id)` pairs, in order.
+    Missing users are skipped.
+    """
+    entries = list(entries)
+    users = get_user_representations(entries, request, fields)
+    return [users[entry] for entry in entries if entry in users]
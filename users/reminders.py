@@ -0,0 +1,136 @@
+import datetime
+
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.db.models import Q
+from django.utils import timezone
+
+from .jobs import build_job, enqueue_many, schedule, task
+from .models import Job, Session
+
+
+def get_reminder_setting(name):
+    defaults = {
+        # seconds before the start of a session its reminders are sent
+        "LEADS": [86400, 3600],
+        # reminders are queued this many seconds before they are due
+        "AHEAD": 600,
+        # a reminder missed by up to this many seconds (workers down) is
+        # still sent, later ones are dropped
+        "GRACE": 900,
+        "BATCH_SIZE": 500,
+    }
+    return getattr(settings, "SESSION_REMINDERS", {}).get(name, defaults[name])
+
+
+def reminder_key(session_id, lead, start_time):
+    # a moved session gets reminders for its new time
+    return f"session_reminder:{session_id}:{lead}:{start_time.isoformat()}"
+
+
+def queue_reminders(lead, start, end, batch_size):
+    """
+    Queue the `lead` reminders of sessions starting from `start` to `end`,
+    `batch_size` sessions at a time in start_time order, a range of the
+    start_time index. Returns the number of reminders queued.
+    """
+    sessions = Session.objects.filter(start_time__gte=start, start_time__lt=end)
+    queued = 0
+    after = None
+    while True:
+        batch = sessions
+        if after is not None:
+            batch = batch.filter(
+                Q(start_time__gt=after[0]) | Q(start_time=after[0], pk__gt=after[1])
+            )
+        rows = list(
+            batch.order_by("start_time", "pk").values_list("pk", "start_time")[
+                :batch_size
+            ]
+        )
+        if not rows:
+            return queued
+        keys = {
+            reminder_key(pk, lead, start_time): (pk, start_time)
+            for pk, start_time in rows
+        }
+        # most of the window was queued by earlier runs, look the keys up
+        # instead of sending conflicting inserts
+        for key in Job.objects.filter(dedupe_key__in=keys).values_list(
+            "dedupe_key", flat=True
+        ):
+            del keys[key]
+        enqueue_many(
+            [
+                build_job(
+                    "session_reminder",
+                    run_at=start_time - datetime.timedelta(seconds=lead),
+                    dedupe_key=key,
+                    session_id=pk,
+                    lead=lead,
+                    start_time=start_time.isoformat(),
+                )
+                for key, (pk, start_time) in keys.items()
+            ]
+        )
+        queued += len(keys)
+        after = (rows[-1][1], rows[-1][0])
+
+
+@schedule
+def schedule_reminders(now=None):
+    """
+    Queue the reminders due from GRACE seconds ago to AHEAD seconds from
+    now. Every run reads that window again, so sessions booked or moved
+    into it since the last run get their reminders too.
+    """
+    now = now or timezone.now()
+    ahead = datetime.timedelta(seconds=get_reminder_setting("AHEAD"))
+    grace = datetime.timedelta(seconds=get_reminder_setting("GRACE"))
+    queued = 0
+    for lead in get_reminder_setting("LEADS"):
+        due = now + datetime.timedelta(seconds=lead)
+        queued += queue_reminders(
+            lead, due - grace, due + ahead, get_reminder_setting("BATCH_SIZE")
+        )
+    return queued
+
+
+@task("session_reminder")
+def send_session_reminder(session_id, lead, start_time):
+    """
+    Email the patient and the nurse of a session about to start. Skipped
+    when the session was deleted, moved (its new time has its own
+    reminders), already consumed or the reminder is too late.
+    """
+    session = (
+        Session.objects.select_related("patient", "nurse").filter(pk=session_id).first()
+    )
+    if session is None or session.start_time.isoformat() != start_time:
+        return
+    if session.ordinal <= session.total_sessions - session.remaining_sessions:
+        return
+    now = timezone.now()
+    due = session.start_time - datetime.timedelta(seconds=lead)
+    if now > due + datetime.timedelta(seconds=get_reminder_setting("GRACE")):
+        return
+    if now >= session.start_time:
+        return
+
+    when = timezone.localtime(session.start_time).strftime("%A %d %B %Y at %H:%M")
+    subject = f"Reminder: {session.session_type} session on {when}"
+    messages = [
+        (
+            subject,
+            f"Hello {user},\n\nYour {session.session_type} session with {other} "
+            f"starts on {when} at {session.place}.\n",
+            None,
+            [user.email],
+        )
+        for user, other in [
+            (session.patient, session.nurse),
+            (session.nurse, session.patient),
+        ]
+        if user.email
+    ]
+    send_mass_mail(messages)
@@ -0,0 +1,67 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SCALARS = {str, int, bool, type(None)}
+
+
+def has_unportable_floats(data):
+    """
+    Whether `data` holds floats orjson doesn't print like json.dumps: the
+    ones repr() writes with an exponent, NaN and infinities, or arrays the
+    encoder turns into lists.
+    """
+    stack = [data]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        value = pop()
+        kind = type(value)
+        if kind in SCALARS:
+            continue
+        if kind is float:
+            if value and not 1e-4 <= abs(value) < 1e16:
+                return True
+        elif isinstance(value, dict):
+            extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            extend(value)
+        elif isinstance(value, float) or hasattr(value, "tolist"):
+            return True
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer rendering through orjson when it is installed.
+
+    The output is the same bytes JSONRenderer produces with the default
+    settings. Types orjson doesn't handle go through the DRF encoder, and
+    anything orjson can't render identically (indented output, non default
+    COMPACT_JSON/UNICODE_JSON/STRICT_JSON, see has_unportable_floats)
+    falls back to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not (self.compact and not self.ensure_ascii and self.strict)
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+            or has_unportable_floats(data)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # same escaping of the javascript line terminators as JSONRenderer
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
@@ -0,0 +1,327 @@
+import datetime
+import io
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import NullIf, TruncDate, TruncMonth
+from django.utils import timezone
+
+from .jobs import schedule
+from .models import ArchivedSession, Session, SessionRollup, SessionRollupDirtyDay
+
+# what sessions are grouped by for each dimension, a nurse's rollups are
+# keyed by its id
+DIMENSION_COLUMNS = {
+    SessionRollup.Dimension.NURSE: "nurse_id",
+    SessionRollup.Dimension.CITY: "patient__city",
+    SessionRollup.Dimension.SESSION_TYPE: "session_type",
+}
+
+METRICS = ["sessions", "consumed_sessions", "booked_amount", "paid_amount"]
+
+CENTS = Decimal("0.01")
+
+# first key of the advisory locks of days being refreshed
+REFRESH_LOCK = 0x524F4C4C
+
+
+def get_rollup_setting(name):
+    defaults = {
+        # refresh the rollups of changed days in the request once the write
+        # is committed, otherwise the job workers (refresh_marked) and the
+        # refresh_session_rollups command catch up
+        "SYNC": False,
+        # marks refreshed per transaction by the workers and the command
+        "BATCH_SIZE": 50,
+        # seconds a rendered chart is kept, a change of its rollups makes it
+        # unreachable sooner
+        "CHART_TTL": 86400,
+    }
+    return getattr(settings, "SESSION_ROLLUPS", {}).get(name, defaults[name])
+
+
+def session_day(start_time):
+    """
+    Day of the rollups a session starting at `start_time` counts in.
+    """
+    return timezone.localtime(start_time, timezone.get_default_timezone()).date()
+
+
+def day_range(day):
+    tz = timezone.get_default_timezone()
+    return (
+        datetime.datetime.combine(day, datetime.time.min, tzinfo=tz),
+        datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz
+        ),
+    )
+
+
+def mark_days(days):
+    """
+    Flag `days` as changed, in the transaction of the write that changed
+    them.
+
+    Marks are plain inserts, they take no lock another writer could wait
+    for. A refresh only deletes the marks it could see: one committed
+    with a change the refresh could not see yet stays for the next one.
+    """
+    now = timezone.now()
+    SessionRollupDirtyDay.objects.bulk_create(
+        [SessionRollupDirtyDay(day=day, marked_at=now) for day in sorted(days)]
+    )
+
+
+def days_changed(days):
+    """
+    Mark `days` and, with the SYNC setting, refresh them after commit.
+    """
+    days = set(days)
+    if not days:
+        return
+    mark_days(days)
+    if get_rollup_setting("SYNC"):
+        # a failed refresh leaves the days marked for the workers, it must
+        # not fail the committed write
+        transaction.on_commit(
+            lambda: refresh_days(days),
+            using=router.db_for_write(SessionRollupDirtyDay),
+            robust=True,
+        )
+
+
+def mark_sessions(queryset):
+    """
+    Mark the days of the sessions of `queryset`, with one query.
+    """
+    days = (
+        queryset.order_by()
+        .annotate(day=TruncDate("start_time", tzinfo=timezone.get_default_timezone()))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    days_changed(days)
+
+
+def compute_days(days):
+    """
+    Rollups of every dimension for the sessions starting on `days`, live
+    and archived, one query per dimension and table on the start_time
+    indexes whatever the number of days.
+    """
+    ranges = Q()
+    for day in days:
+        start, end = day_range(day)
+        ranges |= Q(start_time__gte=start, start_time__lt=end)
+    totals = {
+        "sessions": Count("pk"),
+        "consumed_sessions": Count(
+            "pk", filter=Q(ordinal__lte=F("total_sessions") - F("remaining_sessions"))
+        ),
+        "booked_amount": Sum("price"),
+        # what was paid for a course is spread over its sessions
+        "paid_amount": Sum(
+            ExpressionWrapper(
+                F("paid_price") / NullIf(F("total_sessions"), 0),
+                output_field=DecimalField(),
+            )
+        ),
+    }
+    rollups = {}
+    for model in [Session, ArchivedSession]:
+        sessions = (
+            model.objects.filter(ranges)
+            .order_by()
+            .annotate(
+                day=TruncDate("start_time", tzinfo=timezone.get_default_timezone())
+            )
+        )
+        for dimension, column in DIMENSION_COLUMNS.items():
+            for row in sessions.values("day", column).annotate(**totals):
+                key = str(row[column])
+                rollup = rollups.setdefault(
+                    (dimension, key, row["day"]),
+                    SessionRollup(dimension=dimension, key=key, day=row["day"]),
+                )
+                rollup.sessions += row["sessions"]
+                rollup.consumed_sessions += row["consumed_sessions"]
+                rollup.booked_amount += row["booked_amount"] or 0
+                rollup.paid_amount += row["paid_amount"] or 0
+    for rollup in rollups.values():
+        rollup.paid_amount = Decimal(rollup.paid_amount).quantize(CENTS)
+    return list(rollups.values())
+
+
+def lock_days(days, using):
+    """
+    Those of `days` no other refresh is computing, locked for them until
+    the end of the transaction.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT day FROM unnest(%s::date[]) AS day
+            WHERE pg_try_advisory_xact_lock(%s, day - DATE '2000-01-01')
+            ORDER BY day
+            """,
+            [sorted(days), REFRESH_LOCK],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _refresh(marks):
+    """
+    Recompute the rollups of the days of the `marks` queryset and delete
+    those marks. Marks and days locked by another refresh are left to it.
+    Returns the refreshed days.
+    """
+    using = router.db_for_write(SessionRollup)
+    with transaction.atomic(using=using):
+        locked = list(
+            marks.using(using)
+            .select_for_update(skip_locked=True)
+            .values_list("pk", "day")
+        )
+        if not locked:
+            return []
+        days = lock_days({day for _, day in locked}, using)
+        if not days:
+            return days
+        rollups = compute_days(days)
+        SessionRollup.objects.using(using).filter(day__in=days).delete()
+        SessionRollup.objects.using(using).bulk_create(rollups)
+        refreshed = set(days)
+        SessionRollupDirtyDay.objects.using(using).filter(
+            pk__in=[pk for pk, day in locked if day in refreshed]
+        ).delete()
+    return days
+
+
+def refresh_days(days):
+    """
+    Refresh those of `days` that are still marked, returns the refreshed
+    days.
+    """
+    return _refresh(
+        SessionRollupDirtyDay.objects.filter(day__in=list(days)).order_by("day", "pk")
+    )
+
+
+# run by the job workers, the catch-up of days whose refresh after commit
+# failed or is disabled
+@schedule
+def refresh_marked(batch_size=None):
+    """
+    Refresh every marked day, `batch_size` marks per transaction, oldest
+    day first. Returns the number of days refreshed.
+    """
+    batch_size = batch_size or get_rollup_setting("BATCH_SIZE")
+    refreshed = 0
+    while True:
+        days = _refresh(SessionRollupDirtyDay.objects.order_by("day", "pk")[:batch_size])
+        if not days:
+            return refreshed
+        refreshed += len(days)
+
+
+def mark_range(start=None, end=None):
+    """
+    Mark every day from `start` (included) to `end` (excluded) that has
+    sessions (live or archived) or rollups, to rebuild them. Returns the
+    number of days.
+    """
+    rollups = SessionRollup.objects.all()
+    if start is not None:
+        rollups = rollups.filter(day__gte=start)
+    if end is not None:
+        rollups = rollups.filter(day__lt=end)
+    days = set(rollups.order_by().values_list("day", flat=True).distinct())
+    for model in [Session, ArchivedSession]:
+        sessions = model.objects.all()
+        if start is not None:
+            sessions = sessions.filter(start_time__gte=day_range(start)[0])
+        if end is not None:
+            sessions = sessions.filter(start_time__lt=day_range(end)[0])
+        days.update(
+            sessions.order_by()
+            .annotate(day=TruncDate("start_time", tzinfo=timezone.get_default_timezone()))
+            .values_list("day", flat=True)
+            .distinct()
+        )
+    if days:
+        mark_days(days)
+    return len(days)
+
+
+def get_rollups(dimension, start, end, key=None):
+    """
+    Rollups of `dimension` for the days from `start` to `end` (excluded).
+    """
+    queryset = SessionRollup.objects.filter(
+        dimension=dimension, day__gte=start, day__lt=end
+    )
+    if key is not None:
+        queryset = queryset.filter(key=key)
+    return queryset
+
+
+def get_totals(rollups, interval="day"):
+    """
+    Totals of `rollups` per key and day or month, in order.
+    """
+    period = F("day") if interval == "day" else TruncMonth("day")
+    return (
+        rollups.order_by()
+        .annotate(period=period)
+        .values("period", "key")
+        .annotate(**{metric: Sum(metric) for metric in METRICS})
+        .order_by("period", "key")
+    )
+
+
+def utilization(totals):
+    if not totals["sessions"]:
+        return None
+    return round(totals["consumed_sessions"] / totals["sessions"], 4)
+
+
+def render_chart(totals, metric, title, max_lines=10):
+    """
+    PNG line chart of `metric` over time for the keys of `totals` with the
+    largest sums, at most `max_lines` of them.
+    """
+    # imported on first use, rendering charts is rare and matplotlib heavy
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    lines = {}
+    for row in totals:
+        value = utilization(row) if metric == "utilization" else row[metric]
+        lines.setdefault(row["key"], {})[row["period"]] = float(value or 0)
+    keys = sorted(lines, key=lambda key: -sum(lines[key].values()))[:max_lines]
+
+    # a Figure of its own instead of pyplot's global state, requests can
+    # render concurrently
+    figure = Figure(figsize=(10, 5), dpi=100)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for key in keys:
+        points = sorted(lines[key].items())
+        axes.plot(
+            [day for day, _ in points],
+            [value for _, value in points],
+            label=key,
+            marker=".",
+        )
+    axes.set_title(title)
+    axes.set_ylabel(metric.replace("_", " "))
+    axes.grid(True, alpha=0.3)
+    if keys:
+        axes.legend(loc="upper left", fontsize="small")
+    figure.autofmt_xdate()
+    buffer = io.BytesIO()
+    # no creation date in the metadata, the same rollups give the same bytes
+    figure.savefig(buffer, format="png", metadata={"Software": None})
+    return buffer.getvalue()
@@ -0,0 +1,129 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_use_replicas = contextvars.ContextVar("use_replicas", default=False)
+
+
+@contextmanager
+def use_replicas(enabled=True):
+    """
+    Let the reads of the enclosed block go to a replica. Outside of it
+    (management commands, workers, pinned requests) everything is read from
+    the primary.
+    """
+    token = _use_replicas.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replicas.reset(token)
+
+
+def get_routing_setting(name):
+    defaults = {
+        "READ_YOUR_WRITES_SECONDS": 5,
+        "MAX_REPLICA_LAG_SECONDS": 2,
+        "LAG_CHECK_INTERVAL": 1,
+        "CACHE_ALIAS": "default",
+    }
+    return getattr(settings, "DATABASE_ROUTING", {}).get(name, defaults[name])
+
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class ReplicaLagMonitor:
+    """
+    Per-process view of replica lag, refreshed at most once per
+    LAG_CHECK_INTERVAL for each replica.
+
+    A replica that is not in recovery (a stand-in database) has no lag, one
+    that cannot be queried counts as lagging.
+    """
+
+    def __init__(self):
+        self._checks = {}  # alias -> (checked_at, lag)
+        self._lock = threading.Lock()
+
+    def lag(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checks.get(alias)
+            if checked is not None and now - checked[0] < get_routing_setting(
+                "LAG_CHECK_INTERVAL"
+            ):
+                return checked[1]
+            # other threads keep using the previous value meanwhile
+            self._checks[alias] = (now, checked[1] if checked else 0)
+
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+            lag = float(lag or 0)
+        except Exception:
+            connections[alias].close()
+            lag = float("inf")
+
+        with self._lock:
+            self._checks[alias] = (time.monotonic(), lag)
+        return lag
+
+    def is_healthy(self, alias):
+        return self.lag(alias) <= get_routing_setting("MAX_REPLICA_LAG_SECONDS")
+
+    def reset(self):
+        with self._lock:
+            self._checks.clear()
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+def get_replicas():
+    return getattr(settings, "REPLICA_DATABASES", [])
+
+
+class PrimaryReplicaRouter:
+    """
+    Send writes to the primary and, inside use_replicas(), reads to a random
+    replica that is not lagging.
+
+    Reads fall back to the primary when no replica is healthy and while the
+    primary connection is inside a transaction, so a transaction never reads
+    around its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if (
+            not replicas
+            or not _use_replicas.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        healthy = [alias for alias in replicas if lag_monitor.is_healthy(alias)]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
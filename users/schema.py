@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views import View
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+
+RENDERERS = {
+    "yaml": OpenApiYamlRenderer,
+    "json": OpenApiJsonRenderer,
+}
+
+
+class SchemaArtifact:
+    """
+    One rendered format of the API schema with its gzip variant and ETags.
+    """
+
+    def __init__(self, format, body, gzipped=None):
+        self.format = format
+        self.content_type = RENDERERS[format].media_type
+        self.body = body
+        self.gzipped = gzipped if gzipped is not None else gzip.compress(body, mtime=0)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+def generate_schema():
+    """
+    Render the OpenAPI schema in every format.
+    """
+    schema = SchemaGenerator().get_schema(request=None, public=True)
+    return {
+        format: renderer().render(schema, renderer_context={})
+        for format, renderer in RENDERERS.items()
+    }
+
+
+def get_schema_dir():
+    return Path(getattr(settings, "API_SCHEMA_DIR", settings.BASE_DIR / "api_schema"))
+
+
+def write_schema(directory=None):
+    """
+    Generate the schema and store it, with gzip variants, under `directory`.
+    Returns the written paths.
+    """
+    directory = Path(directory or get_schema_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for format, body in generate_schema().items():
+        path = directory / f"schema.{format}"
+        path.write_bytes(body)
+        gzip_path = path.with_suffix(path.suffix + ".gz")
+        gzip_path.write_bytes(gzip.compress(body, mtime=0))
+        paths += [path, gzip_path]
+    return paths
+
+
+_artifacts = None
+_artifacts_lock = threading.Lock()
+
+
+def get_artifacts():
+    """
+    Schema artifacts of this process, loaded from the prebuilt files (and
+    their gzip variants) when they exist and generated once otherwise.
+    """
+    global _artifacts
+    if _artifacts is None:
+        with _artifacts_lock:
+            if _artifacts is None:
+                _artifacts = load_artifacts(get_schema_dir())
+    return _artifacts
+
+
+def load_artifacts(directory):
+    paths = {format: directory / f"schema.{format}" for format in RENDERERS}
+    if not all(path.exists() for path in paths.values()):
+        return {
+            format: SchemaArtifact(format, body)
+            for format, body in generate_schema().items()
+        }
+    artifacts = {}
+    for format, path in paths.items():
+        gzip_path = path.with_suffix(path.suffix + ".gz")
+        artifacts[format] = SchemaArtifact(
+            format,
+            path.read_bytes(),
+            gzip_path.read_bytes() if gzip_path.exists() else None,
+        )
+    return artifacts
+
+
+class PrebuiltSchemaView(View):
+    """
+    Serve the prebuilt OpenAPI schema with strong ETags.
+
+    YAML by default like SpectacularAPIView, JSON with ?format=json or an
+    Accept header asking for json. Clients repeating a known ETag in
+    If-None-Match get a bodyless 304.
+    """
+
+    cache_control = "public, max-age=300"
+
+    def get(self, request):
+        artifacts = get_artifacts()
+        format = request.GET.get("format")
+        if format not in artifacts:
+            format = "json" if "json" in request.headers.get("Accept", "") else "yaml"
+        artifact = artifacts[format]
+
+        use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        etag = artifact.gzip_etag if use_gzip else artifact.etag
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                artifact.gzipped if use_gzip else artifact.body,
+                content_type=artifact.content_type,
+            )
+            if use_gzip:
+                response["Content-Encoding"] = "gzip"
+        response["ETag"] = etag
+        response["Cache-Control"] = self.cache_control
+        patch_vary_headers(response, ["Accept", "Accept-Encoding"])
+        return response
@@ -0,0 +1,95 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Cast
+
+from .models import UserIdentity, normalize_search_text
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class SearchQuery:
+    """
+    Similarity ranked user search over the identity index.
+
+    Names, city, specialization and national id are matched in one query
+    against the trigram indexed `UserIdentity.search_text`. The index finds
+    the matching rows, which are then ranked by their computed similarity:
+    every page sorts all the matches again. The keyset on (rank, id) only
+    keeps deep pages from also reading and discarding the rows of the
+    earlier pages, as an offset would.
+    """
+
+    page_size = 10
+
+    def __init__(self, string, cursor=None, page_size=None):
+        self.string = normalize_search_text(string)
+        self.after = self.decode_cursor(cursor) if cursor else None
+        if page_size is not None:
+            self.page_size = page_size
+
+    def get_queryset(self):
+        # rank is rounded to a fixed precision so it can round-trip through
+        # the cursor and be compared for equality on the next page
+        rank = Cast(
+            TrigramWordSimilarity(self.string, "search_text"),
+            output_field=models.DecimalField(max_digits=7, decimal_places=6),
+        )
+        queryset = (
+            UserIdentity.objects.filter(
+                Q(search_text__trigram_word_similar=self.string)
+                | Q(search_text__contains=self.string)
+            )
+            .annotate(rank=rank)
+            .order_by("-rank", "id")
+        )
+        if self.after is not None:
+            rank, pk = self.after
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__gt=pk))
+        return queryset
+
+    def page(self):
+        """
+        Return `(users, next_cursor)` for the current page, next_cursor is
+        None on the last page.
+        """
+        entries, next_cursor = self.page_entries()
+        return UserIdentity.objects.get_users(entries), next_cursor
+
+    def page_entries(self):
+        """
+        Like page() with `(identity, user_id)` pairs instead of users.
+        """
+        if not self.string:
+            return [], None
+
+        entries = list(
+            self.get_queryset().values("id", "identity", "user_id", "rank")[
+                : self.page_size + 1
+            ]
+        )
+        next_cursor = None
+        if len(entries) > self.page_size:
+            entries = entries[: self.page_size]
+            last = entries[-1]
+            next_cursor = self.encode_cursor(last["rank"], last["id"])
+        return [(entry["identity"], entry["user_id"]) for entry in entries], next_cursor
+
+    @staticmethod
+    def encode_cursor(rank, pk):
+        data = json.dumps([str(rank), pk]).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            rank, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return Decimal(rank), int(pk)
+        except (ValueError, TypeError, ArithmeticError):
+            raise InvalidCursor("Invalid cursor.")
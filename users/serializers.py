@@ -1,5 +1,24 @@
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User, Patient, Nurse, Admin, AbstractSession, Session
+from .models import (
+    User,
+    Patient,
+    Nurse,
+    Admin,
+    ArchivedSession,
+    Session,
+    SessionRollup,
+    Identity,
+    UserIdentity,
+    NurseAvailability,
+    NurseAvailabilityException,
+    MINUTES_PER_DAY,
+)
+from .rollups import utilization
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -7,6 +26,8 @@ class UserSerializer(serializers.ModelSerializer):
     Serializer for User model.
     """
 
+    media = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         fields = [
@@ -26,6 +47,10 @@ class UserSerializer(serializers.ModelSerializer):
             "city",
             "country",
             "date_of_birth",
+            "latitude",
+            "longitude",
+            "media",
+            "updated_at",
         ]
         extra_kwargs = {
             "password": {"write_only": True},
@@ -33,68 +58,284 @@ class UserSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         """
-        Encrypt password.
+        Encrypt password, unless the caller already hashed it and passes
+        it as `encoded_password`.
         """
         password = validated_data.pop("password", None)
+        encoded_password = validated_data.pop("encoded_password", None)
         instance = self.Meta.model(**validated_data)
-        if password is not None:
+        if encoded_password is not None:
+            instance.password = encoded_password
+        elif password is not None:
             instance.set_password(password)
         instance.save()
         return instance
 
+    def update(self, instance, validated_data):
+        """
+        Encrypt password, when one is given.
+        """
+        password = validated_data.pop("password", None)
+        if password is not None:
+            instance.set_password(password)
+        return super().update(instance, validated_data)
+
+    # columns and static methods giving SerializerMethodFields from
+    # `.values()` rows, see users.projections
+    projected_methods = {"media": ("processed_media", "represent_media")}
+
+    def get_media(self, user) -> dict:
+        """
+        Processing state of each uploaded file, with the URLs of the WebP
+        variants of processed images (list views should show the thumbnail).
+        """
+        return self.represent_media(
+            user.processed_media, type(user), self.context.get("request")
+        )
+
+    @staticmethod
+    def represent_media(processed_media, model, request=None):
+        media = {}
+        for field, state in processed_media.items():
+            state = {key: value for key, value in state.items() if key != "name"}
+            if "variants" in state:
+                storage = model._meta.get_field(field).storage
+                state["variants"] = {
+                    variant: (
+                        request.build_absolute_uri(storage.url(name))
+                        if request is not None
+                        else storage.url(name)
+                    )
+                    for variant, name in state["variants"].items()
+                }
+            media[field] = state
+        return media
+
+    def validate_email(self, value):
+        return self._validate_unique_identity("email", value)
 
-class PatientSerializer(serializers.ModelSerializer):
+    def validate_national_id(self, value):
+        return self._validate_unique_identity("national_id", value)
+
+    def _validate_unique_identity(self, field, value):
+        """
+        Check uniqueness across all user tables through the identity index.
+        """
+        entries = UserIdentity.objects.filter(**{field: value})
+        if self.instance is not None:
+            entries = entries.exclude(
+                identity=self.instance.identity, user_id=self.instance.pk
+            )
+        if entries.exists():
+            raise serializers.ValidationError(f"user with this {field} already exists.")
+        return value
+
+
+class PatientSerializer(UserSerializer):
     """
     Serializer for patient model
     """
     
-    class Meta:
+    class Meta(UserSerializer.Meta):
         model = Patient
-        fields = [
+        fields = UserSerializer.Meta.fields + [
             "profile_image",
             "chronic_diseases",
             "medical_report",
         ]
 
 
-class NurseSerializer(serializers.ModelSerializer):
+class NurseSerializer(UserSerializer):
     """
     Serializer for Nurse model
     """
     
-    class Meta:
+    class Meta(UserSerializer.Meta):
         model = Nurse
-        fields = [
+        fields = UserSerializer.Meta.fields + [
             "profile_image",
             "specialization",
             "certificates",
             "medical_accreditations",
-            "available_working_hours"
+            "available_working_hours",
+            "session_price",
         ]
 
 
-class AdminSerializer(serializers.ModelSerializer):
+class AdminSerializer(UserSerializer):
     """
     Serializer for Admin model
     """
     
-    class Meta:
+    class Meta(UserSerializer.Meta):
         model = Admin
-        fields = ["profile_image"]
+        fields = UserSerializer.Meta.fields + ["profile_image"]
 
 
-class AbstractSessionSerializer(serializers.ModelSerializer):
+# serializer for each identity, UserSerializer itself can't be used
+# directly because User is abstract
+USER_SERIALIZERS = {
+    Identity.PATIENT: PatientSerializer,
+    Identity.Nurse: NurseSerializer,
+    Identity.ADMIN: AdminSerializer,
+}
+
+
+class NurseAvailabilitySerializer(serializers.Serializer):
     """
-    Serializer for AbstractSession model.
+    Serializer for a weekly working slot of a nurse (Monday is weekday 0).
     """
 
-    class Meta:
-        model = AbstractSession
-        fields = [
-            "id",
-            "session_type",
-            "price",
+    weekday = serializers.IntegerField(min_value=0, max_value=6)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
+
+    def validate(self, attrs):
+        if attrs["end_time"] <= attrs["start_time"]:
+            raise serializers.ValidationError("end_time must be after start_time.")
+        return attrs
+
+    def to_representation(self, instance):
+        day = instance.weekday * MINUTES_PER_DAY
+        start, end = instance.minutes.lower - day, instance.minutes.upper - day
+        return {
+            "weekday": instance.weekday,
+            "start_time": f"{start // 60:02d}:{start % 60:02d}:00",
+            "end_time": f"{end // 60:02d}:{end % 60:02d}:00",
+        }
+
+
+class NurseAvailabilityExceptionSerializer(serializers.Serializer):
+    """
+    Serializer for a one-off extra availability or time off of a nurse.
+    """
+
+    start_time = serializers.DateTimeField(source="period.lower")
+    end_time = serializers.DateTimeField(source="period.upper")
+    is_available = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        period = attrs["period"]
+        if period["upper"] <= period["lower"]:
+            raise serializers.ValidationError("end_time must be after start_time.")
+        return attrs
+
+
+class NurseScheduleSerializer(serializers.Serializer):
+    """
+    Serializer for the whole schedule of a nurse, saving replaces it.
+    """
+
+    slots = NurseAvailabilitySerializer(many=True, source="availability.all")
+    exceptions = NurseAvailabilityExceptionSerializer(
+        many=True, source="availability_exceptions.all"
+    )
+
+    def validate_slots(self, value):
+        slots = sorted(value, key=lambda slot: (slot["weekday"], slot["start_time"]))
+        for previous, following in zip(slots, slots[1:]):
+            if (
+                previous["weekday"] == following["weekday"]
+                and following["start_time"] < previous["end_time"]
+            ):
+                raise serializers.ValidationError("Weekly slots must not overlap.")
+        return slots
+
+    def update(self, instance, validated_data):
+        slots = [
+            NurseAvailability.weekly(
+                instance, slot["weekday"], slot["start_time"], slot["end_time"]
+            )
+            for slot in validated_data["availability"]["all"]
         ]
+        exceptions = [
+            NurseAvailabilityException(
+                nurse=instance,
+                period=(exception["period"]["lower"], exception["period"]["upper"]),
+                is_available=exception["is_available"],
+            )
+            for exception in validated_data["availability_exceptions"]["all"]
+        ]
+        with transaction.atomic():
+            instance.availability.all().delete()
+            instance.availability_exceptions.all().delete()
+            NurseAvailability.objects.bulk_create(slots)
+            NurseAvailabilityException.objects.bulk_create(exceptions)
+        return instance
+
+
+class AvailabilityWindowSerializer(serializers.Serializer):
+    """
+    Serializer for the query parameters of availability searches.
+    """
+
+    # free intervals expand the weekly slots of every week of the window
+    MAX_DAYS = 31
+
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+    city = serializers.CharField(required=False)
+    specialization = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if attrs["end_time"] <= attrs["start_time"]:
+            raise serializers.ValidationError("end_time must be after start_time.")
+        if attrs["end_time"] - attrs["start_time"] > datetime.timedelta(days=self.MAX_DAYS):
+            raise serializers.ValidationError(
+                f"The window can't be longer than {self.MAX_DAYS} days."
+            )
+        return attrs
+
+
+class NurseMatchQuerySerializer(serializers.Serializer):
+    """
+    Serializer for the query parameters of nurse matching.
+    """
+
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(min_value=0.1, max_value=500, default=25)
+    specialization = serializers.CharField(required=False)
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate(self, attrs):
+        if ("start_time" in attrs) != ("end_time" in attrs):
+            raise serializers.ValidationError("start_time and end_time go together.")
+        if "start_time" in attrs and attrs["end_time"] <= attrs["start_time"]:
+            raise serializers.ValidationError("end_time must be after start_time.")
+        return attrs
+
+
+class NurseMatchSerializer(NurseSerializer):
+    """
+    Serializer for a ranked nurse match.
+    """
+
+    distance_km = serializers.FloatField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(NurseSerializer.Meta):
+        fields = NurseSerializer.Meta.fields + ["distance_km", "score"]
+
+
+class CalendarRangeSerializer(serializers.Serializer):
+    """
+    Serializer for the optional date range of session calendars.
+    """
+
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+
+class FreeIntervalSerializer(serializers.Serializer):
+    """
+    Serializer for a free interval of a nurse.
+    """
+
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
 
 
 class SessionSerializer(serializers.ModelSerializer):
@@ -102,6 +343,9 @@ class SessionSerializer(serializers.ModelSerializer):
     Serializer for Session model.
     """
 
+    # relations lists can return as nested objects with ?expand=
+    expandable_fields = {"patient": PatientSerializer, "nurse": NurseSerializer}
+
     class Meta:
         model = Session
         fields = [
@@ -118,8 +362,141 @@ class SessionSerializer(serializers.ModelSerializer):
             "place",
             "start_time",
             "end_time",
+            "series",
+            "ordinal",
+            "updated_at",
         ]
         extra_kwargs = {
             "session_type": {"read_only": True},
             "price": {"read_only": True},
+            "series": {"read_only": True},
+            "ordinal": {"read_only": True},
         }
+
+
+class ArchivedSessionSerializer(SessionSerializer):
+    """
+    Serializer for ArchivedSession model, the representation of live
+    sessions.
+    """
+
+    class Meta(SessionSerializer.Meta):
+        model = ArchivedSession
+
+
+class ConsumeSessionSerializer(serializers.Serializer):
+    """
+    Serializer for consuming one session of a treatment course.
+    """
+
+    paid_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal(0), default=0
+    )
+
+
+class SeriesStateSerializer(serializers.Serializer):
+    """
+    Serializer for the counters of a treatment course after a consumption.
+    """
+
+    series = serializers.UUIDField()
+    consumed_ordinal = serializers.IntegerField()
+    total_sessions = serializers.IntegerField()
+    remaining_sessions = serializers.IntegerField()
+    paid_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class SessionSlotSerializer(serializers.Serializer):
+    """
+    Time slot of one session in a booking.
+    """
+
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+
+    def validate(self, attrs):
+        if attrs["end_time"] <= attrs["start_time"]:
+            raise serializers.ValidationError("end_time must be after start_time.")
+        return attrs
+
+
+class BookSeriesSerializer(serializers.Serializer):
+    """
+    Serializer for booking a treatment course of several sessions at once.
+    """
+
+    patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all())
+    nurse = serializers.PrimaryKeyRelatedField(queryset=Nurse.objects.all())
+    session_type = serializers.CharField(max_length=55)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    paid_price = serializers.DecimalField(max_digits=10, decimal_places=2, default=0)
+    place = serializers.CharField(max_length=100)
+    slots = SessionSlotSerializer(many=True, allow_empty=False)
+
+    def validate_slots(self, value):
+        return sorted(value, key=lambda slot: slot["start_time"])
+
+    def create(self, validated_data):
+        """
+        Create and link the whole series in one transaction.
+        """
+        slots = [
+            (slot["start_time"], slot["end_time"])
+            for slot in validated_data.pop("slots")
+        ]
+        return Session.objects.book_series(slots=slots, **validated_data)
+
+
+class SessionRollupQuerySerializer(serializers.Serializer):
+    """
+    Serializer for the query parameters of session analytics, the last 30
+    days by default.
+    """
+
+    MAX_DAYS = 731
+
+    dimension = serializers.ChoiceField(choices=SessionRollup.Dimension.choices)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=["day", "month"], default="day")
+    key = serializers.CharField(required=False, max_length=100)
+    # charts only
+    metric = serializers.ChoiceField(
+        choices=[
+            "sessions",
+            "consumed_sessions",
+            "utilization",
+            "booked_amount",
+            "paid_amount",
+        ],
+        default="paid_amount",
+    )
+
+    def validate(self, attrs):
+        today = timezone.localdate(timezone=timezone.get_default_timezone())
+        attrs.setdefault("end", today + datetime.timedelta(days=1))
+        attrs.setdefault("start", attrs["end"] - datetime.timedelta(days=30))
+        if attrs["end"] <= attrs["start"]:
+            raise serializers.ValidationError("end must be after start.")
+        if (attrs["end"] - attrs["start"]).days > self.MAX_DAYS:
+            raise serializers.ValidationError(
+                f"The range can't be longer than {self.MAX_DAYS} days."
+            )
+        return attrs
+
+
+class SessionRollupSerializer(serializers.Serializer):
+    """
+    Serializer for the session totals of a key over a day or month.
+    """
+
+    key = serializers.CharField()
+    period = serializers.DateField()
+    sessions = serializers.IntegerField()
+    consumed_sessions = serializers.IntegerField()
+    utilization = serializers.SerializerMethodField()
+    booked_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    paid_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+    def get_utilization(self, totals) -> float | None:
+        return utilization(totals)
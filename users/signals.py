@@ -0,0 +1,146 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .auth_cache import principal_cache
+from .media import get_media_fields, schedule_media_processing
+from .profile_cache import profile_cache
+from .rollups import days_changed, mark_sessions, session_day
+from .models import (
+    Admin,
+    Nurse,
+    Patient,
+    Session,
+    UserIdentity,
+    MODEL_IDENTITIES,
+    sessions_changed,
+)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Nurse)
+@receiver(post_save, sender=Admin)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Nurse)
+@receiver(post_delete, sender=Admin)
+def invalidate_cached_principal(sender, instance, **kwargs):
+    """
+    Drop cached tokens of a user whenever it is saved (password change,
+    profile update) or deleted.
+    """
+    principal_cache.invalidate_user(instance)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Nurse)
+@receiver(post_save, sender=Admin)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Nurse)
+@receiver(post_delete, sender=Admin)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    """
+    Drop cached representations of a user when it is saved or deleted,
+    again after commit so a read between the two can't cache the
+    uncommitted state as current.
+    """
+    identity, pk = MODEL_IDENTITIES[sender], instance.pk
+    profile_cache.invalidate(identity, pk)
+    transaction.on_commit(lambda: profile_cache.invalidate(identity, pk))
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Nurse)
+@receiver(post_delete, sender=Admin)
+def delete_user_identity(sender, instance, **kwargs):
+    """
+    Remove the identity index entry of a deleted user. Runs inside the
+    transaction of the delete.
+    """
+    UserIdentity.objects.filter(
+        identity=MODEL_IDENTITIES[sender], user_id=instance.pk
+    ).delete()
+
+
+@receiver(pre_save, sender=Patient)
+@receiver(pre_save, sender=Nurse)
+@receiver(pre_save, sender=Admin)
+def mark_new_uploads(sender, instance, **kwargs):
+    """
+    Flag files assigned since the user was loaded as pending, they are
+    written to storage by this save.
+    """
+    instance._new_uploads = [
+        field.name
+        for field in get_media_fields(sender)
+        if getattr(instance, field.name) and not getattr(instance, field.name)._committed
+    ]
+    for field in instance._new_uploads:
+        instance.processed_media[field] = {"status": "pending"}
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Nurse)
+@receiver(post_save, sender=Admin)
+def process_new_uploads(sender, instance, **kwargs):
+    """
+    Hand the new uploads to the media workers after commit.
+    """
+    fields = getattr(instance, "_new_uploads", None)
+    if fields:
+        schedule_media_processing(instance, fields)
+        instance._new_uploads = []
+
+
+@receiver(sessions_changed)
+def mark_changed_session_days(sender, start_times, **kwargs):
+    """
+    Rollups of sessions written in bulk or by raw updates.
+    """
+    days_changed(session_day(start_time) for start_time in start_times)
+
+
+@receiver(pre_save, sender=Session)
+def remember_session_day(sender, instance, **kwargs):
+    """
+    Keep the day a session being moved is leaving, its rollups change too.
+    """
+    instance._previous_start_time = None
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and "start_time" not in update_fields:
+        return
+    if instance.pk is not None and not kwargs.get("raw"):
+        instance._previous_start_time = (
+            Session.objects.filter(pk=instance.pk)
+            .values_list("start_time", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def mark_session_days(sender, instance, **kwargs):
+    start_times = [instance.start_time, getattr(instance, "_previous_start_time", None)]
+    days_changed(session_day(start_time) for start_time in start_times if start_time)
+
+
+@receiver(pre_save, sender=Patient)
+def remember_patient_city(sender, instance, **kwargs):
+    instance._previous_city = None
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and "city" not in update_fields:
+        return
+    if instance.pk is not None and not kwargs.get("raw"):
+        instance._previous_city = (
+            Patient.objects.filter(pk=instance.pk).values_list("city", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Patient)
+def mark_patient_session_days(sender, instance, created, **kwargs):
+    """
+    City rollups count sessions by the city of their patient, a move
+    changes every day the patient has sessions.
+    """
+    previous = getattr(instance, "_previous_city", None)
+    if not created and previous is not None and previous != instance.city:
+        mark_sessions(instance.sessions.all())
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files by the SHA-256 of their content.
+
+    `reports/scan.pdf` is stored as `reports/ab/cd/abcd…ef.pdf`, so the same
+    file uploaded twice (a certificate re-uploaded by another nurse) is
+    stored once, and names never change content, which makes the hash a
+    strong ETag. Files are written to a temporary name and renamed into
+    place, so concurrent uploads of the same content are safe.
+
+    Files are shared between rows, so delete() keeps them.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # names are derived from the content in _save, they never collide
+        return name
+
+    def get_content_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    @staticmethod
+    def hash_content(content):
+        digest = hashlib.sha256()
+        if hasattr(content, "temporary_file_path"):
+            with open(content.temporary_file_path(), "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        else:
+            for chunk in content.chunks():
+                digest.update(chunk.encode() if isinstance(chunk, str) else chunk)
+        return digest.hexdigest()
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, self.hash_content(content))
+        if self.exists(name):
+            return name
+
+        temporary_name = posixpath.join(posixpath.dirname(name), f".{uuid.uuid4().hex}.tmp")
+        temporary_name = super()._save(temporary_name, content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+    def delete(self, name):
+        pass
+
+    @staticmethod
+    def get_digest(name):
+        """
+        Content hash of a content addressed name, None for other names.
+        """
+        root = posixpath.splitext(posixpath.basename(name))[0]
+        if len(root) == 64 and all(char in "0123456789abcdef" for char in root):
+            return root
+        return None
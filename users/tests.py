@@ -1,3 +1,1093 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from Kraston.db_pool.base import ConnectionPool, close_pools, get_pool
+
+from .instrumentation import assert_query_budget
+from . import partitions
+from .auth_cache import PrincipalCache
+from .bulk import SessionImporter, UserImporter, get_importer, read_rows
+from .jobs import LeaseRenewal, claim, enqueue, execute, requeue_expired, task
+from .middleware import authenticate_token
+from .profile_cache import ProfileCache, profile_cache
+from .projections import get_projection
+from .renderers import FastJSONRenderer
+from .schema import load_artifacts, write_schema
+from .serializers import NurseSerializer, PatientSerializer, SessionSerializer
+from .models import (
+    Admin,
+    BookingConflict,
+    Identity,
+    ArchivedSession,
+    Job,
+    MINUTES_PER_DAY,
+    Nurse,
+    NurseAvailability,
+    Patient,
+    Session,
+    SessionRollup,
+    SessionRollupDirtyDay,
+    UserIdentity,
+)
+from .rollups import compute_days, mark_sessions, refresh_marked
+
+
+def create_patient(number, **fields):
+    return Patient.objects.create(
+        **{
+            "email": f"patient{number}@example.com",
+            "username": f"patient{number}",
+            "national_id": f"P{number}",
+            "first_name": f"Patient{number}",
+            "last_name": "Test",
+            "gender": "M",
+            "phone_number": "0100000000",
+            "nationality": "Egyptian",
+            "location": "Home",
+            "city": "Cairo",
+            "country": "Egypt",
+            "date_of_birth": "1990-01-01",
+            **fields,
+        }
+    )
+
+
+def create_nurse(number, **fields):
+    return Nurse.objects.create(
+        **{
+            "email": f"nurse{number}@example.com",
+            "username": f"nurse{number}",
+            "national_id": f"N{number}",
+            "first_name": f"Nurse{number}",
+            "last_name": "Test",
+            "gender": "F",
+            "phone_number": "0100000000",
+            "nationality": "Egyptian",
+            "location": "Clinic",
+            "city": "Cairo",
+            "country": "Egypt",
+            "date_of_birth": "1990-01-01",
+            "specialization": "Pediatrics",
+            "available_working_hours": "9-5",
+            **fields,
+        }
+    )
+
+
+def create_admin(number, **fields):
+    return Admin.objects.create(
+        **{
+            "email": f"admin{number}@example.com",
+            "username": f"admin{number}",
+            "national_id": f"A{number}",
+            "first_name": f"Admin{number}",
+            "last_name": "Test",
+            "gender": "F",
+            "phone_number": "0100000000",
+            "nationality": "Egyptian",
+            "location": "Office",
+            "city": "Cairo",
+            "country": "Egypt",
+            "date_of_birth": "1990-01-01",
+            "profile_image": "profile_images/admin.png",
+            **fields,
+        }
+    )
+
+
+def make_token(user):
+    """
+    Token as issued by the login views.
+    """
+    return jwt.encode(
+        {
+            "id": user.id,
+            "identity": user.identity,
+            "jti": uuid.uuid4().hex,
+            "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=30),
+        },
+        "secret",
+        algorithm="HS256",
+    )
+
+
+def make_slots(start, count, days_apart=7):
+    return [
+        (
+            start + datetime.timedelta(days=days_apart * number),
+            start + datetime.timedelta(days=days_apart * number, hours=1),
+        )
+        for number in range(count)
+    ]
+
+
+def book(patient, nurse, slots, price="100.00"):
+    return Session.objects.book_series(
+        patient, nurse, "Physiotherapy", Decimal(price), "Home", slots
+    )
+
+
+class UserIdentityTests(TestCase):
+    def test_kept_in_sync_on_save_and_delete(self):
+        patient = create_patient(1)
+        nurse = create_nurse(1, national_id="P2")
+        entry = UserIdentity.objects.get(identity=Identity.PATIENT, user_id=patient.pk)
+        self.assertEqual(entry.email, "patient1@example.com")
+        self.assertEqual(UserIdentity.objects.get_user(national_id="P2"), nurse)
+
+        patient.email = "renamed@example.com"
+        patient.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.email, "renamed@example.com")
+        self.assertEqual(UserIdentity.objects.get_user(email="renamed@example.com"), patient)
+
+        patient.delete()
+        self.assertFalse(
+            UserIdentity.objects.filter(identity=Identity.PATIENT, user_id=patient.pk).exists()
+        )
+        self.assertEqual(UserIdentity.objects.count(), 1)
+
+
+class BookSeriesTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+        self.nurse = create_nurse(1)
+        self.start = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+
+    def test_sessions_are_linked_in_order(self):
+        sessions = book(self.patient, self.nurse, make_slots(self.start, 3))
+        chain = list(Session.objects.chain(sessions[0].series))
+        self.assertEqual([session.ordinal for session in chain], [1, 2, 3])
+        self.assertEqual(chain[0].next_session_id, chain[1].pk)
+        self.assertEqual(chain[2].prev_session_id, chain[1].pk)
+        self.assertEqual({session.remaining_sessions for session in chain}, {3})
+
+    def test_overlap_with_the_nurse_raises_booking_conflict(self):
+        book(self.patient, self.nurse, make_slots(self.start, 2))
+        other = create_patient(2)
+        overlapping = self.start + datetime.timedelta(days=7, minutes=30)
+        with self.assertRaisesMessage(
+            BookingConflict, "The nurse is already booked at this time."
+        ):
+            book(other, self.nurse, [(overlapping, overlapping + datetime.timedelta(hours=1))])
+        # the whole course is rolled back
+        self.assertEqual(Session.objects.filter(patient=other).count(), 0)
+
+    def test_overlap_is_answered_with_409(self):
+        book(self.patient, create_nurse(2), make_slots(self.start, 1))
+        response = self.client.post(
+            "/sessions/book/",
+            {
+                "patient": self.patient.pk,
+                "nurse": self.nurse.pk,
+                "session_type": "Physiotherapy",
+                "price": "100.00",
+                "place": "Home",
+                "slots": [
+                    {
+                        "start_time": (self.start + datetime.timedelta(minutes=30)).isoformat(),
+                        "end_time": (self.start + datetime.timedelta(hours=2)).isoformat(),
+                    }
+                ],
+            },
+            content_type="application/json",
+            HTTP_AUTHORIZATION=make_token(self.patient),
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), "The patient is already booked at this time.")
+
+
+class ConcurrentConsumeTests(TransactionTestCase):
+    # flushed with TRUNCATE ... CASCADE, the unmanaged session archive
+    # references the user tables
+    available_apps = ["django.contrib.auth", "django.contrib.contenttypes", "users"]
+
+    def test_concurrent_consumers_never_lose_or_overdraw_sessions(self):
+        patient, nurse = create_patient(1), create_nurse(1)
+        start = timezone.now() + datetime.timedelta(days=1)
+        series = book(patient, nurse, make_slots(start, 5))[0].series
+
+        barrier = threading.Barrier(8)
+        states = []
+
+        def consume():
+            try:
+                barrier.wait()
+                states.append(Session.objects.consume(series, Decimal("10.00")))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=consume) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        consumed = [state for state in states if state is not None]
+        self.assertEqual(len(states), 8)
+        self.assertEqual(len(consumed), 5)
+        self.assertEqual(
+            sorted(state["consumed_ordinal"] for state in consumed), [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(
+            set(Session.objects.filter(series=series).values_list("remaining_sessions", "paid_price")),
+            {(0, Decimal("50.00"))},
+        )
+
+
+class ArchiveTests(TransactionTestCase):
+    available_apps = ["django.contrib.auth", "django.contrib.contenttypes", "users"]
+
+    def setUp(self):
+        self.patient, self.nurse = create_patient(1), create_nurse(1)
+        self.now = timezone.now()
+
+    def book_consumed(self, start, count, consumed):
+        series = book(self.patient, self.nurse, make_slots(start, count))[0].series
+        for _ in range(consumed):
+            Session.objects.consume(series)
+        return series
+
+    def get_partition(self, pk):
+        table = ArchivedSession._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {table} WHERE id = %s", [pk])
+            return cursor.fetchone()[0]
+
+    def test_only_old_fully_consumed_courses_move_whole(self):
+        old = self.now - datetime.timedelta(days=800)
+        consumed = self.book_consumed(old, 3, consumed=3)
+        partly_consumed = self.book_consumed(old + datetime.timedelta(hours=2), 3, consumed=2)
+        recent = self.book_consumed(self.now - datetime.timedelta(days=30), 2, consumed=2)
+        ids = set(Session.objects.filter(series=consumed).values_list("pk", flat=True))
+
+        self.assertEqual(partitions.archive_series(retention_days=365, now=self.now), (1, 3))
+
+        self.assertFalse(Session.objects.filter(series=consumed).exists())
+        archived = ArchivedSession.objects.chain(consumed)
+        self.assertEqual({session.pk for session in archived}, ids)
+        self.assertEqual([session.ordinal for session in archived], [1, 2, 3])
+        for series in [partly_consumed, recent]:
+            self.assertFalse(ArchivedSession.objects.filter(series=series).exists())
+        self.assertEqual(Session.objects.filter(series=partly_consumed).count(), 3)
+        self.assertEqual(Session.objects.filter(series=recent).count(), 2)
+        # every session went to the partition of its month
+        for session in archived:
+            self.assertEqual(
+                self.get_partition(session.pk), partitions.partition_name(session.start_time)
+            )
+        # nothing left to archive
+        self.assertEqual(partitions.archive_series(retention_days=365, now=self.now), (0, 0))
+
+    def test_default_partition_rows_move_to_an_attached_month(self):
+        partitions.ensure_archive_table()
+        month = partitions.month_start(self.now - datetime.timedelta(days=2000))
+        name = partitions.partition_name(month)
+        self.assertNotIn(name, partitions.get_partitions())
+        series = self.book_consumed(month + datetime.timedelta(days=3), 1, consumed=1)
+        session = Session.objects.get(series=series)
+        columns = ", ".join(partitions.ARCHIVED_COLUMNS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {ArchivedSession._meta.db_table} ({columns}, archived_at) "
+                f"SELECT {columns}, now() FROM {Session._meta.db_table} WHERE id = %s",
+                [session.pk],
+            )
+        default = ArchivedSession._meta.db_table + "_default"
+        self.assertEqual(self.get_partition(session.pk), default)
+
+        self.assertEqual(partitions.ensure_partitions(month, month), [name])
+
+        self.assertEqual(self.get_partition(session.pk), name)
+        self.assertEqual(ArchivedSession.objects.filter(pk=session.pk).count(), 1)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    List endpoints run a constant number of queries whatever the page size.
+    """
+
+    def setUp(self):
+        self.patients, self.nurses = [], []
+        for number in range(10):
+            self.patients.append(create_patient(number))
+            self.nurses.append(create_nurse(number))
+        start = timezone.now() + datetime.timedelta(days=1)
+        for number, (patient, nurse) in enumerate(zip(self.patients, self.nurses)):
+            book(patient, nurse, make_slots(start + datetime.timedelta(hours=2 * number), 2))
+
+    def get(self, user, path, budget):
+        token = make_token(user)
+        # warm principal, as for any client past its first request
+        authenticate_token(token)
+        with assert_query_budget(budget, max_duplicates=1):
+            return self.client.get(path, HTTP_AUTHORIZATION=token)
+
+    def test_user_list(self):
+        # the identity page, then one query per identity of the page
+        response = self.get(self.patients[0], "/users/", 3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 10)
+
+    def test_session_list(self):
+        # the validators aggregate, then the page with its expanded users
+        response = self.get(self.nurses[0], "/sessions/?expand=patient,nurse", 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+@task("tests.record")
+def record_task(value):
+    RECORDED.append(value)
+
+
+RECORDED = []
+
+
+class JobTests(TransactionTestCase):
+    available_apps = ["django.contrib.auth", "django.contrib.contenttypes", "users"]
+
+    def setUp(self):
+        RECORDED.clear()
+
+    def test_each_claim_locks_with_its_own_token(self):
+        first, second = enqueue("tests.record", value=1), enqueue("tests.record", value=2)
+        [claimed_first] = claim("worker")
+        [claimed_second] = claim("worker")
+        self.assertEqual({claimed_first.pk, claimed_second.pk}, {first.pk, second.pk})
+        self.assertNotEqual(claimed_first.locked_by, claimed_second.locked_by)
+        self.assertTrue(claimed_first.locked_by.startswith("worker:"))
+
+    def test_expired_claim_does_not_record_the_outcome(self):
+        job = enqueue("tests.record", value=1)
+        [stale] = claim("worker")
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.assertEqual(requeue_expired(), 1)
+        # claimed again by another thread of the same worker
+        [current] = claim("worker")
+
+        self.assertTrue(execute(stale))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.locked_by, current.locked_by)
+
+        self.assertTrue(execute(current))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(RECORDED, [1, 1])
+
+    def test_lease_is_renewed_while_the_job_runs(self):
+        enqueue("tests.record", value=1)
+        [job] = claim("worker")
+        with LeaseRenewal(job, interval=0.05):
+            threading.Event().wait(0.3)
+        renewed = Job.objects.get(pk=job.pk).locked_at
+        self.assertGreater(renewed, job.locked_at)
+
+
+class AvailabilityWindowTests(TestCase):
+    def setUp(self):
+        self.nurse = create_nurse(1)
+
+    def get_free(self, start, end):
+        return self.client.get(
+            f"/nurses/{self.nurse.pk}/free/",
+            {"start_time": start.isoformat(), "end_time": end.isoformat()},
+            HTTP_AUTHORIZATION=make_token(self.nurse),
+        )
+
+    def test_window_span_is_limited(self):
+        start = timezone.now()
+        self.assertEqual(self.get_free(start, start + datetime.timedelta(days=31)).status_code, 200)
+        response = self.get_free(start, start + datetime.timedelta(days=3650))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"non_field_errors": ["The window can't be longer than 31 days."]}
+        )
+
+    def is_available(self, start, end):
+        return Nurse.objects.available_between(start, end).filter(pk=self.nurse.pk).exists()
+
+    def test_window_across_back_to_back_slots(self):
+        NurseAvailability.objects.bulk_create(
+            [
+                NurseAvailability.weekly(self.nurse, 0, datetime.time(9), datetime.time(12)),
+                NurseAvailability.weekly(self.nurse, 0, datetime.time(12), datetime.time(15)),
+            ]
+        )
+        monday = datetime.datetime(2030, 3, 4, tzinfo=timezone.get_current_timezone())
+        hour = datetime.timedelta(hours=1)
+        self.assertTrue(self.is_available(monday + 11 * hour, monday + 13 * hour))
+        self.assertTrue(self.is_available(monday + 9 * hour, monday + 15 * hour))
+        self.assertFalse(self.is_available(monday + 11 * hour, monday + 16 * hour))
+
+    def test_window_from_sunday_into_monday(self):
+        sunday = 6 * MINUTES_PER_DAY
+        NurseAvailability.objects.bulk_create(
+            [
+                NurseAvailability(
+                    nurse=self.nurse, minutes=(sunday + 20 * 60, sunday + MINUTES_PER_DAY)
+                ),
+                NurseAvailability(nurse=self.nurse, minutes=(0, 2 * 60)),
+            ]
+        )
+        midnight = datetime.datetime(2030, 3, 4, tzinfo=timezone.get_current_timezone())
+        hour = datetime.timedelta(hours=1)
+        self.assertTrue(self.is_available(midnight - hour, midnight + hour))
+        self.assertFalse(self.is_available(midnight - hour, midnight + 3 * hour))
+        self.assertFalse(self.is_available(midnight - 5 * hour, midnight + hour))
+
+
+class ConnectionPoolTests(TestCase):
+    def test_session_state_is_discarded_before_reuse(self):
+        params = connection.get_connection_params()
+        pool = ConnectionPool(max_size=1, max_lifetime=3600, health_check_after=30, timeout=5)
+        self.addCleanup(pool.close)
+        raw = pool.get(lambda: connection.get_new_connection(params))
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute("SET statement_timeout = 1234")
+        pool.put(raw)
+
+        self.assertIs(pool.get(lambda: self.fail("the idle connection is reused")), raw)
+        with raw.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            self.assertNotEqual(cursor.fetchone()[0], "1234ms")
+        pool.put(raw)
+
+    def test_pools_are_keyed_by_connection_parameters(self):
+        self.addCleanup(close_pools)
+        settings_dict = {"POOL": {"MAX_SIZE": 1}}
+        first = get_pool(settings_dict, {"dbname": "test_a", "host": "db"})
+        self.assertIs(get_pool(settings_dict, {"host": "db", "dbname": "test_a"}), first)
+        self.assertIsNot(get_pool(settings_dict, {"dbname": "test_b", "host": "db"}), first)
+
+
+class AuthenticationTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+
+    def test_warm_token_resolves_without_queries(self):
+        token = make_token(self.patient)
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate_token(token), self.patient)
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate_token(token), self.patient)
+
+    def test_saving_the_user_drops_its_cached_principal(self):
+        token = make_token(self.patient)
+        authenticate_token(token)
+        self.patient.first_name = "Renamed"
+        self.patient.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate_token(token).first_name, "Renamed")
+
+    def test_middleware_rejects_requests_without_a_valid_token(self):
+        for headers in [{}, {"HTTP_AUTHORIZATION": "not-a-token"}]:
+            with self.subTest(headers=headers):
+                response = self.client.get("/users/", **headers)
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(response.json(), {"detail": "Unauthenticated!"})
+
+    def test_logged_out_token_is_rejected(self):
+        token = make_token(self.patient)
+        self.assertEqual(
+            self.client.get("/users/", HTTP_AUTHORIZATION=token).status_code, 200
+        )
+        self.client.post("/auth/logout/", HTTP_AUTHORIZATION=token)
+        self.assertIsNone(authenticate_token(token))
+        self.assertEqual(
+            self.client.get("/users/", HTTP_AUTHORIZATION=token).status_code, 403
+        )
+
+    def test_token_without_expiry_is_revoked_for_the_ttl(self):
+        token = jwt.encode(
+            {"id": self.patient.id, "identity": self.patient.identity, "jti": uuid.uuid4().hex},
+            "secret",
+            algorithm="HS256",
+        )
+        response = self.client.post("/auth/logout/", HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(authenticate_token(token))
+
+    def test_expired_revocations_are_pruned(self):
+        cache = PrincipalCache(ttl=300)
+        cache.revoke("expired", time.time() - 1)
+        cache.revoke("current", time.time() + 60)
+        cache.revoke("no-expiry")
+        self.assertEqual(set(cache._revoked), {"current", "no-expiry"})
+        self.assertTrue(cache.is_revoked("no-expiry"))
+
+
+class MediaDownloadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.patient = create_patient(1)
+        self.nurse = create_nurse(1)
+        self.report = default_storage.save(
+            "reports/scan.pdf", ContentFile(b"%PDF-1.4 report\n%%EOF")
+        )
+        Patient.objects.filter(pk=self.patient.pk).update(medical_report=self.report)
+
+    def get(self, user, path):
+        return self.client.get(path, HTTP_AUTHORIZATION=make_token(user))
+
+    def test_patient_downloads_own_report(self):
+        response = self.get(self.patient, f"/media/{self.report}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 report\n%%EOF")
+
+    def test_report_needs_a_session_with_the_patient(self):
+        response = self.get(self.nurse, f"/media/{self.report}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_dot_segments_are_rejected(self):
+        for path in [
+            f"/media/profile_images/../{self.report}",
+            f"/media/profile_images/%2e%2e/{self.report}",
+            f"/media/certificates/./../{self.report}",
+            f"/media/profile_images//../{self.report}",
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(self.get(self.nurse, path).status_code, 404)
+
+
+class UserUpdateTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+
+    def test_password_is_hashed(self):
+        data = {
+            "national_id": "P1",
+            "username": "patient1",
+            "first_name": "Renamed",
+            "last_name": "Test",
+            "email": "patient1@example.com",
+            "password": "n3w-Passw0rd",
+            "identity": "P",
+            "gender": "M",
+            "phone_number": "0100000000",
+            "nationality": "Egyptian",
+            "location": "Home",
+            "city": "Cairo",
+            "country": "Egypt",
+            "date_of_birth": "1990-01-01",
+        }
+        response = self.client.put(
+            f"/users/patient/{self.patient.pk}/",
+            data,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=make_token(self.patient),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("password", response.json())
+        self.patient.refresh_from_db()
+        self.assertEqual(self.patient.first_name, "Renamed")
+        self.assertNotEqual(self.patient.password, "n3w-Passw0rd")
+        self.assertTrue(self.patient.check_password("n3w-Passw0rd"))
+
+
+class SessionRollupTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+        self.nurse = create_nurse(1)
+        start = datetime.datetime(2030, 3, 4, 10, tzinfo=timezone.get_default_timezone())
+        self.sessions = book(self.patient, self.nurse, make_slots(start, 2))
+        self.days = [start.date(), start.date() + datetime.timedelta(days=7)]
+
+    def get_marked(self):
+        return set(SessionRollupDirtyDay.objects.values_list("day", flat=True))
+
+    def get_city_keys(self):
+        return set(
+            SessionRollup.objects.filter(dimension="city").values_list("key", flat=True)
+        )
+
+    def test_compute_days(self):
+        Session.objects.consume(self.sessions[0].series, paid_price=Decimal("50.00"))
+        rollups = {
+            (rollup.dimension, rollup.key): rollup
+            for rollup in compute_days(self.days[:1])
+        }
+        self.assertEqual(
+            set(rollups),
+            {("nurse", str(self.nurse.pk)), ("city", "Cairo"), ("session_type", "Physiotherapy")},
+        )
+        city = rollups["city", "Cairo"]
+        self.assertEqual(city.day, self.days[0])
+        self.assertEqual((city.sessions, city.consumed_sessions), (1, 1))
+        self.assertEqual(city.booked_amount, Decimal("100.00"))
+        # what was paid is spread over the two sessions of the course
+        self.assertEqual(city.paid_amount, Decimal("25.00"))
+
+    def test_bookings_are_refreshed_by_the_workers(self):
+        self.assertEqual(self.get_marked(), set(self.days))
+        self.assertFalse(SessionRollup.objects.exists())
+        self.assertEqual(refresh_marked(), 2)
+        self.assertEqual(self.get_marked(), set())
+        self.assertEqual(SessionRollup.objects.filter(dimension="city").count(), 2)
+
+    def test_sync_refreshes_after_commit(self):
+        refresh_marked()
+        nurse = create_nurse(2)
+        start = datetime.datetime(2030, 3, 5, 10, tzinfo=timezone.get_default_timezone())
+        with override_settings(SESSION_ROLLUPS={"SYNC": True}):
+            with self.captureOnCommitCallbacks(execute=True):
+                book(self.patient, nurse, make_slots(start, 1))
+        self.assertEqual(self.get_marked(), set())
+        self.assertTrue(SessionRollup.objects.filter(day=start.date()).exists())
+
+    def test_mark_sessions(self):
+        refresh_marked()
+        mark_sessions(Session.objects.filter(pk=self.sessions[1].pk))
+        self.assertEqual(self.get_marked(), {self.days[1]})
+
+    def test_patient_move_moves_its_city_rollups(self):
+        refresh_marked()
+        self.assertEqual(self.get_city_keys(), {"Cairo"})
+        self.patient.city = "Alexandria"
+        self.patient.save()
+        self.assertEqual(self.get_marked(), set(self.days))
+        refresh_marked()
+        self.assertEqual(self.get_city_keys(), {"Alexandria"})
+
+
+class SessionAnalyticsTests(TestCase):
+    query = "?dimension=city&start=2030-03-01&end=2030-04-01"
+
+    def setUp(self):
+        self.admin = create_admin(1)
+        self.patient = create_patient(1)
+        start = datetime.datetime(2030, 3, 4, 10, tzinfo=timezone.get_default_timezone())
+        book(self.patient, create_nurse(1), make_slots(start, 2))
+        refresh_marked()
+
+    def get(self, user, path, **headers):
+        return self.client.get(path, HTTP_AUTHORIZATION=make_token(user), **headers)
+
+    def test_totals_per_month(self):
+        response = self.get(self.admin, f"/analytics/sessions/{self.query}&interval=month")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "key": "Cairo",
+                    "period": "2030-03-01",
+                    "sessions": 2,
+                    "consumed_sessions": 0,
+                    "utilization": 0.0,
+                    "booked_amount": "200.00",
+                    "paid_amount": "0.00",
+                }
+            ],
+        )
+
+    def test_admins_only(self):
+        response = self.get(self.patient, f"/analytics/sessions/{self.query}")
+        self.assertEqual(response.status_code, 403)
+        response = self.get(self.patient, f"/analytics/sessions/chart/{self.query}")
+        self.assertEqual(response.status_code, 403)
+
+    def test_chart_is_revalidated(self):
+        response = self.get(self.admin, f"/analytics/sessions/chart/{self.query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        response = self.get(
+            self.admin,
+            f"/analytics/sessions/chart/{self.query}",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+def patient_row(number, **fields):
+    return {
+        "email": f"patient{number}@example.com",
+        "username": f"patient{number}",
+        "national_id": f"P{number}",
+        "first_name": f"Patient{number}",
+        "last_name": "Test",
+        "gender": "M",
+        "phone_number": "0100000000",
+        "nationality": "Egyptian",
+        "location": "Home",
+        "city": "Cairo",
+        "country": "Egypt",
+        "date_of_birth": "1990-01-01",
+        **fields,
+    }
+
+
+def to_csv(rows):
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fields)
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def to_ndjson(rows):
+    return "".join(
+        (row if isinstance(row, str) else json.dumps(row)) + "\n" for row in rows
+    )
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.admin = create_admin(1)
+        create_patient(1)
+
+    def import_rows(self, kind, text, file_format):
+        return self.client.post(
+            f"/bulk/import/{kind}/?file_format={file_format}",
+            data=text.encode(),
+            content_type="text/csv" if file_format == "csv" else "application/x-ndjson",
+            HTTP_AUTHORIZATION=make_token(self.admin),
+        )
+
+    def get_national_ids(self):
+        return set(
+            UserIdentity.objects.filter(identity=Identity.PATIENT).values_list(
+                "national_id", flat=True
+            )
+        )
+
+    def test_csv_with_duplicates_and_bad_rows(self):
+        rows = [
+            patient_row(2),
+            # taken by a patient in the database
+            patient_row(3, email="patient1@example.com"),
+            # taken by an earlier row of the file
+            patient_row(4, national_id="P2"),
+            patient_row(5, date_of_birth="yesterday"),
+            patient_row(6, password="s3cret-pass"),
+        ]
+        response = self.import_rows("patients", to_csv(rows), "csv")
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (2, 3))
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 3, 4])
+        self.assertEqual(list(report["errors"][0]["errors"]), ["email"])
+        self.assertEqual(list(report["errors"][1]["errors"]), ["national_id"])
+        self.assertEqual(list(report["errors"][2]["errors"]), ["date_of_birth"])
+        self.assertEqual(self.get_national_ids(), {"P1", "P2", "P6"})
+        patient = Patient.objects.get(national_id="P6")
+        self.assertEqual(patient.identity, Identity.PATIENT)
+        self.assertTrue(patient.check_password("s3cret-pass"))
+        self.assertFalse(Patient.objects.get(national_id="P2").has_usable_password())
+
+    def test_ndjson_with_duplicates_and_bad_rows(self):
+        lines = [
+            patient_row(2),
+            "{not json",
+            "[1, 2]",
+            "",
+            patient_row(3, username="patient2"),
+            patient_row(4, email="not-an-email"),
+            patient_row(5),
+        ]
+        response = self.import_rows("patients", to_ndjson(lines), "ndjson")
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (2, 4))
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 3, 5, 6])
+        self.assertIn("Invalid JSON", report["errors"][0]["errors"]["non_field_errors"][0])
+        self.assertEqual(list(report["errors"][2]["errors"]), ["username"])
+        self.assertEqual(self.get_national_ids(), {"P1", "P2", "P5"})
+
+    def test_conflicting_batch_is_inserted_row_by_row(self):
+        class RacingImporter(UserImporter):
+            def check_batch(self, valid):
+                checked = super().check_batch(valid)
+                # written by another client once the batch was checked
+                create_patient(3)
+                return checked
+
+        rows = [patient_row(2), patient_row(3), patient_row(4)]
+        importer = RacingImporter("patients").run(read_rows(to_csv(rows).splitlines(), "csv"))
+        self.assertEqual(importer.created, 2)
+        self.assertEqual([error["row"] for error in importer.errors], [2])
+        self.assertIn("non_field_errors", importer.errors[0]["errors"])
+        self.assertEqual(self.get_national_ids(), {"P1", "P2", "P3", "P4"})
+        self.assertEqual(Patient.objects.filter(national_id="P3").count(), 1)
+
+    def test_courses_are_linked_across_batches(self):
+        patient, nurse = Patient.objects.get(), create_nurse(1)
+        series = uuid.uuid4()
+        start = timezone.now() + datetime.timedelta(days=1)
+        rows = [
+            {
+                "patient": patient.pk,
+                "nurse": nurse.pk,
+                "session_type": "Physiotherapy",
+                "price": "100.00",
+                "paid_price": "0.00",
+                "total_sessions": 3,
+                "remaining_sessions": 3,
+                "place": "Home",
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "series": str(series),
+                "ordinal": ordinal,
+            }
+            # out of order, the links follow the ordinals
+            for ordinal, (start_time, end_time) in zip(
+                [3, 1, 2], make_slots(start, 3)
+            )
+        ]
+        rows.append({**rows[0], "patient": 999999, "ordinal": 4})
+        importer = get_importer("sessions", batch_size=2)
+        self.assertIsInstance(importer, SessionImporter)
+        importer.run(read_rows(to_ndjson(rows).splitlines(), "ndjson"))
+        self.assertEqual(importer.created, 3)
+        self.assertEqual([error["row"] for error in importer.errors], [4])
+        self.assertEqual(list(importer.errors[0]["errors"]), ["patient"])
+        sessions = list(Session.objects.chain(series))
+        self.assertEqual([session.ordinal for session in sessions], [1, 2, 3])
+        self.assertEqual(
+            [session.next_session_id for session in sessions],
+            [sessions[1].pk, sessions[2].pk, None],
+        )
+        self.assertEqual(
+            [session.prev_session_id for session in sessions],
+            [None, sessions[0].pk, sessions[1].pk],
+        )
+
+
+class BulkExportTests(TestCase):
+    def setUp(self):
+        self.admin = create_admin(1)
+        self.patients = [create_patient(number) for number in range(3)]
+
+    def export(self, kind, file_format):
+        response = self.client.get(
+            f"/bulk/export/{kind}/?file_format={file_format}",
+            HTTP_AUTHORIZATION=make_token(self.admin),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("patients", "csv"))))
+        self.assertEqual([row["national_id"] for row in rows], ["P0", "P1", "P2"])
+        self.assertNotIn("password", rows[0])
+
+    def test_ndjson_export_imports_back(self):
+        text = self.export("patients", "ndjson")
+        rows = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [patient.pk for patient in self.patients])
+        Patient.objects.all().delete()
+        importer = get_importer("patients").run(read_rows(text.splitlines(), "ndjson"))
+        self.assertEqual((importer.created, importer.errors), (3, []))
+
+    def test_non_admins_cannot_export(self):
+        response = self.client.get(
+            "/bulk/export/patients/", HTTP_AUTHORIZATION=make_token(self.patients[0])
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+        self.nurse = create_nurse(1)
+        start = timezone.now() + datetime.timedelta(days=1)
+        self.sessions = book(self.patient, self.nurse, make_slots(start, 3))
+
+    def get(self, path, **headers):
+        return self.client.get(path, HTTP_AUTHORIZATION=make_token(self.patient), **headers)
+
+    def test_unchanged_user_is_not_sent_again(self):
+        path = f"/users/patient/{self.patient.pk}/"
+        response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        response = self.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get(path, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        # another field selection is another representation
+        self.assertEqual(self.get(f"{path}?fields=id", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.patient.first_name = "Renamed"
+        self.patient.save()
+        response = self.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["first_name"], "Renamed")
+
+    def test_list_etag_changes_on_deletion(self):
+        response = self.get("/sessions/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertNotIn("Last-Modified", response)
+        self.assertEqual(self.get("/sessions/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # the latest updated_at stays, only the count tells
+        Session.objects.filter(pk=self.sessions[0].pk).delete()
+        response = self.get("/sessions/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        self.patient = create_patient(1)
+        self.entry = (Identity.PATIENT, self.patient.pk)
+
+    def get_first_name(self):
+        [data] = profile_cache.get_many([self.entry])
+        return data["first_name"]
+
+    def get_version(self):
+        return profile_cache._versions([self.entry])[self.entry]
+
+    def test_concurrent_misses_are_computed_once(self):
+        cache = ProfileCache(cache_alias="default")
+        release = threading.Event()
+        calls = []
+
+        def compute(entries, fields=None):
+            calls.append(entries)
+            release.wait(5)
+            return {entry: {"id": entry[1]} for entry in entries}
+
+        results = []
+        with mock.patch("users.profile_cache.get_user_representations", compute):
+            threads = [
+                threading.Thread(target=lambda: results.append(cache.get_many([self.entry])))
+                for _ in range(2)
+            ]
+            threads[0].start()
+            while not calls:
+                threading.Event().wait(0.01)
+            threads[1].start()
+            while not cache.stats()["coalesced"]:
+                threading.Event().wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[{"id": self.patient.pk}]] * 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_save_invalidates(self):
+        self.assertEqual(self.get_first_name(), "Patient1")
+        # no signal, the cached representation is served
+        Patient.objects.filter(pk=self.patient.pk).update(first_name="Updated")
+        self.assertEqual(self.get_first_name(), "Patient1")
+        self.patient.first_name = "Saved"
+        self.patient.save()
+        self.assertEqual(self.get_first_name(), "Saved")
+
+    def test_commit_invalidates_again(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.patient.first_name = "Saved"
+            self.patient.save()
+            # what a concurrent read caches before the commit
+            version = self.get_version()
+            self.get_first_name()
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.get_version(), version)
+
+    def test_evicted_version_drops_every_entry(self):
+        self.assertEqual(self.get_first_name(), "Patient1")
+        version = self.get_version()
+        Patient.objects.filter(pk=self.patient.pk).update(first_name="Updated")
+        profile_cache.cache.delete(profile_cache._version_key(*self.entry))
+        self.assertEqual(self.get_first_name(), "Updated")
+        self.assertNotEqual(self.get_version(), version)
+
+
+class ProjectionParityTests(TestCase):
+    """
+    `.values()` projections rendered with orjson give the bytes of the DRF
+    serializers rendered by JSONRenderer.
+    """
+
+    def setUp(self):
+        self.request = RequestFactory().get("/")
+        patient = create_patient(
+            1, bio="Ünïcode \u2028 line", latitude=30.0444, longitude=31.2357
+        )
+        nurse = create_nurse(
+            1, session_price=Decimal("150.50"), profile_image="profile_images/nurse.png"
+        )
+        start = timezone.now() + datetime.timedelta(days=1)
+        book(patient, nurse, make_slots(start, 3), price="99.90")
+
+    def assert_same_bytes(self, serializer_class, queryset):
+        instances = list(queryset.order_by("pk"))
+        expected = JSONRenderer().render(
+            serializer_class(instances, many=True, context={"request": self.request}).data
+        )
+        projection = get_projection(serializer_class)
+        rows = projection.values(queryset.order_by("pk"))
+        rendered = FastJSONRenderer().render(projection.represent(rows, self.request))
+        self.assertEqual(rendered, expected)
+
+    def test_sessions(self):
+        self.assert_same_bytes(SessionSerializer, Session.objects.all())
+
+    def test_patients(self):
+        self.assert_same_bytes(PatientSerializer, Patient.objects.all())
+
+    def test_nurses(self):
+        self.assert_same_bytes(NurseSerializer, Nurse.objects.all())
+
+
+class SchemaArtifactTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_prebuilt_gzip_variants_are_served(self):
+        write_schema(self.directory)
+        artifacts = load_artifacts(self.directory)
+        self.assertEqual(gzip.decompress(artifacts["json"].gzipped), artifacts["json"].body)
+        # read back from the file, not compressed again
+        prebuilt = gzip.compress(b"prebuilt", mtime=0)
+        (self.directory / "schema.yaml.gz").write_bytes(prebuilt)
+        self.assertEqual(load_artifacts(self.directory)["yaml"].gzipped, prebuilt)
+
+
+class NearbyNurseTests(TestCase):
+    def test_box_across_the_antimeridian(self):
+        east = create_nurse(1, latitude=0.0, longitude=179.9)
+        west = create_nurse(2, latitude=0.0, longitude=-179.9)
+        create_nurse(3, latitude=0.0, longitude=0.0)
+        for longitude in [179.95, -179.95]:
+            nurses = Nurse.objects.within_box(0.0, longitude, 50)
+            self.assertEqual(set(nurses), {east, west})
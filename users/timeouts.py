@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def limit_request_statements(timeout=None):
+    """
+    Cancel the statements of this process running longer than `timeout`
+    milliseconds (REQUEST_STATEMENT_TIMEOUT_MS by default) on every
+    PostgreSQL database.
+
+    Only called by the WSGI and ASGI entry points: migrations, index builds,
+    management commands and job workers run without a timeout. The limit is
+    a startup option of new connections, it costs no query per request.
+    """
+    if timeout is None:
+        timeout = getattr(settings, "REQUEST_STATEMENT_TIMEOUT_MS", 0)
+    if not timeout:
+        return
+    for alias in connections:
+        settings_dict = connections.settings[alias]
+        if connections[alias].vendor != "postgresql":
+            continue
+        options = settings_dict.get("OPTIONS", {})
+        startup = f"{options.get('options', '')} -c statement_timeout={int(timeout)}"
+        # replicas share the OPTIONS dict of the primary, each gets its own
+        settings_dict["OPTIONS"] = {**options, "options": startup.strip()}
+
+
+@contextmanager
+def no_statement_timeout(using=DEFAULT_DB_ALIAS):
+    """
+    Lift the statement timeout of the `using` connection for the enclosed
+    block, e.g. a bulk export streamed by a request.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SET statement_timeout = 0")
+    try:
+        yield
+    finally:
+        # back to the startup option, before the connection is reused
+        with connection.cursor() as cursor:
+            cursor.execute("RESET statement_timeout")
@@ -1,201 +1,741 @@
-# from rest_framework.response import Response
-# from rest_framework.exceptions import AuthenticationFailed
-# from .serializers import UserSerializer
-# from .models import User
-# import jwt, datetime
-# from rest_framework import status
-# from rest_framework import viewsets, pagination
-
-
-# class RegisterView(viewsets.ModelViewSet):
-#     """
-#     Create a new user.
-#     """
-
-#     queryset = User.objects.none()
-#     serializer_class = UserSerializer
-
-#     def create(self, request):
-#         serializer = self.serializer_class(data=request.data)
-#         serializer.is_valid(raise_exception=True)
-#         serializer.save()
-#         return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-
-# class LoginView(viewsets.ModelViewSet):
-#     """
-#     User Login.
-#     """
-
-#     queryset = User.objects.all()
-#     serializer_class = UserSerializer
-
-#     def login(self, request):
-#         """
-#         User Login.
-
-#         Returns:
-#             {"jwt": token} in json format and in cookie.
-#         """
-#         email = request.data["email"]
-#         password = request.data["password"]
-
-#         user = self.get_queryset().filter(email=email).first()
-
-#         if user is None:
-#             raise AuthenticationFailed("User not found!")
-
-#         if not user.check_password(password):
-#             raise AuthenticationFailed("Incorrect password!")
-
-#         payload = {
-#             "id": user.id,
-#             "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=180),
-#             "iat": datetime.datetime.utcnow(),
-#         }
-
-#         token = jwt.encode(payload, "secret", algorithm="HS256")
-
-#         response = Response()
-
-#         response.set_cookie(key="jwt", value=token, httponly=True)
-#         response.data = {"jwt": token}
-#         return response
-
-
-# class UserView(viewsets.ModelViewSet):
-#     """
-#     Check Authentication and Retrieve User.
-#     """
-
-#     queryset = User.objects.all()
-#     serializer_class = UserSerializer
-
-#     def retrieve(self, request):
-#         """
-#         Retrieve Login User data after checking authentication.
-#         """
-#         user = request.user
-#         serializer = self.serializer_class(user)
-#         return Response(serializer.data)
-
-
-# class LogoutView(viewsets.ModelViewSet):
-#     """
-#     User Logout and Delete Cookie.
-#     """
-
-#     queryset = User.objects.all()
-#     serializer_class = UserSerializer
-
-#     def logout(self, request):
-#         """
-#         User Logout and Delete Cookie.
-
-#         Note: request body is not required.
-#         """
-#         response = Response()
-#         response.delete_cookie("jwt")
-#         response.data = {"message": "success"}
-#         return response
-
-
-# class UserViewSet(viewsets.ModelViewSet):
-#     """
-#     User CRUD
-#     """
-
-#     queryset = User.objects.all()
-#     serializer_class = UserSerializer
-
-#     def list(self, request):
-#         """
-#         List Users.
-#         """
-
-#         user = self.get_queryset()
-#         serializer = self.serializer_class(user, many=True)
-#         return Response(serializer.data)
-
-#     def retrieve(self, request, pk):
-#         """
-#         Retrieve user by id.
-#         """
-
-#         user = self.get_queryset().filter(id=pk).first()
-#         serializer = self.serializer_class(user)
-#         return Response(serializer.data)
-
-#     def update(self, request, pk):
-#         """
-#         Update User.
-#         """
-#         user = self.get_queryset().filter(id=pk).first()
-#         if user is not None:
-#             if request.user.id != user.id:
-#                 return Response(
-#                     "You are not authorized to update this data",
-#                     status=status.HTTP_403_FORBIDDEN,
-#                 )
-#         serializer = self.serializer_class(user, data=request.data)
-#         serializer.is_valid(raise_exception=True)
-#         serializer.save()
-#         return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-#     def destroy(self, request, pk):
-#         """
-#         Delete User.
-#         """
-#         user = self.get_queryset().filter(id=pk).first()
-#         if user is not None:
-#             if request.user.id != user.id:
-#                 return Response(
-#                     "You are not authorized to delete this user",
-#                     status=status.HTTP_403_FORBIDDEN,
-#                 )
-#         user.delete()
-#         return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-# class UserPagination(pagination.PageNumberPagination):
-#     """
-#     Pagination class for User objects.
-
-#     This class defines the page size for paginated responses.
-
-#     Attributes:
-#         page_size (int): The number of users to display per page.
-#             Default is 10.
-#     """
-
-#     page_size = 10
-
-
-# class UserSearch(viewsets.ModelViewSet):
-#     """
-#     Search Users and list them by pagination pages.
-#     """
-
-#     queryset = User.objects.all()
-#     serializer_class = UserSerializer
-#     pagination_class = UserPagination
-
-#     def list(self, request, string):
-#         """
-#         Search users and list them by pagination pages(10 by 10).
-
-#         Note: the input string search can be near from the actual string.
-#         """
-
-#         queryset = (
-#             self.get_queryset().filter(name__icontains=string)
-#             | self.get_queryset().filter(name__trigram_similar=string)
-#             | self.get_queryset().filter(name__unaccent=string)
-#         )
-#         page = self.paginate_queryset(queryset)
-#         if page is not None:
-#             serializer = self.get_serializer(page, many=True)
-#             return self.get_paginated_response(serializer.data)
-
-#         serializer = self.get_serializer(queryset, many=True)
-#         return Response(serializer.data)
+from rest_framework.response import Response
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
+from rest_framework.permissions import IsAuthenticated
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    PolymorphicProxySerializer,
+    extend_schema,
+    inline_serializer,
+)
+from rest_framework import serializers
+from .serializers import (
+    ArchivedSessionSerializer,
+    AvailabilityWindowSerializer,
+    BookSeriesSerializer,
+    CalendarRangeSerializer,
+    ConsumeSessionSerializer,
+    FreeIntervalSerializer,
+    NurseMatchQuerySerializer,
+    NurseMatchSerializer,
+    NurseScheduleSerializer,
+    NurseSerializer,
+    SeriesStateSerializer,
+    SessionRollupQuerySerializer,
+    SessionRollupSerializer,
+    SessionSerializer,
+    USER_SERIALIZERS,
+)
+from .models import (
+    IDENTITY_MODELS,
+    ArchivedSession,
+    BookingConflict,
+    Identity,
+    Nurse,
+    Session,
+    UserIdentity,
+)
+from .middleware import get_request_token, revoke_token
+from .bulk import BULK_KINDS, FORMATS, decode_lines, export_rows, get_importer, read_rows
+from .search import InvalidCursor, SearchQuery
+from .pagination import SessionCursorPagination, UserCursorPagination
+from .projections import get_fieldset, get_projection
+from .conditional import Validators
+from .profile_cache import profile_cache
+from .rollups import get_rollup_setting, get_rollups, get_totals, render_chart
+from .auth_cache import principal_cache
+from .availability import free_intervals
+from .matching import match_nurses
+import jwt, datetime, uuid
+from rest_framework import status
+from rest_framework import mixins, viewsets
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_user_schema(many=False):
+    """
+    Schema of users of any identity, told apart by their `identity`.
+    """
+    return PolymorphicProxySerializer(
+        component_name="User",
+        serializers={
+            identity.value: serializer
+            for identity, serializer in USER_SERIALIZERS.items()
+        },
+        resource_type_field_name="identity",
+        many=many,
+    )
+
+
+class RegisterView(viewsets.ViewSet):
+    """
+    Create a new user.
+    """
+
+    @extend_schema(request=get_user_schema(), responses={201: get_user_schema()})
+    def create(self, request):
+        serializer_class = USER_SERIALIZERS.get(request.data.get("identity"))
+        if serializer_class is None:
+            raise ValidationError({"identity": "Invalid identity."})
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+def create_token(user):
+    """
+    Signed JWT of `user`, valid for 3 hours.
+    """
+    payload = {
+        "id": user.id,
+        "identity": user.identity,
+        "jti": uuid.uuid4().hex,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=180),
+        "iat": datetime.datetime.utcnow(),
+    }
+    return jwt.encode(payload, "secret", algorithm="HS256")
+
+
+class LoginView(viewsets.ViewSet):
+    """
+    User Login.
+    """
+
+    @extend_schema(
+        request=inline_serializer(
+            "Login",
+            {"email": serializers.EmailField(), "password": serializers.CharField()},
+        ),
+        responses=inline_serializer("Token", {"jwt": serializers.CharField()}),
+    )
+    def login(self, request):
+        """
+        User Login.
+
+        Returns:
+            {"jwt": token} in json format and in cookie.
+        """
+        email = request.data["email"]
+        password = request.data["password"]
+
+        user = UserIdentity.objects.get_user(email=email)
+
+        if user is None:
+            raise AuthenticationFailed("User not found!")
+
+        if not user.check_password(password):
+            raise AuthenticationFailed("Incorrect password!")
+
+        token = create_token(user)
+
+        response = Response()
+
+        response.set_cookie(key="jwt", value=token, httponly=True)
+        response.data = {"jwt": token}
+        return response
+
+
+class UserView(viewsets.ViewSet):
+    """
+    Check Authentication and Retrieve User.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses=get_user_schema())
+    def retrieve(self, request):
+        """
+        Retrieve Login User data after checking authentication.
+        """
+        user = request.user
+        serializer = USER_SERIALIZERS[user.identity](user)
+        return Response(serializer.data)
+
+
+class LogoutView(viewsets.ViewSet):
+    """
+    User Logout and Delete Cookie.
+    """
+
+    @extend_schema(
+        request=None,
+        responses=inline_serializer("Logout", {"message": serializers.CharField()}),
+    )
+    def logout(self, request):
+        """
+        User Logout and Delete Cookie.
+
+        Note: request body is not required.
+        """
+        token = get_request_token(request)
+        if token:
+            revoke_token(token)
+
+        response = Response()
+        response.delete_cookie("jwt")
+        response.data = {"message": "success"}
+        return response
+
+
+# identity names used in user urls, e.g. users/nurse/5/
+IDENTITY_NAMES = {label.lower(): value for value, label in Identity.choices}
+
+
+class UserViewSet(viewsets.GenericViewSet):
+    """
+    User CRUD
+    """
+
+    queryset = UserIdentity.objects.only("id", "identity", "user_id")
+    permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
+
+    def get_user(self, identity, pk):
+        model = IDENTITY_MODELS.get(IDENTITY_NAMES.get(identity))
+        if model is None:
+            raise NotFound()
+        return get_object_or_404(model, pk=pk)
+
+    @extend_schema(responses=get_user_schema(many=True))
+    def list(self, request):
+        """
+        List Users by cursor pages, ?fields=id,first_name,profile_image
+        returns and selects only these fields.
+        """
+
+        fields, _ = get_fieldset(request, USER_SERIALIZERS.values())
+        page = self.paginate_queryset(self.get_queryset())
+        data = profile_cache.get_many(
+            ((entry.identity, entry.user_id) for entry in page), fields=fields
+        )
+        return self.get_paginated_response(data)
+
+    @extend_schema(responses=get_user_schema())
+    def retrieve(self, request, identity, pk):
+        """
+        Retrieve user by identity and id, ?fields= as in list.
+
+        Conditional: polls repeating the ETag (If-None-Match) or date
+        (If-Modified-Since) of the last response get a 304 after a single
+        primary key lookup.
+        """
+
+        identity = IDENTITY_NAMES.get(identity)
+        if identity is None:
+            raise NotFound()
+        fields, _ = get_fieldset(request, [USER_SERIALIZERS[identity]])
+        updated_at = (
+            IDENTITY_MODELS[identity]
+            .objects.filter(pk=pk)
+            .values_list("updated_at", flat=True)
+            .first()
+        )
+        if updated_at is None:
+            raise NotFound()
+        validators = Validators(updated_at, identity, pk, profile_cache.variant(fields))
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        users = profile_cache.get_many([(identity, pk)], fields=fields)
+        if not users:
+            raise NotFound()
+        return validators.patch(Response(users[0]))
+
+    @extend_schema(request=get_user_schema(), responses=get_user_schema())
+    def update(self, request, identity, pk):
+        """
+        Update User.
+        """
+        user = self.get_user(identity, pk)
+        if request.user != user:
+            return Response(
+                "You are not authorized to update this data",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        serializer = USER_SERIALIZERS[user.identity](user, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    @extend_schema(responses={204: None})
+    def destroy(self, request, identity, pk):
+        """
+        Delete User.
+        """
+        user = self.get_user(identity, pk)
+        if request.user != user:
+            return Response(
+                "You are not authorized to delete this user",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        user.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SessionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    List sessions of the logged in user by cursor pages, in calendar order.
+
+    With ?archived=1 lists and courses are read from the archive of
+    completed courses instead, see users.partitions.
+    """
+
+    serializer_class = SessionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = SessionCursorPagination
+
+    def get_participant_filters(self):
+        """
+        Restrict patients and nurses to their own sessions, admins see all.
+        """
+        user = self.request.user
+        if user.identity == Identity.PATIENT:
+            return {"patient": user}
+        if user.identity == Identity.Nurse:
+            return {"nurse": user}
+        return {}
+
+    @property
+    def archived(self):
+        return self.request.query_params.get("archived") in ("1", "true")
+
+    def get_queryset(self):
+        model = ArchivedSession if self.archived else Session
+        return model.objects.filter(**self.get_participant_filters())
+
+    def get_serializer_class(self):
+        if self.archived:
+            return ArchivedSessionSerializer
+        return super().get_serializer_class()
+
+    def get_projection(self):
+        """
+        Projection of the sessions for ?fields= and ?expand=, e.g.
+        ?fields=id,start_time,nurse.first_name&expand=nurse
+        """
+        serializer_class = self.get_serializer_class()
+        fields, expand = get_fieldset(self.request, [serializer_class])
+        return get_projection(serializer_class, fields, expand)
+
+    def get_validators(self, queryset, projection):
+        """
+        Validators of a list of sessions as the current user sees it.
+        """
+        user = self.request.user
+        return Validators.for_queryset(
+            queryset,
+            user.identity,
+            user.pk,
+            self.request.get_full_path(),
+            related=[name for name, *_ in projection.expanded],
+        )
+
+    def list(self, request):
+        """
+        List sessions from `.values()` rows, see users.projections.
+
+        Conditional like user retrieval: a calendar that didn't change
+        since the last poll costs one aggregate over the index range.
+        """
+        projection = self.get_projection()
+        queryset = self.filter_queryset(self.get_queryset())
+        validators = self.get_validators(queryset, projection)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        page = self.paginate_queryset(
+            projection.values(queryset, *self.paginator.ordering)
+        )
+        response = self.get_paginated_response(projection.represent(page, request))
+        return validators.patch(response)
+
+    def filter_queryset(self, queryset):
+        """
+        Calendar range of the list, e.g. ?start=2024-07-01T00:00Z&end=2024-08-01T00:00Z
+        served by the (patient, start_time) and (nurse, start_time) indexes.
+        """
+        params = CalendarRangeSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        if "start" in params.validated_data:
+            queryset = queryset.filter(start_time__gte=params.validated_data["start"])
+        if "end" in params.validated_data:
+            queryset = queryset.filter(start_time__lt=params.validated_data["end"])
+        return queryset
+
+    def series(self, request, series):
+        """
+        List a whole treatment course in order.
+        """
+        projection = self.get_projection()
+        queryset = self.get_queryset().chain(series)
+        validators = self.get_validators(queryset, projection)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        sessions = projection.values(queryset)
+        return validators.patch(Response(projection.represent(sessions, request)))
+
+    def consume(self, request, series):
+        """
+        Consume one session of a treatment course and record its payment.
+
+        Safe under concurrent check-ins: the counters are changed by one
+        conditional update that also returns the new state.
+        """
+        serializer = ConsumeSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        state = Session.objects.consume(
+            series,
+            serializer.validated_data["paid_price"],
+            **self.get_participant_filters(),
+        )
+        if state is None:
+            if not self.get_queryset().filter(series=series).exists():
+                raise NotFound()
+            return Response(
+                "No remaining sessions in this course",
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(SeriesStateSerializer(state).data)
+
+    def book(self, request):
+        """
+        Book a treatment course: one session per slot, linked in order.
+        """
+        serializer = BookSeriesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        data = serializer.validated_data
+        if user.identity != Identity.ADMIN and user not in (data["patient"], data["nurse"]):
+            return Response(
+                "You are not authorized to book sessions for other users",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            sessions = serializer.save()
+        except BookingConflict as exc:
+            return Response(str(exc), status=status.HTTP_409_CONFLICT)
+        serializer = self.get_serializer(sessions, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NurseScheduleView(viewsets.ViewSet):
+    """
+    Weekly working slots and exceptions of the logged in nurse.
+    """
+
+    serializer_class = NurseScheduleSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_nurse(self, request):
+        if request.user.identity != Identity.Nurse:
+            raise PermissionDenied("Only nurses have a schedule.")
+        return request.user
+
+    def retrieve(self, request):
+        """
+        Retrieve the schedule.
+        """
+        serializer = NurseScheduleSerializer(self.get_nurse(request))
+        return Response(serializer.data)
+
+    def update(self, request):
+        """
+        Replace the whole schedule.
+        """
+        serializer = NurseScheduleSerializer(self.get_nurse(request), data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+
+class AvailableNurseViewSet(viewsets.GenericViewSet):
+    """
+    Find nurses free during a time window and rank nurses for patients.
+    """
+
+    serializer_class = NurseSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
+
+    def get_window(self, request):
+        window = AvailabilityWindowSerializer(data=request.query_params)
+        window.is_valid(raise_exception=True)
+        return window.validated_data
+
+    def list(self, request):
+        """
+        List nurses free for the whole window, optionally in a city and
+        with a specialization, e.g.
+        ?start_time=2024-07-02T14:00Z&end_time=2024-07-02T15:00Z&city=Cairo
+        """
+        window = self.get_window(request)
+        queryset = Nurse.objects.available_between(
+            window["start_time"], window["end_time"]
+        )
+        if "city" in window:
+            queryset = queryset.filter(city=window["city"])
+        if "specialization" in window:
+            queryset = queryset.filter(specialization=window["specialization"])
+
+        fields, _ = get_fieldset(request, [self.serializer_class])
+        projection = get_projection(self.serializer_class, fields)
+        page = self.paginate_queryset(
+            projection.values(queryset, *self.paginator.ordering)
+        )
+        return self.get_paginated_response(projection.represent(page, request))
+
+    def match(self, request):
+        """
+        Rank the best nurses near a patient, by distance, specialization,
+        availability during the optional window and price, e.g.
+        ?latitude=30.04&longitude=31.23&radius_km=10&specialization=Pediatrics
+        """
+        query = NurseMatchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        nurses = match_nurses(
+            params["latitude"],
+            params["longitude"],
+            params["radius_km"],
+            specialization=params.get("specialization"),
+            start=params.get("start_time"),
+            end=params.get("end_time"),
+            limit=params["limit"],
+        )
+        serializer = NurseMatchSerializer(nurses, many=True)
+        return Response(serializer.data)
+
+    def free(self, request, pk):
+        """
+        List the free intervals of a nurse within the window.
+        """
+        window = self.get_window(request)
+        nurse = get_object_or_404(Nurse, pk=pk)
+        intervals = free_intervals(nurse, window["start_time"], window["end_time"])
+        serializer = FreeIntervalSerializer(
+            [{"start_time": start, "end_time": end} for start, end in intervals],
+            many=True,
+        )
+        return Response(serializer.data)
+
+
+class UserSearch(viewsets.ViewSet):
+    """
+    Search Users and list them by cursor pages.
+    """
+
+    @extend_schema(
+        responses=inline_serializer(
+            "UserSearchPage",
+            {
+                "next": serializers.URLField(allow_null=True),
+                "results": get_user_schema(many=True),
+            },
+        )
+    )
+    def list(self, request, string):
+        """
+        Search users and list them by cursor pages(10 by 10), best matches first.
+
+        Note: the input string search can be near from the actual string.
+        """
+        try:
+            query = SearchQuery(string, cursor=request.query_params.get("cursor"))
+        except InvalidCursor as exc:
+            raise ValidationError({"cursor": str(exc)})
+
+        fields, _ = get_fieldset(request, USER_SERIALIZERS.values())
+        entries, next_cursor = query.page_entries()
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", next_cursor
+            )
+        results = profile_cache.get_many(entries, fields=fields)
+        return Response({"next": next_url, "results": results})
+
+
+class BulkViewSet(viewsets.ViewSet):
+    """
+    Admin only bulk import and export of patients, nurses, admins and sessions.
+    """
+
+    permission_classes = [IsAuthenticated]
+    content_types = {
+        "csv": "text/csv; charset=utf-8",
+        "ndjson": "application/x-ndjson",
+    }
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.user.identity != Identity.ADMIN:
+            raise PermissionDenied("Only admins can import or export data.")
+        if kwargs["kind"] not in BULK_KINDS:
+            raise NotFound(f"Nothing to import or export as {kwargs['kind']!r}.")
+
+    def perform_content_negotiation(self, request, force=False):
+        # exports are CSV or NDJSON whatever the Accept header asks for
+        return super().perform_content_negotiation(request, force=True)
+
+    def get_file_format(self, request):
+        file_format = request.query_params.get("file_format", "csv")
+        if file_format not in FORMATS:
+            raise ValidationError({"file_format": f"Expected one of {', '.join(FORMATS)}."})
+        return file_format
+
+    @extend_schema(
+        request={
+            "multipart/form-data": inline_serializer(
+                "BulkImportFile", {"file": serializers.FileField()}
+            ),
+            "text/csv": OpenApiTypes.STR,
+            "application/x-ndjson": OpenApiTypes.STR,
+        },
+        responses=inline_serializer(
+            "BulkImportReport",
+            {
+                "created": serializers.IntegerField(),
+                "failed": serializers.IntegerField(),
+                "errors": serializers.ListField(child=serializers.DictField()),
+            },
+        ),
+    )
+    def import_rows(self, request, kind):
+        """
+        Import rows from a multipart `file` or from the raw request body,
+        in CSV (with a header line) or NDJSON (?file_format=ndjson).
+
+        Valid rows are created, the others are reported by row number.
+        """
+        file_format = self.get_file_format(request)
+        if request.content_type.startswith("multipart/form-data"):
+            stream = request.FILES.get("file")
+            if stream is None:
+                raise ValidationError({"file": "No file was submitted."})
+        else:
+            stream = request.stream or []
+
+        importer = get_importer(kind).run(read_rows(decode_lines(stream), file_format))
+        return Response(importer.report(max_errors=1000))
+
+    @extend_schema(
+        responses={
+            (200, content_type): OpenApiTypes.STR
+            for content_type in content_types.values()
+        }
+    )
+    def export_rows(self, request, kind):
+        """
+        Stream every row as CSV or NDJSON (?file_format=ndjson).
+        """
+        file_format = self.get_file_format(request)
+        response = StreamingHttpResponse(
+            export_rows(kind, file_format), content_type=self.content_types[file_format]
+        )
+        response["Content-Disposition"] = f'attachment; filename="{kind}.{file_format}"'
+        return response
+
+
+class CacheStatsView(viewsets.ViewSet):
+    """
+    Hit ratios and counters of the caches of the worker process serving
+    the request, for admins.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses=inline_serializer(
+            "CacheStats",
+            {
+                "profiles": serializers.DictField(),
+                "principals": serializers.DictField(),
+            },
+        )
+    )
+    def list(self, request):
+        if request.user.identity != Identity.ADMIN:
+            raise PermissionDenied("Only admins can read cache statistics.")
+        return Response(
+            {
+                "profiles": profile_cache.stats(),
+                "principals": principal_cache.stats(),
+            }
+        )
+
+
+class SessionAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Session totals per nurse, patient city or session type over days or
+    months, read from the rollups only, for admins.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_rollups(self, request):
+        if request.user.identity != Identity.ADMIN:
+            raise PermissionDenied("Only admins can read session analytics.")
+        params = SessionRollupQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+        rollups = get_rollups(
+            query["dimension"], query["start"], query["end"], query.get("key")
+        )
+        # the query string selects the representation
+        validators = Validators.for_queryset(rollups, request.get_full_path())
+        return query, rollups, validators
+
+    @extend_schema(
+        parameters=[SessionRollupQuerySerializer],
+        responses=SessionRollupSerializer(many=True),
+    )
+    def list(self, request):
+        """
+        Totals per key, e.g. ?dimension=city&start=2024-01-01&end=2025-01-01&interval=month
+        """
+        query, rollups, validators = self.get_rollups(request)
+        response = validators.not_modified(request)
+        if response is not None:
+            return response
+        totals = get_totals(rollups, query["interval"])
+        return validators.patch(
+            Response(SessionRollupSerializer(totals, many=True).data)
+        )
+
+    @extend_schema(
+        parameters=[SessionRollupQuerySerializer],
+        responses={(200, "image/png"): OpenApiTypes.BINARY},
+    )
+    def chart(self, request):
+        """
+        PNG chart of one metric of the totals (?metric=, paid_amount by
+        default), rendered once for each state of its rollups.
+        """
+        query, rollups, validators = self.get_rollups(request)
+        response = validators.not_modified(request)
+        if response is not None:
+            return response
+        # the ETag changes with the rollups, older charts are never read again
+        key = f"session_rollup_chart:{validators.etag[3:-1]}"
+        png = cache.get(key)
+        if png is None:
+            png = render_chart(
+                get_totals(rollups, query["interval"]),
+                query["metric"],
+                title=f"{query['metric']} per {query['dimension']}, "
+                f"{query['start']} to {query['end']}",
+            )
+            cache.set(key, png, get_rollup_setting("CHART_TTL"))
+        return validators.patch(HttpResponse(png, content_type="image/png"))